@@ -81,10 +81,18 @@ async def is_bible_question(
             temperature=0.0,
             max_tokens=24,
             model=model,
+            cache=True,
+            stage="gate",
         )
     except Exception:
         try:
-            answer = await llm.chat(classifier_messages, temperature=0.0, max_tokens=24)
+            answer = await llm.chat(
+                classifier_messages,
+                temperature=0.0,
+                max_tokens=24,
+                cache=True,
+                stage="gate",
+            )
         except Exception:
             return False
 
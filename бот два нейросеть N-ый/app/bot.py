@@ -5,9 +5,12 @@ import ipaddress
 import logging
 import re
 import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
 from urllib.parse import urlparse
 
-from telegram import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram import KeyboardButton, Message, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
 from telegram.constants import ChatAction
 from telegram.ext import (
     Application,
@@ -16,12 +19,33 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 from app.bible_gate import RULE_VIOLATION_TEXT, is_bible_question
-from app.config import load_settings
-from app.llm_client import LLMClient
-from app.pipeline import run_pipeline
+from app.cassette import CassetteSettings, configure_cassette
+from app.chat_summary import fold_exchange
+from app.config import Settings, load_settings
+from app.http_pool import PoolSettings, close_clients, configure_pool, http2_available
+from app.llm_cache import CacheSettings, ResponseCache
+from app.llm_client import LLMClient, LLMUsage, coalescing_stats as llm_coalescing_stats
+from app.model_health import HealthSettings, configure_health, get_health
+from app.pipeline import HedgePolicy, PipelineResult, run_pipeline
+from app.prompt_budget import BudgetSettings, configure_budget
+from app.rate_limit import LimiterSettings, configure_limits
+from app.scheduler import FairScheduler, SchedulerFull, SchedulerSettings
 from app.storage import BotStorage
+from app.tracing import (
+    TraceSettings,
+    configure_tracing,
+    format_trace,
+    recent_traces,
+    set_attribute,
+    span,
+    start_trace,
+)
+from app.update_processor import ChatOrderedUpdateProcessor
+from app.web_search import coalescing_stats as search_coalescing_stats, configure_search
+from app.webhook import WebhookSettings, serve as serve_webhook
 
 
 BOT_TITLE = "Православие простым языком"
@@ -86,6 +110,13 @@ MODEL_PRESET_BY_BUTTON = {
     MODEL_MISTRAL_BUTTON: "mistral_24b",
 }
 
+# Priors for the "answers left" estimate until answer_usage has measured data for a mode.
+DEFAULT_ANSWER_COST = {
+    "fast": (2.0, 1500.0),
+    "balanced": (7.0, 7000.0),
+    "deep": (8.0, 11000.0),
+}
+
 MODEL_BY_PRESET = {
     "router_free": "openrouter/free",
     "qwen_4b": "qwen/qwen3-4b:free",
@@ -93,6 +124,9 @@ MODEL_BY_PRESET = {
     "mistral_24b": "mistralai/mistral-small-3.1-24b-instruct:free",
 }
 
+# Fast-mode questions up to this length jump the pipeline queue (see app.scheduler).
+SHORT_QUESTION_CHARS = 200
+
 
 logging.basicConfig(
     format="%(asctime)s %(levelname)s %(name)s: %(message)s",
@@ -156,17 +190,40 @@ def _normalize_name(raw: str) -> str | None:
     return cleaned
 
 
-def _format_context(history: list[tuple[str, str]], window: int) -> str:
-    if not history:
-        return ""
-
+def _format_context(summary: str, last_exchange: tuple[str, str] | None) -> str:
     rows: list[str] = []
-    for idx, (question, answer) in enumerate(history[-window:], start=1):
-        answer_short = answer.strip().replace("\n", " ")[:300]
-        rows.append(f"{idx}) Вопрос: {question}\nОтвет: {answer_short}")
+    if summary:
+        rows.append(f"Ранее в разговоре:\n{summary}")
+    if last_exchange is not None:
+        question, answer = last_exchange
+        answer_short = answer.strip().replace("\n", " ")[:600]
+        rows.append(f"Последний вопрос: {question}\nОтвет: {answer_short}")
     return "\n\n".join(rows)
 
 
+def _remember_exchange(storage: BotStorage, settings: Settings, chat_id: int, question: str, answer: str) -> None:
+    # The exchange being replaced as "last" is folded into the summary; older chats are folded whole once.
+    if settings.history_window > 1:
+        summary = storage.get_chat_summary(chat_id=chat_id)
+        pending = storage.get_short_memory(chat_id=chat_id, window=1 if summary else settings.history_window)
+        for previous_question, previous_answer in pending:
+            summary = fold_exchange(
+                summary,
+                previous_question,
+                previous_answer,
+                max_turns=settings.history_window - 1,
+                max_chars=settings.summary_max_chars,
+            )
+        if pending:
+            storage.set_chat_summary(chat_id=chat_id, summary=summary)
+    storage.append_short_memory(
+        chat_id=chat_id,
+        question=question,
+        answer=answer,
+        window=settings.history_window,
+    )
+
+
 def _denomination_label(value: str) -> str:
     return "Католик" if value == "catholic" else "Православный"
 
@@ -215,6 +272,35 @@ def _selected_model(default_model: str, preset: str) -> tuple[str, list[str]]:
     return selected, [selected, selected, selected, selected]
 
 
+def _is_openrouter(base_url: str) -> bool:
+    host = (urlparse(base_url.strip()).hostname or "").lower()
+    return host == "openrouter.ai" or host.endswith(".openrouter.ai")
+
+
+def _fallback_models(base_url: str, base_model: str, configured: list[str]) -> list[str]:
+    candidates = configured
+    if not candidates and _is_openrouter(base_url):
+        # Preset ids are OpenRouter names; a personal or local endpoint would fail every one of them.
+        candidates = list(MODEL_BY_PRESET.values())
+    return list(dict.fromkeys([base_model.strip() or "openrouter/free", *candidates]))
+
+
+def _estimate_answers_left(remaining_calls: int, remaining_tokens: int | None, cost: tuple[float, float]) -> int:
+    avg_calls, avg_tokens = cost
+    estimate = int(remaining_calls // max(avg_calls, 1.0))
+    if remaining_tokens is not None and avg_tokens > 0:
+        estimate = min(estimate, int(remaining_tokens // avg_tokens))
+    return max(estimate, 0)
+
+
+def _circuit_state_label(value: str) -> str:
+    return {
+        "closed": "работает",
+        "open": "временно отключена",
+        "half_open": "проверяется",
+    }.get(value, value)
+
+
 def _progress_bar(percent: int, width: int = 20) -> str:
     safe = max(0, min(100, percent))
     filled = int(round((safe / 100) * width))
@@ -230,6 +316,13 @@ def _progress_text(percent: int, stage: str) -> str:
     )
 
 
+def _stream_preview_text(text: str, limit: int = 3900) -> str:
+    preview = text.strip()
+    if len(preview) > limit:
+        preview = preview[: limit - 2].rstrip() + " …"
+    return f"{preview} ▌"
+
+
 def _setup_instructions(default_base_url: str = "", default_model: str = "") -> str:
     base_hint = default_base_url.strip() or "https://openrouter.ai/api/v1"
     model_hint = default_model.strip() or "openrouter/free"
@@ -366,13 +459,122 @@ def _validate_connect(base_url: str, api_key: str, model: str) -> tuple[str, str
     return (url, key, mdl)
 
 
+def _deadline_left(deadline_seconds: float | None, started_at: float) -> float | None:
+    if not deadline_seconds:
+        return None
+    # The topic gate already ran inside the same deadline.
+    return deadline_seconds - (time.monotonic() - started_at)
+
+
+@dataclass
+class _ChatWork:
+    previous: _ChatWork | None = None
+    task: asyncio.Task[None] | None = None
+    spawned: list[asyncio.Task[Any]] = field(default_factory=list)
+    cancel_reason: str = ""
+
+    def cancel(self, reason: str) -> None:
+        # Answers still queued behind this one in the same chat go with it.
+        work: _ChatWork | None = self
+        while work is not None:
+            if work.task is not None and not work.task.done():
+                work.cancel_reason = reason
+                work.task.cancel()
+            work = work.previous
+
+
+async def _close_http_pool(_: Application) -> None:
+    await close_clients()
+
+
+def _telegram_requests(settings: Settings) -> tuple[HTTPXRequest, HTTPXRequest]:
+    use_http2 = settings.telegram_http2
+    if use_http2 and not http2_available():
+        logger.warning("TELEGRAM_HTTP2 is set but the 'h2' package is missing, falling back to HTTP/1.1")
+        use_http2 = False
+
+    def request(pool_size: int) -> HTTPXRequest:
+        return HTTPXRequest(
+            connection_pool_size=pool_size,
+            connect_timeout=settings.telegram_connect_timeout_seconds,
+            read_timeout=settings.telegram_read_timeout_seconds,
+            write_timeout=settings.telegram_write_timeout_seconds,
+            pool_timeout=settings.telegram_pool_timeout_seconds,
+            http_version="2" if use_http2 else "1.1",
+        )
+
+    # Replies, progress edits and chat actions get their own pool; long polling holds a separate one.
+    return request(settings.telegram_pool_size), request(settings.telegram_polling_pool_size)
+
+
 def build_application() -> Application:
     settings = load_settings()
+    configure_cassette(
+        CassetteSettings(
+            mode=settings.cassette_mode,
+            path=settings.cassette_path,
+            replay_timing=settings.cassette_replay_timing,
+        )
+    )
+    configure_pool(
+        PoolSettings(
+            max_connections=settings.llm_pool_max_connections,
+            max_keepalive_connections=settings.llm_pool_max_keepalive,
+            keepalive_expiry_seconds=settings.llm_keepalive_seconds,
+            http2=settings.llm_http2,
+        )
+    )
+    configure_limits(
+        LimiterSettings(
+            max_concurrency=settings.llm_max_concurrency,
+            min_concurrency=min(settings.llm_min_concurrency, settings.llm_max_concurrency),
+            queue_timeout_seconds=settings.llm_queue_timeout_seconds,
+            default_backoff_seconds=settings.llm_rate_limit_backoff_seconds,
+        )
+    )
+    configure_health(
+        HealthSettings(
+            failure_threshold=settings.model_failure_threshold,
+            cooldown_seconds=settings.model_cooldown_seconds,
+            slow_call_seconds=settings.model_slow_call_seconds,
+        )
+    )
+    configure_search(
+        duckduckgo_url=settings.search_duckduckgo_url,
+        wikipedia_url=settings.search_wikipedia_url,
+    )
+    configure_budget(
+        BudgetSettings(
+            default_context_tokens=settings.default_context_tokens,
+            model_context_tokens=settings.model_context_tokens,
+            max_prompt_tokens=settings.max_prompt_tokens,
+        )
+    )
+    configure_tracing(
+        TraceSettings(
+            enabled=settings.trace_enabled,
+            path=settings.trace_path,
+            max_bytes=settings.trace_max_bytes,
+            backups=settings.trace_backups,
+        )
+    )
     storage = BotStorage(settings.storage_path)
     default_base_url = settings.llm_base_url.strip().rstrip("/")
     default_api_key = settings.llm_api_key.strip()
     default_model = settings.llm_model.strip() or "openrouter/free"
     setup_instructions = _setup_instructions(default_base_url=default_base_url, default_model=default_model)
+    response_cache = (
+        ResponseCache(
+            storage,
+            CacheSettings(
+                max_entries=settings.llm_cache_max_entries,
+                ttl_seconds=settings.llm_cache_ttl_seconds,
+                max_rows=settings.llm_cache_max_rows,
+            ),
+        )
+        if settings.llm_cache_enabled
+        else None
+    )
 
     def default_ai_config() -> dict[str, str] | None:
         parsed = _validate_connect(default_base_url, default_api_key, default_model)
@@ -390,29 +592,163 @@ def build_application() -> Application:
             return fallback, "default"
         return None, "missing"
 
-    def on_request_complete() -> None:
-        storage.increment_api_calls(1)
+    def usage_recorder(chat_id: int, tally: dict[str, int]) -> Callable[[LLMUsage], None]:
+        def on_request_complete(usage: LLMUsage) -> None:
+            storage.increment_api_calls(1)
+            storage.record_token_usage(
+                chat_id=chat_id,
+                model=usage.model,
+                stage=usage.stage,
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+            )
+            tally["calls"] = tally.get("calls", 0) + 1
+            tally["tokens"] = tally.get("tokens", 0) + usage.total_tokens
+            if usage.stage == "gate":
+                tally["gate_calls"] = tally.get("gate_calls", 0) + 1
+                tally["gate_tokens"] = tally.get("gate_tokens", 0) + usage.total_tokens
+
+        return on_request_complete
+
+    def cancel_recorder(tally: dict[str, int]) -> Callable[[str, str], None]:
+        # One rule for every cancellation (hedge loser, early consensus, superseded answer):
+        # a call counts against the quota only if it was actually sent upstream.
+        def on_request_cancelled(model: str, stage: str) -> None:
+            storage.increment_api_calls(1)
+            tally["calls"] = tally.get("calls", 0) + 1
+            if stage == "gate":
+                tally["gate_calls"] = tally.get("gate_calls", 0) + 1
+
+        return on_request_cancelled
+
+    hedge_policy = (
+        HedgePolicy(
+            quantile=settings.hedge_quantile,
+            min_delay_seconds=settings.hedge_min_delay_seconds,
+            default_delay_seconds=settings.hedge_default_delay_seconds,
+        )
+        if settings.hedge_agents
+        else None
+    )
 
-    def make_llm(ai_cfg: dict[str, str]) -> LLMClient:
+    # In-flight answer per chat; each one links to the earlier answer it is queued behind.
+    answers: dict[int, _ChatWork] = {}
+
+    def _forget_answer(chat_id: int, work: _ChatWork) -> None:
+        if answers.get(chat_id) is work:
+            del answers[chat_id]
+
+    update_processor = ChatOrderedUpdateProcessor(settings.update_concurrency)
+    scheduler = FairScheduler(
+        SchedulerSettings(
+            max_running=settings.scheduler_max_running,
+            max_waiting=settings.scheduler_max_waiting,
+            max_wait_seconds=settings.scheduler_max_wait_seconds,
+            priority_burst=settings.scheduler_priority_burst,
+        )
+    )
+
+    # LLMClient is a thin wrapper; TCP/TLS connections live in the shared app.http_pool registry.
+    def make_llm(ai_cfg: dict[str, str], chat_id: int, tally: dict[str, int]) -> LLMClient:
         return LLMClient(
             base_url=ai_cfg["base_url"],
             api_key=ai_cfg["api_key"],
             model=ai_cfg["model"],
             timeout_seconds=settings.llm_timeout_seconds,
-            on_request_complete=on_request_complete,
+            on_request_complete=usage_recorder(chat_id, tally),
+            cache=response_cache,
+            on_request_cancelled=cancel_recorder(tally),
         )
 
-    def quota_text() -> str:
+    def remaining_tokens_today() -> int | None:
+        if settings.daily_token_limit <= 0:
+            return None
+        return max(settings.daily_token_limit - storage.get_tokens_today(), 0)
+
+    def quota_text(reasoning_mode: str = "balanced") -> str:
         used = storage.get_api_calls_today()
         remaining = max(settings.daily_api_limit - used, 0)
-        approx_answers = remaining // 8
-        return (
+        tokens_left = remaining_tokens_today()
+        costs = {**DEFAULT_ANSWER_COST, **storage.get_answer_costs()}
+        mode = reasoning_mode if reasoning_mode in DEFAULT_ANSWER_COST else "balanced"
+        estimates = {
+            name: _estimate_answers_left(remaining, tokens_left, cost)
+            for name, cost in costs.items()
+            if name in DEFAULT_ANSWER_COST
+        }
+        text = (
             "Лимит на сегодня (OpenRouter API):\n"
             f"- Использовано: {used}/{settings.daily_api_limit}\n"
             f"- Осталось: {remaining}\n"
-            f"- Примерно полноценных ответов бота: {approx_answers}"
+        )
+        if tokens_left is not None:
+            text += f"- Токенов осталось: {tokens_left}/{settings.daily_token_limit}\n"
+        text += (
+            f"- Примерно полноценных ответов бота ({_reasoning_mode_label(mode)}): {estimates[mode]}\n"
+            f"- По режимам: быстро ~{estimates['fast']}, стандарт ~{estimates['balanced']}, "
+            f"глубоко ~{estimates['deep']}"
+        )
+        if hedge_policy is not None:
+            hedges_started, hedges_won = storage.get_hedge_stats_today()
+            text += f"\n- Дублирующих запросов: {hedges_started} (быстрее основного: {hedges_won})"
+        return text
+
+    def stats_text() -> str:
+        lines = ["Статистика бота:"]
+        if response_cache is None:
+            lines.append("- Кэш ответов выключен")
+        else:
+            cache_stats = response_cache.stats()
+            hits = cache_stats["memory_hits"] + cache_stats["disk_hits"]
+            total = hits + cache_stats["misses"]
+            hit_rate = round(100 * hits / total) if total else 0
+            lines.append(
+                f"- Кэш ответов: попаданий {hits} (память {cache_stats['memory_hits']}, "
+                f"база {cache_stats['disk_hits']}), промахов {cache_stats['misses']}, доля {hit_rate}%"
+            )
+
+        llm_flights = llm_coalescing_stats()
+        search_flights = search_coalescing_stats()
+        lines.append(
+            f"- Объединено одинаковых запросов: LLM {llm_flights['followers']}, "
+            f"поиск {search_flights['followers']}"
+        )
+
+        rows = get_health().snapshot()
+        if rows:
+            lines.append("Модели:")
+        for row in rows:
+            p50 = row["p50_latency"]
+            latency = f"{p50:.1f} с" if isinstance(p50, float) else "нет данных"
+            lines.append(
+                f"- {row['model']}: {_circuit_state_label(str(row['state']))}, "
+                f"успешно {round(100 * float(row['success_rate']))}%, медиана {latency}"
+            )
+
+        updates = update_processor.stats()
+        lines.append(
+            f"- Обновления: обработано {updates['processed']}, ожидание за другими чатами "
+            f"p95 {updates['global_wait_p95']:.2f} с (макс. {updates['global_wait_max']:.2f} с), "
+            f"внутри своего чата p95 {updates['chat_wait_p95']:.2f} с"
+        )
+
+        queue = scheduler.stats()
+        lines.append(
+            f"- Очередь: выполняется {queue['running']}, ждут {queue['waiting']}, "
+            f"обслужено {queue['served']}, отказов {queue['rejected']}, "
+            f"среднее ожидание {queue['avg_wait_seconds']:.1f} с"
         )
 
+        if settings.speculative_gate != "off":
+            spec = storage.get_speculation_stats()
+            lines.append(
+                f"- Параллельная проверка темы ({settings.speculative_gate}) за 7 дней: "
+                f"принято {spec['accepted']}, отклонено {spec['rejected']}, "
+                f"сэкономлено {spec['saved_seconds']:.0f} с, впустую {spec['wasted_calls']} запросов "
+                f"и {spec['wasted_tokens']} токенов"
+            )
+        return "\n".join(lines)
+
     def settings_text(user: dict[str, str], ai_cfg: dict[str, str], ai_source: str) -> str:
         source_label = "Личный IP/API" if ai_source == "personal" else "Серверный IP/API по умолчанию"
         return (
@@ -539,9 +875,51 @@ def build_application() -> Application:
         await update.message.reply_text(setup_instructions, reply_markup=_menu_keyboard())
 
     async def quota_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not update.message:
+        if not update.message or not update.effective_chat:
             return
-        await update.message.reply_text(quota_text(), reply_markup=_menu_keyboard())
+        user = storage.get_user(update.effective_chat.id) or {}
+        await update.message.reply_text(
+            quota_text(str(user.get("reasoning_mode", "balanced"))),
+            reply_markup=_menu_keyboard(),
+        )
+
+    async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not update.message or not update.effective_chat:
+            return
+        if update.effective_chat.id not in settings.admin_chat_ids:
+            await update.message.reply_text("Команда доступна только администраторам.", reply_markup=_menu_keyboard())
+            return
+        await update.message.reply_text(stats_text(), reply_markup=_menu_keyboard())
+
+    async def trace_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not update.message or not update.effective_chat:
+            return
+        if update.effective_chat.id not in settings.admin_chat_ids:
+            await update.message.reply_text("Команда доступна только администраторам.", reply_markup=_menu_keyboard())
+            return
+
+        try:
+            limit = int(context.args[0]) if context.args else 1
+        except ValueError:
+            limit = 1
+        traces = recent_traces(max(1, min(limit, 5)))
+        if not traces:
+            await update.message.reply_text("Трасс пока нет.", reply_markup=_menu_keyboard())
+            return
+
+        text = "\n\n".join(format_trace(trace) for trace in traces)
+        for chunk in _split_message(text):
+            await update.message.reply_text(chunk, reply_markup=_menu_keyboard())
+
+    async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not update.message or not update.effective_chat:
+            return
+        work = answers.get(update.effective_chat.id)
+        if work is None:
+            await update.message.reply_text("Сейчас нечего отменять.", reply_markup=_menu_keyboard())
+            return
+        work.cancel("Ответ отменён по /cancel.")
+        await update.message.reply_text("Отменяю текущий вопрос.", reply_markup=_menu_keyboard())
 
     async def settings_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.message or not update.effective_chat:
@@ -666,7 +1044,10 @@ def build_application() -> Application:
 
         if text == QUOTA_BUTTON:
             context.user_data["settings_mode"] = False
-            await update.message.reply_text(quota_text(), reply_markup=_menu_keyboard())
+            await update.message.reply_text(
+                quota_text(str(user.get("reasoning_mode", "balanced"))),
+                reply_markup=_menu_keyboard(),
+            )
             return
 
         if text == ASK_BUTTON:
@@ -739,133 +1120,312 @@ def build_application() -> Application:
         question = text
         context.user_data["awaiting_question"] = False
 
+        reasoning_mode = str(user.get("reasoning_mode", "balanced"))
         used_calls = storage.get_api_calls_today()
         remaining_calls = max(settings.daily_api_limit - used_calls, 0)
-        if remaining_calls <= 0:
+        tokens_left = remaining_tokens_today()
+        if remaining_calls <= 0 or tokens_left == 0:
             await update.message.reply_text(
                 "Дневной лимит API-запросов исчерпан. Попробуй завтра.\n\n"
-                f"{quota_text()}",
+                f"{quota_text(reasoning_mode)}",
                 reply_markup=_menu_keyboard(),
             )
             return
 
-        history = storage.get_short_memory(chat_id=chat_id, window=settings.history_window)
-        context_excerpt = _format_context(history=history, window=settings.history_window)
-
-        model_preset = str(user.get("model_preset", "router_free"))
-        gate_model, agent_models = _selected_model(ai_cfg.get("model", "openrouter/free"), model_preset)
-
-        progress_message = await update.message.reply_text(_progress_text(0, "Подготовка"))
-        progress_state = {
-            "percent": -1,
-            "stage": "",
-            "last_edit": 0.0,
-        }
-
-        async def progress(percent: int, stage: str) -> None:
-            safe = max(0, min(100, int(percent)))
-            now = time.monotonic()
-            last_percent = int(progress_state["percent"])
-            last_stage = str(progress_state["stage"])
-            last_edit = float(progress_state["last_edit"])
-
-            if safe == last_percent and stage == last_stage:
-                return
-            if (
-                safe < 100
-                and last_percent >= 0
-                and now - last_edit < 0.7
-                and safe - last_percent < 4
-            ):
-                return
-
-            try:
-                await progress_message.edit_text(_progress_text(safe, stage))
-            except Exception:
-                return
-
-            progress_state["percent"] = safe
-            progress_state["stage"] = stage
-            progress_state["last_edit"] = now
-
-        llm = make_llm(ai_cfg)
-
-        await progress(5, "Проверяю тему вопроса")
-        allowed = await is_bible_question(
-            question=question,
-            llm=llm,
-            context_excerpt=context_excerpt,
-            last_topic_bible=bool(context.user_data.get("last_topic_bible")),
-            model=gate_model,
-        )
-        if not allowed:
-            context.user_data["last_topic_bible"] = False
-            try:
-                await progress_message.delete()
-            except Exception:
-                pass
+        previous = answers.get(chat_id)
+        if previous is not None and settings.inflight_policy == "reject":
             await update.message.reply_text(
-                RULE_VIOLATION_TEXT,
+                "Предыдущий вопрос ещё обрабатывается. Дождись ответа или отправь /cancel.",
                 reply_markup=_menu_keyboard(),
             )
             return
+        if previous is not None and settings.inflight_policy == "supersede":
+            previous.cancel("Ответ отменён: пришёл новый вопрос.")
+
+        work = _ChatWork(previous=previous)
+        answers[chat_id] = work
+
+        async def answer(progress_message: Message) -> None:
+            if work.previous is not None:
+                # Queued behind an earlier question of the same chat; its answer becomes this one's history.
+                try:
+                    await progress_message.edit_text(_progress_text(0, "Жду ответа на предыдущий вопрос"))
+                except Exception:
+                    pass
+                await asyncio.wait([work.previous.task])
+                work.previous = None
+            started_at = time.monotonic()
+
+            last_exchange = storage.get_short_memory(chat_id=chat_id, window=1)
+            context_excerpt = _format_context(
+                summary=storage.get_chat_summary(chat_id=chat_id),
+                last_exchange=last_exchange[-1] if last_exchange else None,
+            )
 
-        await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-        await progress(12, "Запускаю анализ")
+            model_preset = str(user.get("model_preset", "router_free"))
+            gate_model, agent_models = _selected_model(ai_cfg.get("model", "openrouter/free"), model_preset)
+
+            progress_state = {
+                "percent": -1,
+                "stage": "",
+                "last_edit": 0.0,
+                "streaming": False,
+                "admitted": False,
+            }
+
+            async def progress(percent: int, stage: str) -> None:
+                if progress_state["streaming"]:
+                    return
+                safe = max(0, min(100, int(percent)))
+                now = time.monotonic()
+                last_percent = int(progress_state["percent"])
+                last_stage = str(progress_state["stage"])
+                last_edit = float(progress_state["last_edit"])
+
+                if safe == last_percent and stage == last_stage:
+                    return
+                if (
+                    safe < 100
+                    and last_percent >= 0
+                    and now - last_edit < 0.7
+                    and safe - last_percent < 4
+                ):
+                    return
+
+                try:
+                    await progress_message.edit_text(_progress_text(safe, stage))
+                except Exception:
+                    return
+
+                progress_state["percent"] = safe
+                progress_state["stage"] = stage
+                progress_state["last_edit"] = now
+
+            async def stream_preview(text: str) -> None:
+                # A speculative pipeline may produce text before the topic gate has accepted the question.
+                if not progress_state["admitted"]:
+                    return
+                now = time.monotonic()
+                # Telegram throttles frequent edits of one message, so partial answers are batched.
+                if now - float(progress_state["last_edit"]) < settings.stream_edit_interval_seconds:
+                    return
+                if not text.strip():
+                    return
+
+                progress_state["streaming"] = True
+                progress_state["last_edit"] = now
+                try:
+                    await progress_message.edit_text(_stream_preview_text(text), disable_web_page_preview=True)
+                except Exception:
+                    return
+
+            usage_tally: dict[str, int] = {"calls": 0, "tokens": 0}
+            llm = make_llm(ai_cfg, chat_id, usage_tally)
+
+            await progress(5, "Проверяю тему вопроса")
+            gate_state = {"seconds": 0.0}
+
+            async def run_gate() -> bool:
+                gate_started = time.monotonic()
+                try:
+                    with span("gate", model=gate_model) as gate_span:
+                        verdict = await is_bible_question(
+                            question=question,
+                            llm=llm,
+                            context_excerpt=context_excerpt,
+                            last_topic_bible=bool(context.user_data.get("last_topic_bible")),
+                            model=gate_model,
+                        )
+                        gate_span.set("status", "accepted" if verdict else "rejected")
+                        return verdict
+                finally:
+                    gate_state["seconds"] = time.monotonic() - gate_started
+
+            async def queue_progress(position: int, eta: float) -> None:
+                await progress(8, f"В очереди: {position}-й, примерно {eta:.0f} с")
+
+            # Short fast-mode questions are cheap, so they may overtake deeper ones in the queue.
+            priority = reasoning_mode == "fast" and len(question) <= SHORT_QUESTION_CHARS
+
+            async def scheduled_pipeline(admission: asyncio.Task[bool] | None) -> PipelineResult:
+                async with scheduler.slot(chat_id, priority=priority, on_position=queue_progress) as waited:
+                    set_attribute("queue_wait_seconds", round(waited, 3))
+                    return await run_pipeline(
+                        llm=llm,
+                        question=question,
+                        web_results=settings.web_results,
+                        temperature=settings.request_temperature,
+                        context_excerpt=context_excerpt,
+                        agent_models=agent_models,
+                        denomination=str(user.get("denomination", "orthodox")),
+                        answer_length=str(user.get("answer_length", "long")),
+                        explain_style=str(user.get("explain_style", "orthodox")),
+                        reasoning_mode=reasoning_mode,
+                        topology=settings.mode_topologies.get(reasoning_mode),
+                        fallback_models=_fallback_models(
+                            ai_cfg.get("base_url", ""),
+                            ai_cfg.get("model", "openrouter/free"),
+                            settings.fallback_models,
+                        ),
+                        hedge=hedge_policy,
+                        consensus_threshold=settings.consensus_threshold if settings.consensus_enabled else None,
+                        deadline_seconds=_deadline_left(settings.mode_deadlines.get(reasoning_mode), started_at + waited),
+                        admission=admission,
+                        top_up_concurrency=settings.top_up_concurrency,
+                        progress_callback=progress,
+                        stream_callback=stream_preview if settings.stream_answers else None,
+                        hedge_callback=storage.record_hedge,
+                    )
+
+            def start_pipeline(admission: asyncio.Task[bool] | None) -> asyncio.Task[PipelineResult]:
+                task = asyncio.create_task(scheduled_pipeline(admission))
+                work.spawned.append(task)
+                return task
+
+            speculation = settings.speculative_gate
+            gate_task = asyncio.create_task(run_gate())
+            work.spawned.append(gate_task)
+            pipeline_task: asyncio.Task[PipelineResult] | None = None
+            if speculation != "off":
+                # "search" overlaps only the web search with the gate, "full" also starts the agents.
+                pipeline_task = start_pipeline(gate_task if speculation == "search" else None)
+
+            allowed = await gate_task
+            if not allowed:
+                if pipeline_task is not None:
+                    pipeline_task.cancel()
+                    await asyncio.gather(pipeline_task, return_exceptions=True)
+                    storage.record_speculation(
+                        accepted=False,
+                        wasted_calls=usage_tally["calls"] - usage_tally.get("gate_calls", 0),
+                        wasted_tokens=usage_tally["tokens"] - usage_tally.get("gate_tokens", 0),
+                    )
+                context.user_data["last_topic_bible"] = False
+                try:
+                    await progress_message.delete()
+                except Exception:
+                    pass
+                await update.message.reply_text(
+                    RULE_VIOLATION_TEXT,
+                    reply_markup=_menu_keyboard(),
+                )
+                return
+
+            progress_state["admitted"] = True
+            await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+            if pipeline_task is None:
+                await progress(12, "Запускаю анализ")
+                pipeline_task = start_pipeline(None)
 
-        try:
-            result = await run_pipeline(
-                llm=llm,
-                question=question,
-                web_results=settings.web_results,
-                temperature=settings.request_temperature,
-                context_excerpt=context_excerpt,
-                agent_models=agent_models,
-                denomination=str(user.get("denomination", "orthodox")),
-                answer_length=str(user.get("answer_length", "long")),
-                explain_style=str(user.get("explain_style", "orthodox")),
-                reasoning_mode=str(user.get("reasoning_mode", "balanced")),
-                progress_callback=progress,
-            )
-        except Exception:
-            logger.exception("Pipeline failed")
             try:
-                await progress_message.edit_text("Ошибка при обработке запроса. Попробуйте через минуту.")
+                result = await pipeline_task
+            except SchedulerFull:
+                try:
+                    await progress_message.edit_text("Сейчас слишком много вопросов. Попробуйте через пару минут.")
+                except Exception:
+                    pass
+                return
             except Exception:
-                pass
-            return
-
-        context.user_data["last_topic_bible"] = True
-        storage.append_short_memory(
-            chat_id=chat_id,
-            question=question,
-            answer=result.answer_text,
-            window=settings.history_window,
-        )
+                logger.exception("Pipeline failed")
+                try:
+                    await progress_message.edit_text("Ошибка при обработке запроса. Попробуйте через минуту.")
+                except Exception:
+                    pass
+                return
 
-        await progress(100, "Готово")
-        await asyncio.sleep(0.35)
-        try:
-            await progress_message.delete()
-        except Exception:
-            pass
+            if speculation != "off":
+                storage.record_speculation(
+                    accepted=True,
+                    saved_seconds=gate_state["seconds"] - result.admission_wait_seconds,
+                )
 
-        for chunk in _split_message(result.answer_text):
-            await update.message.reply_text(
-                chunk,
-                disable_web_page_preview=True,
-                reply_markup=_menu_keyboard(),
+            context.user_data["last_topic_bible"] = True
+            storage.record_answer_usage(
+                reasoning_mode=reasoning_mode,
+                api_calls=usage_tally["calls"],
+                tokens=usage_tally["tokens"],
             )
+            _remember_exchange(storage, settings, chat_id=chat_id, question=question, answer=result.answer_text)
+
+            chunks = _split_message(result.answer_text)
+            if progress_state["streaming"]:
+                # The streamed preview already sits in the progress message: finalize it in place.
+                try:
+                    await progress_message.edit_text(chunks[0], disable_web_page_preview=True)
+                    chunks = chunks[1:]
+                except Exception:
+                    try:
+                        await progress_message.delete()
+                    except Exception:
+                        pass
+            else:
+                await progress(100, "Готово")
+                await asyncio.sleep(0.35)
+                try:
+                    await progress_message.delete()
+                except Exception:
+                    pass
+
+            with span("telegram.send", chunks=len(chunks)):
+                for chunk in chunks:
+                    await update.message.reply_text(
+                        chunk,
+                        disable_web_page_preview=True,
+                        reply_markup=_menu_keyboard(),
+                    )
+
+        async def answer_detached() -> None:
+            with start_trace("answer", chat_id=chat_id, reasoning_mode=reasoning_mode):
+                progress_message = await update.message.reply_text(_progress_text(0, "Подготовка"))
+                try:
+                    try:
+                        await answer(progress_message)
+                    finally:
+                        # However the answer ended, its gate and speculative pipeline must not keep
+                        # spending upstream calls and quota with nobody waiting on them.
+                        for task in work.spawned:
+                            if not task.done():
+                                task.cancel()
+                except asyncio.CancelledError:
+                    try:
+                        await progress_message.edit_text(work.cancel_reason or "Ответ отменён.")
+                    except Exception:
+                        pass
+                    raise
+
+        # The answer runs detached from the update, so the chat stays responsive and the work can be cancelled.
+        work.task = context.application.create_task(answer_detached(), update=update)
+        work.task.add_done_callback(lambda _: _forget_answer(chat_id, work))
 
     async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.exception("Unhandled telegram error", exc_info=context.error)
 
-    app = Application.builder().token(settings.telegram_bot_token).build()
+    bot_request, polling_request = _telegram_requests(settings)
+    builder = (
+        Application.builder()
+        .token(settings.telegram_bot_token)
+        .concurrent_updates(update_processor)
+        .request(bot_request)
+        .get_updates_request(polling_request)
+        .post_shutdown(_close_http_pool)
+    )
+    if settings.telegram_api_base_url:
+        # A self-hosted Bot API server or the bench mock; the token is appended by the library.
+        builder = builder.base_url(f"{settings.telegram_api_base_url}/bot").base_file_url(
+            f"{settings.telegram_api_base_url}/file/bot"
+        )
+    app = builder.build()
+    # Exposed so the offline bench can wait for detached answers to finish.
+    app.bot_data["answers"] = answers
+    app.bot_data["settings"] = settings
     app.add_handler(CommandHandler("start", start_handler))
     app.add_handler(CommandHandler("help", help_handler))
     app.add_handler(CommandHandler("setup", setup_handler))
     app.add_handler(CommandHandler("connect", connect_handler))
     app.add_handler(CommandHandler("quota", quota_handler))
+    app.add_handler(CommandHandler("stats", stats_handler))
+    app.add_handler(CommandHandler("trace", trace_handler))
+    app.add_handler(CommandHandler("cancel", cancel_handler))
     app.add_handler(CommandHandler("settings", settings_handler))
     app.add_handler(CommandHandler("menu", menu_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
@@ -875,6 +1435,16 @@ def build_application() -> Application:
 
 def run() -> None:
     app = build_application()
+    settings = app.bot_data["settings"]
+    if settings.update_mode == "webhook":
+        webhook = WebhookSettings(
+            secret_token=settings.webhook_secret_token,
+            path=settings.webhook_path,
+            public_url=settings.webhook_url,
+            max_connections=settings.webhook_max_connections,
+        )
+        serve_webhook(app, webhook, settings.webhook_listen, settings.webhook_port)
+        return
     try:
         asyncio.get_event_loop()
     except RuntimeError:
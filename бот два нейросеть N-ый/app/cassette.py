@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+_KEPT_HEADERS = ("content-type", "retry-after")
+
+
+@dataclass(frozen=True)
+class CassetteSettings:
+    mode: str = "off"
+    path: str = "cassette.jsonl"
+    replay_timing: bool = False
+
+
+_settings = CassetteSettings()
+_write_lock = threading.Lock()
+_entries: dict[str, list[dict[str, Any]]] | None = None
+_cursors: dict[str, int] = {}
+
+
+def configure_cassette(settings: CassetteSettings) -> None:
+    global _settings, _entries
+    _settings = settings
+    _entries = None
+    _cursors.clear()
+
+
+def request_key(request: httpx.Request) -> str:
+    # Auth headers and query order must not change the key, so only method, sorted URL and body are hashed.
+    query = urlencode(sorted(parse_qsl(request.url.query.decode("ascii"), keep_blank_values=True)))
+    url = request.url.copy_with(query=query.encode("ascii") or None)
+    digest = hashlib.sha256(request.content).hexdigest()[:16] if request.content else ""
+    return f"{request.method} {url} {digest}".rstrip()
+
+
+def _append(entry: dict[str, Any]) -> None:
+    line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+    try:
+        with _write_lock:
+            with open(_settings.path, "a", encoding="utf-8") as sink:
+                sink.write(line + "\n")
+    except OSError:
+        logger.exception("Failed to append to cassette %s", _settings.path)
+
+
+def _load() -> dict[str, list[dict[str, Any]]]:
+    global _entries
+    if _entries is not None:
+        return _entries
+
+    entries: dict[str, list[dict[str, Any]]] = {}
+    if os.path.exists(_settings.path):
+        with open(_settings.path, encoding="utf-8") as source:
+            for line in source:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries.setdefault(str(entry.get("key", "")), []).append(entry)
+    else:
+        logger.warning("Cassette %s does not exist, every request will miss", _settings.path)
+    _entries = entries
+    return entries
+
+
+def _next_entry(key: str) -> dict[str, Any] | None:
+    # Repeated identical requests (retries, hedges) get the recorded responses in their original order.
+    recorded = _load().get(key)
+    if not recorded:
+        return None
+    with _write_lock:
+        index = _cursors.get(key, 0)
+        _cursors[key] = index + 1
+    return recorded[index % len(recorded)]
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    def __init__(self, inner: httpx.AsyncByteStream, entry: dict[str, Any], started: float) -> None:
+        self._inner = inner
+        self._entry = entry
+        self._started = started
+        self._body = bytearray()
+        self._done = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._inner:
+            self._body.extend(chunk)
+            yield chunk
+        self._finish()
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+        self._finish()
+
+    def _finish(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        self._entry["body"] = self._body.decode("utf-8", errors="replace")
+        self._entry["latency_ms"] = round((time.monotonic() - self._started) * 1000, 1)
+        _append(self._entry)
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, body: bytes, delay: float) -> None:
+        self._body = body
+        self._delay = delay
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._delay > 0:
+            await asyncio.sleep(self._delay)
+        yield self._body
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport) -> None:
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        # Bodies are stored as text, so ask upstream not to compress them.
+        request.headers["Accept-Encoding"] = "identity"
+        entry: dict[str, Any] = {"key": request_key(request)}
+        started = time.monotonic()
+        try:
+            response = await self._inner.handle_async_request(request)
+        except httpx.TransportError as exc:
+            entry["error"] = type(exc).__name__
+            entry["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+            _append(entry)
+            raise
+
+        entry["status"] = response.status_code
+        entry["headers"] = {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers}
+        entry["first_byte_ms"] = round((time.monotonic() - started) * 1000, 1)
+        # The body is teed while the caller reads it, so streamed answers still arrive incrementally.
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, entry, started),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, timing: bool = False) -> None:
+        self._timing = timing
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        key = request_key(request)
+        entry = _next_entry(key)
+        if entry is None:
+            raise httpx.ConnectError(f"No cassette entry for {key}", request=request)
+
+        latency = float(entry.get("latency_ms", 0.0)) / 1000 if self._timing else 0.0
+        if entry.get("error"):
+            if latency:
+                await asyncio.sleep(latency)
+            error_class = getattr(httpx, str(entry["error"]), httpx.TransportError)
+            raise error_class(f"Replayed {entry['error']}", request=request)
+
+        first_byte = min(latency, float(entry.get("first_byte_ms", 0.0)) / 1000) if self._timing else 0.0
+        if first_byte:
+            await asyncio.sleep(first_byte)
+        return httpx.Response(
+            status_code=int(entry.get("status", 200)),
+            headers=entry.get("headers") or {},
+            stream=_ReplayStream(str(entry.get("body", "")).encode("utf-8"), latency - first_byte),
+            request=request,
+        )
+
+
+def cassette_transport(**transport_options: Any) -> httpx.AsyncBaseTransport | None:
+    # None keeps httpx's own transport (and its proxy handling) when the cassette is off.
+    if _settings.mode == "replay":
+        return ReplayTransport(timing=_settings.replay_timing)
+    if _settings.mode == "record":
+        return RecordingTransport(httpx.AsyncHTTPTransport(**transport_options))
+    return None
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from app.compress import find_references
+from app.similarity import similarity_matrix, split_sentences
+
+
+_QUESTION_CHARS = 160
+_GIST_CHARS = 220
+_FOOTER_PREFIXES = ("Проверено ", "Ответ одной модели", "Свежие ссылки", "- http")
+
+
+def _answer_sentences(answer: str) -> list[str]:
+    # The verification note and source links appended by the pipeline say nothing about the topic.
+    body = [line for line in answer.splitlines() if not line.strip().startswith(_FOOTER_PREFIXES)]
+    return [sentence for sentence in split_sentences("\n".join(body)) if "http" not in sentence]
+
+
+def _gist(answer: str) -> str:
+    sentences = _answer_sentences(answer)[:12]
+    if not sentences:
+        return ""
+    if len(sentences) < 3:
+        central = sentences[0]
+    else:
+        # The sentence closest to all the others is the best single-line stand-in for the answer.
+        matrix = similarity_matrix(sentences)
+        central = sentences[max(range(len(sentences)), key=lambda i: sum(matrix[i]))]
+    central = central.lstrip("-•* ").strip()
+    if len(central) > _GIST_CHARS:
+        central = central[: _GIST_CHARS - 1].rstrip() + "…"
+
+    references = [ref for ref in find_references(answer) if ref not in central][:3]
+    return f"{central} ({'; '.join(references)})" if references else central
+
+
+def summary_line(question: str, answer: str) -> str:
+    topic = " ".join(question.split())
+    if len(topic) > _QUESTION_CHARS:
+        topic = topic[: _QUESTION_CHARS - 1].rstrip() + "…"
+    gist = _gist(answer)
+    return f"- {topic} → {gist}" if gist else f"- {topic}"
+
+
+def fold_exchange(summary: str, question: str, answer: str, max_turns: int, max_chars: int) -> str:
+    # One line per past exchange, oldest first; the oldest lines go once the turn or size limit is hit.
+    lines = [line for line in summary.splitlines() if line.strip()]
+    lines.append(summary_line(question, answer))
+    lines = lines[-max(1, max_turns):]
+    while len(lines) > 1 and len("\n".join(lines)) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)[:max_chars]
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+
+from app.prompt_budget import estimate_tokens
+from app.similarity import cosine, medoid, split_sentences, tfidf_vectors
+
+
+# "Ин 3:16", "Матфея 6:14-15", "1 Кор. 13:4" and their Latin counterparts.
+_REFERENCE = re.compile(r"(?:[123]\s*)?[A-Za-zА-Яа-яЁё]{2,}\.?\s*\d{1,3}\s*:\s*\d{1,3}(?:\s*[-–]\s*\d{1,3})?")
+
+
+@dataclass(frozen=True)
+class CompressedDrafts:
+    drafts: list[str]
+    tokens_before: int
+    tokens_after: int
+    dropped_sentences: int
+
+
+@dataclass(frozen=True)
+class _Sentence:
+    draft: int
+    line: int
+    position: int
+    text: str
+    references: frozenset[str]
+
+
+def find_references(text: str) -> list[str]:
+    return list(dict.fromkeys(match.strip() for match in _REFERENCE.findall(text)))
+
+
+def scripture_references(text: str) -> frozenset[str]:
+    return frozenset(re.sub(r"\s+", "", match).lower().rstrip(".") for match in find_references(text))
+
+
+def _sentences(draft: int, text: str) -> list[_Sentence]:
+    rows: list[_Sentence] = []
+    for line_no, line in enumerate(text.splitlines()):
+        for sentence in split_sentences(line):
+            rows.append(_Sentence(draft, line_no, len(rows), sentence, scripture_references(sentence)))
+    return rows
+
+
+def _render(sentences: list[_Sentence]) -> str:
+    lines: dict[int, list[str]] = {}
+    for sentence in sorted(sentences, key=lambda item: item.position):
+        lines.setdefault(sentence.line, []).append(sentence.text)
+    return "\n".join(" ".join(parts) for _, parts in sorted(lines.items()))
+
+
+def compress_drafts(drafts: list[str], token_budget: int, duplicate_threshold: float = 0.6) -> CompressedDrafts:
+    # Drafts from several agents repeat each other; keep every distinct claim and reference once, within budget.
+    tokens_before = sum(estimate_tokens(text) for text in drafts)
+    if len(drafts) < 2:
+        return CompressedDrafts(list(drafts), tokens_before, tokens_before, 0)
+
+    # The most central draft goes first, so its wording wins over near-duplicates elsewhere.
+    lead = medoid(drafts)
+    order = [lead] + [idx for idx in range(len(drafts)) if idx != lead]
+    sentences = [sentence for idx in order for sentence in _sentences(idx, drafts[idx])]
+    vectors = tfidf_vectors([sentence.text for sentence in sentences])
+
+    kept: list[int] = []
+    seen_references: set[str] = set()
+    for idx, sentence in enumerate(sentences):
+        new_references = sentence.references - seen_references
+        duplicate = any(cosine(vectors[idx], vectors[other]) >= duplicate_threshold for other in kept)
+        if duplicate and not new_references:
+            continue
+        kept.append(idx)
+        seen_references |= sentence.references
+
+    if sum(estimate_tokens(sentences[idx].text) for idx in kept) > token_budget:
+        # Over budget: scripture references first, then the lead draft, then earlier sentences of the rest.
+        ranked = sorted(
+            kept,
+            key=lambda idx: (
+                not sentences[idx].references,
+                sentences[idx].draft != lead,
+                sentences[idx].position,
+            ),
+        )
+        selected: list[int] = []
+        used = 0
+        for idx in ranked:
+            cost = estimate_tokens(sentences[idx].text)
+            if selected and used + cost > token_budget:
+                continue
+            selected.append(idx)
+            used += cost
+        kept = sorted(selected)
+
+    by_draft: dict[int, list[_Sentence]] = {}
+    for idx in kept:
+        by_draft.setdefault(sentences[idx].draft, []).append(sentences[idx])
+    compressed = [_render(by_draft[idx]) for idx in order if idx in by_draft]
+    return CompressedDrafts(
+        drafts=compressed,
+        tokens_before=tokens_before,
+        tokens_after=sum(estimate_tokens(text) for text in compressed),
+        dropped_sentences=len(sentences) - len(kept),
+    )
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import re
 from dataclasses import dataclass
 
 from dotenv import load_dotenv
@@ -9,6 +10,55 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+@dataclass(frozen=True)
+class ModeTopology:
+    agents: int
+    personas: tuple[str, ...]
+    synthesis: bool
+    self_review: bool
+    extra_review: bool
+
+
+DEFAULT_PERSONAS = ("scripture", "theology", "cautious", "consistency")
+
+DEFAULT_MODE_TOPOLOGIES = {
+    "fast": ModeTopology(
+        agents=1,
+        personas=("scripture",),
+        synthesis=False,
+        self_review=False,
+        extra_review=False,
+    ),
+    "balanced": ModeTopology(
+        agents=4,
+        personas=DEFAULT_PERSONAS,
+        synthesis=True,
+        self_review=True,
+        extra_review=False,
+    ),
+    "deep": ModeTopology(
+        agents=4,
+        personas=DEFAULT_PERSONAS,
+        synthesis=True,
+        self_review=True,
+        extra_review=True,
+    ),
+}
+
+
+# Context windows of models known to be small; everything else gets DEFAULT_CONTEXT_TOKENS.
+DEFAULT_MODEL_CONTEXT_TOKENS = {
+    "qwen3-4b": 8_192,
+}
+
+# Upper bound on one answer per mode, in seconds; 0 disables the deadline.
+DEFAULT_MODE_DEADLINES = {
+    "fast": 45.0,
+    "balanced": 120.0,
+    "deep": 240.0,
+}
+
+
 @dataclass(frozen=True)
 class Settings:
     telegram_bot_token: str
@@ -20,8 +70,72 @@ class Settings:
     request_temperature: float
     agent_models: list[str]
     daily_api_limit: int
+    daily_token_limit: int
     storage_path: str
     history_window: int
+    summary_max_chars: int
+    default_context_tokens: int
+    model_context_tokens: dict[str, int]
+    max_prompt_tokens: int
+    llm_pool_max_connections: int
+    llm_pool_max_keepalive: int
+    llm_keepalive_seconds: float
+    llm_http2: bool
+    stream_answers: bool
+    stream_edit_interval_seconds: float
+    llm_max_concurrency: int
+    llm_min_concurrency: int
+    llm_queue_timeout_seconds: float
+    llm_rate_limit_backoff_seconds: float
+    fallback_models: list[str]
+    model_failure_threshold: int
+    model_cooldown_seconds: float
+    model_slow_call_seconds: float
+    hedge_agents: bool
+    hedge_quantile: float
+    hedge_min_delay_seconds: float
+    hedge_default_delay_seconds: float
+    llm_cache_enabled: bool
+    llm_cache_max_entries: int
+    llm_cache_ttl_seconds: float
+    llm_cache_max_rows: int
+    consensus_enabled: bool
+    consensus_threshold: float
+    mode_topologies: dict[str, ModeTopology]
+    mode_deadlines: dict[str, float]
+    speculative_gate: str
+    top_up_concurrency: int
+    inflight_policy: str
+    update_concurrency: int
+    telegram_pool_size: int
+    telegram_polling_pool_size: int
+    telegram_connect_timeout_seconds: float
+    telegram_read_timeout_seconds: float
+    telegram_write_timeout_seconds: float
+    telegram_pool_timeout_seconds: float
+    telegram_http2: bool
+    update_mode: str
+    webhook_url: str
+    webhook_path: str
+    webhook_listen: str
+    webhook_port: int
+    webhook_secret_token: str
+    webhook_max_connections: int
+    scheduler_max_running: int
+    scheduler_max_waiting: int
+    scheduler_max_wait_seconds: float
+    scheduler_priority_burst: int
+    trace_enabled: bool
+    trace_path: str
+    trace_max_bytes: int
+    trace_backups: int
+    admin_chat_ids: frozenset[int]
+    telegram_api_base_url: str
+    search_duckduckgo_url: str
+    search_wikipedia_url: str
+    cassette_mode: str
+    cassette_path: str
+    cassette_replay_timing: bool
 
 
 def _read_int(name: str, default: int, min_value: int = 1) -> int:
@@ -42,6 +156,26 @@ def _read_float(name: str, default: float) -> float:
     return value if value > 0 else default
 
 
+def _read_non_negative_float(name: str, default: float) -> float:
+    raw = os.getenv(name, str(default)).strip()
+    try:
+        value = float(raw)
+    except ValueError:
+        return default
+    return value if value >= 0 else default
+
+
+def _read_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name, "").strip().lower()
+    if not raw:
+        return default
+    if raw in {"1", "true", "yes", "on"}:
+        return True
+    if raw in {"0", "false", "no", "off"}:
+        return False
+    return default
+
+
 def _read_models(default_model: str) -> list[str]:
     raw = os.getenv("AGENT_MODELS", "").strip()
     if raw:
@@ -52,10 +186,73 @@ def _read_models(default_model: str) -> list[str]:
     if not models:
         models = [default_model]
 
-    # Always keep exactly 4 workers for "4 models in parallel" mode.
-    while len(models) < 4:
-        models.append(models[-1])
-    return models[:4]
+    # The pipeline cycles through this list, so it may be shorter than a mode's agent count.
+    return models
+
+
+def _read_list(name: str) -> list[str]:
+    raw = os.getenv(name, "").strip()
+    return [item.strip() for item in raw.split(",") if item.strip()]
+
+
+def _read_chat_ids(name: str) -> frozenset[int]:
+    chat_ids: set[int] = set()
+    for item in _read_list(name):
+        try:
+            chat_ids.add(int(item))
+        except ValueError:
+            continue
+    return frozenset(chat_ids)
+
+
+def _read_context_limits() -> dict[str, int]:
+    # MODEL_CONTEXT_TOKENS=qwen3-4b=8192,llama3=4096 (a name matches any model id containing it).
+    limits = dict(DEFAULT_MODEL_CONTEXT_TOKENS)
+    for item in _read_list("MODEL_CONTEXT_TOKENS"):
+        name, _, value = item.rpartition("=")
+        try:
+            tokens = int(value)
+        except ValueError:
+            continue
+        if name.strip() and tokens > 0:
+            limits[name.strip()] = tokens
+    return limits
+
+
+def _read_topology(mode: str, default: ModeTopology) -> ModeTopology:
+    prefix = mode.upper()
+    return ModeTopology(
+        agents=min(_read_int(f"{prefix}_AGENTS", default.agents), 8),
+        personas=tuple(_read_list(f"{prefix}_PERSONAS")) or default.personas,
+        synthesis=_read_bool(f"{prefix}_SYNTHESIS", default.synthesis),
+        self_review=_read_bool(f"{prefix}_SELF_REVIEW", default.self_review),
+        extra_review=_read_bool(f"{prefix}_EXTRA_REVIEW", default.extra_review),
+    )
+
+
+def _read_speculative_gate() -> str:
+    value = os.getenv("SPECULATIVE_GATE", "off").strip().lower()
+    return value if value in {"off", "search", "full"} else "off"
+
+
+def _read_inflight_policy() -> str:
+    value = os.getenv("INFLIGHT_POLICY", "supersede").strip().lower()
+    return value if value in {"queue", "supersede", "reject"} else "supersede"
+
+
+def _read_cassette_mode() -> str:
+    value = os.getenv("HTTP_CASSETTE_MODE", "off").strip().lower()
+    return value if value in {"off", "record", "replay"} else "off"
+
+
+def _read_update_mode() -> str:
+    value = os.getenv("UPDATE_MODE", "polling").strip().lower()
+    return value if value in {"polling", "webhook"} else "polling"
+
+
+def _read_webhook_path() -> str:
+    path = os.getenv("WEBHOOK_PATH", "/telegram").strip().strip("/")
+    return f"/{path}" if path else "/telegram"
 
 
 def load_settings() -> Settings:
@@ -69,6 +266,11 @@ def load_settings() -> Settings:
 
     default_model = os.getenv("LLM_MODEL", "openrouter/free").strip() or "openrouter/free"
 
+    update_mode = _read_update_mode()
+    webhook_secret = os.getenv("WEBHOOK_SECRET_TOKEN", "").strip()
+    if update_mode == "webhook" and not re.fullmatch(r"[A-Za-z0-9_-]{16,256}", webhook_secret):
+        raise RuntimeError("WEBHOOK_SECRET_TOKEN must be 16-256 characters of A-Z, a-z, 0-9, _ or - in webhook mode")
+
     return Settings(
         telegram_bot_token=token,
         llm_base_url=base_url,
@@ -79,6 +281,78 @@ def load_settings() -> Settings:
         request_temperature=_read_float("REQUEST_TEMPERATURE", 0.25),
         agent_models=_read_models(default_model=default_model),
         daily_api_limit=_read_int("DAILY_API_LIMIT", 50),
+        daily_token_limit=_read_int("DAILY_TOKEN_LIMIT", 0, min_value=0),
         storage_path=os.getenv("STORAGE_PATH", "bot_data.sqlite3").strip() or "bot_data.sqlite3",
         history_window=_read_int("HISTORY_WINDOW", 4),
+        summary_max_chars=_read_int("SUMMARY_MAX_CHARS", 1200, min_value=200),
+        default_context_tokens=_read_int("DEFAULT_CONTEXT_TOKENS", 32_768, min_value=1024),
+        model_context_tokens=_read_context_limits(),
+        max_prompt_tokens=_read_int("MAX_PROMPT_TOKENS", 6_000, min_value=500),
+        llm_pool_max_connections=_read_int("LLM_POOL_MAX_CONNECTIONS", 20),
+        llm_pool_max_keepalive=_read_int("LLM_POOL_MAX_KEEPALIVE", 10),
+        llm_keepalive_seconds=_read_float("LLM_KEEPALIVE_SECONDS", 60.0),
+        llm_http2=_read_bool("LLM_HTTP2", False),
+        stream_answers=_read_bool("STREAM_ANSWERS", True),
+        stream_edit_interval_seconds=_read_float("STREAM_EDIT_INTERVAL_SECONDS", 1.5),
+        llm_max_concurrency=_read_int("LLM_MAX_CONCURRENCY", 4),
+        llm_min_concurrency=_read_int("LLM_MIN_CONCURRENCY", 1),
+        llm_queue_timeout_seconds=_read_float("LLM_QUEUE_TIMEOUT_SECONDS", 60.0),
+        llm_rate_limit_backoff_seconds=_read_float("LLM_RATE_LIMIT_BACKOFF_SECONDS", 2.0),
+        fallback_models=_read_list("FALLBACK_MODELS"),
+        model_failure_threshold=_read_int("MODEL_FAILURE_THRESHOLD", 3),
+        model_cooldown_seconds=_read_float("MODEL_COOLDOWN_SECONDS", 60.0),
+        model_slow_call_seconds=_read_float("MODEL_SLOW_CALL_SECONDS", 60.0),
+        hedge_agents=_read_bool("HEDGE_AGENTS", False),
+        hedge_quantile=min(_read_float("HEDGE_QUANTILE", 0.9), 0.99),
+        hedge_min_delay_seconds=_read_float("HEDGE_MIN_DELAY_SECONDS", 3.0),
+        hedge_default_delay_seconds=_read_float("HEDGE_DEFAULT_DELAY_SECONDS", 20.0),
+        llm_cache_enabled=_read_bool("LLM_CACHE_ENABLED", True),
+        llm_cache_max_entries=_read_int("LLM_CACHE_MAX_ENTRIES", 512),
+        llm_cache_ttl_seconds=_read_float("LLM_CACHE_TTL_SECONDS", 86400.0),
+        llm_cache_max_rows=_read_int("LLM_CACHE_MAX_ROWS", 5000),
+        consensus_enabled=_read_bool("CONSENSUS_ENABLED", True),
+        consensus_threshold=min(_read_float("CONSENSUS_THRESHOLD", 0.55), 1.0),
+        mode_topologies={
+            mode: _read_topology(mode, default)
+            for mode, default in DEFAULT_MODE_TOPOLOGIES.items()
+        },
+        speculative_gate=_read_speculative_gate(),
+        top_up_concurrency=max(1, _read_int("TOP_UP_CONCURRENCY", 2)),
+        inflight_policy=_read_inflight_policy(),
+        update_concurrency=_read_int("UPDATE_CONCURRENCY", 32),
+        telegram_pool_size=_read_int("TELEGRAM_POOL_SIZE", 64),
+        telegram_polling_pool_size=_read_int("TELEGRAM_POLLING_POOL_SIZE", 2),
+        telegram_connect_timeout_seconds=max(1.0, _read_float("TELEGRAM_CONNECT_TIMEOUT_SECONDS", 5.0)),
+        telegram_read_timeout_seconds=max(1.0, _read_float("TELEGRAM_READ_TIMEOUT_SECONDS", 10.0)),
+        telegram_write_timeout_seconds=max(1.0, _read_float("TELEGRAM_WRITE_TIMEOUT_SECONDS", 10.0)),
+        telegram_pool_timeout_seconds=max(0.5, _read_float("TELEGRAM_POOL_TIMEOUT_SECONDS", 5.0)),
+        telegram_http2=_read_bool("TELEGRAM_HTTP2", False),
+        update_mode=update_mode,
+        # Render exposes a web service's public URL as RENDER_EXTERNAL_URL.
+        webhook_url=(os.getenv("WEBHOOK_URL", "").strip() or os.getenv("RENDER_EXTERNAL_URL", "").strip()).rstrip("/"),
+        webhook_path=_read_webhook_path(),
+        webhook_listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip() or "0.0.0.0",
+        # Render and most PaaS hosts hand the port to bind through PORT.
+        webhook_port=_read_int("WEBHOOK_PORT", _read_int("PORT", 8080)),
+        webhook_secret_token=webhook_secret,
+        webhook_max_connections=min(100, _read_int("WEBHOOK_MAX_CONNECTIONS", 40)),
+        scheduler_max_running=_read_int("SCHEDULER_MAX_RUNNING", 4),
+        scheduler_max_waiting=_read_int("SCHEDULER_MAX_WAITING", 50),
+        scheduler_max_wait_seconds=max(1.0, _read_float("SCHEDULER_MAX_WAIT_SECONDS", 180.0)),
+        scheduler_priority_burst=_read_int("SCHEDULER_PRIORITY_BURST", 3),
+        trace_enabled=_read_bool("TRACE_ENABLED", True),
+        trace_path=os.getenv("TRACE_PATH", "traces.jsonl").strip() or "traces.jsonl",
+        trace_max_bytes=_read_int("TRACE_MAX_BYTES", 5_000_000),
+        trace_backups=_read_int("TRACE_BACKUPS", 3, min_value=0),
+        admin_chat_ids=_read_chat_ids("ADMIN_CHAT_IDS"),
+        telegram_api_base_url=os.getenv("TELEGRAM_API_BASE_URL", "").strip().rstrip("/"),
+        search_duckduckgo_url=os.getenv("SEARCH_DUCKDUCKGO_URL", "").strip(),
+        search_wikipedia_url=os.getenv("SEARCH_WIKIPEDIA_URL", "").strip(),
+        cassette_mode=_read_cassette_mode(),
+        cassette_path=os.getenv("HTTP_CASSETTE_PATH", "cassette.jsonl").strip() or "cassette.jsonl",
+        cassette_replay_timing=_read_bool("HTTP_CASSETTE_TIMING", False),
+        mode_deadlines={
+            mode: _read_non_negative_float(f"{mode.upper()}_DEADLINE_SECONDS", default)
+            for mode, default in DEFAULT_MODE_DEADLINES.items()
+        },
     )
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import importlib.util
+import logging
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import httpx
+
+from app.cassette import cassette_transport
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry_seconds: float = 60.0
+    http2: bool = False
+
+
+_settings = PoolSettings()
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def configure_pool(settings: PoolSettings) -> None:
+    global _settings
+    _settings = settings
+
+
+def _origin(url: str) -> str:
+    parsed = urlparse(url.strip())
+    return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    key = _origin(url)
+    client = _clients.get(key)
+    if client is not None and not client.is_closed:
+        return client
+
+    use_http2 = _settings.http2
+    if use_http2 and not http2_available():
+        logger.warning("HTTP/2 requested but the 'h2' package is missing, falling back to HTTP/1.1")
+        use_http2 = False
+
+    limits = httpx.Limits(
+        max_connections=_settings.max_connections,
+        max_keepalive_connections=_settings.max_keepalive_connections,
+        keepalive_expiry=_settings.keepalive_expiry_seconds,
+    )
+    client = httpx.AsyncClient(
+        http2=use_http2,
+        limits=limits,
+        transport=cassette_transport(http2=use_http2, limits=limits),
+    )
+    _clients[key] = client
+    return client
+
+
+async def close_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception:
+            logger.exception("Failed to close pooled HTTP client")
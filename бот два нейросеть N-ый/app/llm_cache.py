@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app.storage import BotStorage
+
+
+@dataclass(frozen=True)
+class CacheSettings:
+    max_entries: int = 512
+    ttl_seconds: float = 86400.0
+    max_rows: int = 5000
+
+
+class ResponseCache:
+    # Two tiers: an in-process LRU in front of the llm_cache table in BotStorage.
+    def __init__(self, storage: BotStorage | None, settings: CacheSettings) -> None:
+        self._storage = storage
+        self._settings = settings
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        endpoint: str,
+        key_hash: str,
+        model: str,
+        messages: list[dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+    ) -> str:
+        # Keyed by the API key hash like the limiter: two keys on one endpoint may see different models.
+        raw = json.dumps(
+            [endpoint, key_hash, model, messages, round(temperature, 4), max_tokens],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self._memory[key]
+
+        if self._storage is not None:
+            stored = self._storage.get_cached_response(key, now=now)
+            if stored is not None:
+                value, expires_at = stored
+                self._remember(key, value, expires_at)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        expires_at = time.time() + self._settings.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self._storage is not None:
+            self._storage.put_cached_response(
+                key,
+                value,
+                expires_at=expires_at,
+                max_rows=self._settings.max_rows,
+            )
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._settings.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._memory),
+        }
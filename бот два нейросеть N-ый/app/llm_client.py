@@ -1,10 +1,47 @@
 from __future__ import annotations
 
-from collections.abc import Callable
+import asyncio
+import hashlib
+import json
+import time
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass
 from typing import Any
 
 import httpx
 
+from app import tracing
+from app.http_pool import get_client
+from app.llm_cache import ResponseCache
+from app.model_health import get_health
+from app.rate_limit import get_limiter, parse_retry_after
+from app.single_flight import SingleFlight
+
+
+_flights = SingleFlight()
+
+
+def coalescing_stats() -> dict[str, int]:
+    return _flights.stats()
+
+
+class LLMRateLimitError(RuntimeError):
+    def __init__(self, retry_after: float | None) -> None:
+        super().__init__("LLM rate limit exceeded (429 Too Many Requests)")
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class LLMUsage:
+    model: str
+    stage: str
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
 
 class LLMClient:
     def __init__(
@@ -13,13 +50,18 @@ class LLMClient:
         api_key: str,
         model: str,
         timeout_seconds: float,
-        on_request_complete: Callable[[], None] | None = None,
+        on_request_complete: Callable[[LLMUsage], None] | None = None,
+        cache: ResponseCache | None = None,
+        on_request_cancelled: Callable[[str, str], None] | None = None,
     ) -> None:
         self._url = self._build_url(base_url)
         self._api_key = api_key
+        self._key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
         self._model = model
         self._timeout = timeout_seconds
         self._on_request_complete = on_request_complete
+        self._on_request_cancelled = on_request_cancelled
+        self._cache = cache
 
     @property
     def default_model(self) -> str:
@@ -34,44 +76,269 @@ class LLMClient:
             return f"{url}/chat/completions"
         return f"{url}/v1/chat/completions"
 
-    async def chat(
-        self,
-        messages: list[dict[str, str]],
-        temperature: float,
-        max_tokens: int = 900,
-        model: str | None = None,
-    ) -> str:
+    def _headers(self) -> dict[str, str]:
         headers: dict[str, str] = {
             "Content-Type": "application/json",
         }
         if self._api_key:
             headers["Authorization"] = f"Bearer {self._api_key}"
+        return headers
 
+    def _payload(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        model: str | None,
+        stream: bool,
+    ) -> dict[str, Any]:
         payload: dict[str, Any] = {
             "model": (model or self._model).strip() or self._model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
-            "stream": False,
+            "stream": stream,
         }
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def model_state(self, model: str) -> str:
+        return get_health().state(self._url, model)
 
-        async with httpx.AsyncClient(timeout=self._timeout) as client:
-            response = await client.post(self._url, json=payload, headers=headers)
-            response.raise_for_status()
-            if self._on_request_complete:
-                self._on_request_complete()
+    def model_proven(self, model: str) -> bool:
+        return get_health().proven(self._url, model)
+
+    def rank_models(self, models: list[str]) -> list[str]:
+        return get_health().ranked(self._url, models)
+
+    def latency_quantile(self, model: str, quantile: float, stage: str = "") -> float | None:
+        return get_health().latency_quantile(self._url, model, quantile, stage)
+
+    @staticmethod
+    def _is_health_failure(error: Exception) -> bool:
+        # 429s are quota pressure (handled by the rate limiter) and most 4xx are our own fault.
+        if isinstance(error, LLMRateLimitError):
+            return False
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return status >= 500 or status in {404, 408}
+        return True
+
+    def _report_usage(self, model: str, stage: str, usage: object) -> None:
+        prompt_tokens = 0
+        completion_tokens = 0
+        if isinstance(usage, dict):
+            try:
+                prompt_tokens = int(usage.get("prompt_tokens") or 0)
+                completion_tokens = int(usage.get("completion_tokens") or 0)
+            except (TypeError, ValueError):
+                prompt_tokens = completion_tokens = 0
+        tracing.add_to_attribute("prompt_tokens", prompt_tokens)
+        tracing.add_to_attribute("completion_tokens", completion_tokens)
+        if not self._on_request_complete:
+            return
+        self._on_request_complete(
+            LLMUsage(
+                model=model,
+                stage=stage,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+        )
+
+    def _report_cancelled(self, model: str, stage: str) -> None:
+        # Called only once the request has left the limiter queue: the upstream already counts it.
+        if self._on_request_cancelled:
+            self._on_request_cancelled(model, stage)
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response) -> None:
+        if response.status_code == 429:
+            raise LLMRateLimitError(parse_retry_after(response.headers))
+        response.raise_for_status()
+
+    async def chat(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float,
+        max_tokens: int = 900,
+        model: str | None = None,
+        cache: bool = False,
+        stage: str = "",
+        coalesce: bool = True,
+    ) -> str:
+        payload = self._payload(messages, temperature, max_tokens, model, stream=False)
+        request_key = ResponseCache.make_key(
+            self._url, self._key_hash, payload["model"], messages, temperature, max_tokens
+        )
+        use_cache = cache and self._cache is not None
+
+        with tracing.span("llm.chat", model=payload["model"], stage=stage) as span:
+            if use_cache:
+                cached = self._cache.get(request_key)
+                if cached is not None:
+                    span.set("cached", True)
+                    return cached
+
+            async def produce() -> str:
+                content = await self._complete(payload, stage)
+                if use_cache:
+                    self._cache.put(request_key, content)
+                return content
+
+            if not coalesce:
+                return await produce()
+            return await _flights.run(request_key, produce)
+
+    async def _complete(self, payload: dict[str, Any], stage: str) -> str:
+        client = get_client(self._url)
+        model_name = payload["model"]
+        limiter = get_limiter(self._url, self._api_key, model_name)
+        health = get_health()
+        await limiter.acquire()
+        health.record_start(self._url, model_name)
+        started = time.monotonic()
+        try:
+            response = await client.post(self._url, json=payload, headers=self._headers(), timeout=self._timeout)
+            limiter.observe(response.status_code, response.headers)
+            self._raise_for_status(response)
             data = response.json()
+            self._report_usage(model_name, stage, data.get("usage") if isinstance(data, dict) else None)
+            content = self._content_from_completion(data)
+        except asyncio.CancelledError:
+            health.record_cancelled(self._url, model_name)
+            self._report_cancelled(model_name, stage)
+            raise
+        except Exception as error:
+            if self._is_health_failure(error):
+                health.record_failure(self._url, model_name, time.monotonic() - started)
+            raise
+        finally:
+            limiter.release()
+
+        health.record_success(self._url, model_name, time.monotonic() - started, stage)
+        return content
+
+    async def chat_stream(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float,
+        max_tokens: int = 900,
+        model: str | None = None,
+        stage: str = "",
+    ) -> AsyncIterator[str]:
+        payload = self._payload(messages, temperature, max_tokens, model, stream=True)
 
-        choices = data.get("choices")
+        client = get_client(self._url)
+        model_name = payload["model"]
+        limiter = get_limiter(self._url, self._api_key, model_name)
+        health = get_health()
+        received = False
+        first_token: float | None = None
+        usage: object = None
+        await limiter.acquire()
+        health.record_start(self._url, model_name)
+        started = time.monotonic()
+        try:
+            async with client.stream(
+                "POST",
+                self._url,
+                json=payload,
+                headers=self._headers(),
+                timeout=self._timeout,
+            ) as response:
+                limiter.observe(response.status_code, response.headers)
+                self._raise_for_status(response)
+                if "text/event-stream" not in response.headers.get("content-type", ""):
+                    # Some OpenAI-compatible servers ignore "stream" and answer with a plain completion.
+                    await response.aread()
+                    data = response.json()
+                    self._report_usage(model_name, stage, data.get("usage") if isinstance(data, dict) else None)
+                    content = self._content_from_completion(data)
+                    health.record_success(self._url, model_name, time.monotonic() - started, stage)
+                    yield content
+                    return
+
+                async for line in response.aiter_lines():
+                    data = self._parse_sse_line(line)
+                    if data is None:
+                        continue
+                    if data == "[DONE]":
+                        break
+                    chunk = self._parse_chunk(data)
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    delta = self._extract_delta(chunk)
+                    if delta:
+                        if not received:
+                            first_token = time.monotonic() - started
+                        received = True
+                        yield delta
+            if not received:
+                raise RuntimeError("LLM returned empty response")
+        except (asyncio.CancelledError, GeneratorExit):
+            health.record_cancelled(self._url, model_name)
+            self._report_cancelled(model_name, stage)
+            raise
+        except Exception as error:
+            if self._is_health_failure(error):
+                health.record_failure(self._url, model_name, time.monotonic() - started)
+            raise
+        finally:
+            limiter.release()
+
+        self._report_usage(model_name, stage, usage)
+        health.record_success(self._url, model_name, time.monotonic() - started, stage, first_token)
+
+    @staticmethod
+    def _content_from_completion(data: Any) -> str:
+        choices = data.get("choices") if isinstance(data, dict) else None
         if not isinstance(choices, list) or not choices:
             raise RuntimeError("LLM returned no choices")
 
         message = choices[0].get("message", {})
-        content = self._extract_content(message=message, choice=choices[0])
+        content = LLMClient._extract_content(message=message, choice=choices[0])
         if not content:
             raise RuntimeError("LLM returned empty response")
         return content
 
+    @staticmethod
+    def _parse_sse_line(line: str) -> str | None:
+        # SSE comments (": OPENROUTER PROCESSING") and event/id fields carry no content.
+        if not line.startswith("data:"):
+            return None
+        return line[len("data:") :].strip()
+
+    @staticmethod
+    def _parse_chunk(data: str) -> dict[str, Any]:
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            return {}
+        return chunk if isinstance(chunk, dict) else {}
+
+    @staticmethod
+    def _extract_delta(chunk: dict[str, Any]) -> str:
+        error = chunk.get("error")
+        if error:
+            message = error.get("message") if isinstance(error, dict) else error
+            raise RuntimeError(f"LLM stream error: {message}")
+
+        choices = chunk.get("choices")
+        if not isinstance(choices, list) or not choices or not isinstance(choices[0], dict):
+            return ""
+
+        delta = choices[0].get("delta")
+        if isinstance(delta, dict):
+            content = delta.get("content")
+            if isinstance(content, str):
+                return content
+            return LLMClient._normalize_content(content)
+
+        text = choices[0].get("text")
+        return text if isinstance(text, str) else ""
+
     @staticmethod
     def _extract_content(message: object, choice: object) -> str:
         if isinstance(message, dict):
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import logging
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HealthSettings:
+    failure_threshold: int = 3
+    cooldown_seconds: float = 60.0
+    slow_call_seconds: float = 60.0
+    window: int = 20
+
+
+@dataclass
+class _ModelStats:
+    outcomes: deque[bool]
+    latencies: deque[float]
+    # Successful calls only, per pipeline stage: agent answers run far longer than gate verdicts.
+    stage_latencies: dict[str, deque[float]] = field(default_factory=dict)
+    consecutive_failures: int = 0
+    opened_at: float | None = None
+    probing: bool = False
+    total_calls: int = 0
+    total_failures: int = 0
+
+
+@dataclass
+class ModelHealth:
+    settings: HealthSettings = field(default_factory=HealthSettings)
+    _stats: dict[tuple[str, str], _ModelStats] = field(default_factory=dict)
+
+    def _get(self, endpoint: str, model: str) -> _ModelStats:
+        key = (endpoint, model)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = _ModelStats(
+                outcomes=deque(maxlen=self.settings.window),
+                latencies=deque(maxlen=self.settings.window),
+            )
+            self._stats[key] = stats
+        return stats
+
+    def state(self, endpoint: str, model: str) -> str:
+        stats = self._stats.get((endpoint, model))
+        if stats is None or stats.opened_at is None:
+            return "closed"
+        if stats.probing or time.monotonic() - stats.opened_at < self.settings.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def record_start(self, endpoint: str, model: str) -> None:
+        if self.state(endpoint, model) == "half_open":
+            self._get(endpoint, model).probing = True
+
+    def record_cancelled(self, endpoint: str, model: str) -> None:
+        stats = self._stats.get((endpoint, model))
+        if stats is not None:
+            stats.probing = False
+
+    def record_success(
+        self,
+        endpoint: str,
+        model: str,
+        latency: float,
+        stage: str = "",
+        first_token: float | None = None,
+    ) -> None:
+        # A streamed answer may legitimately run for minutes; only a slow first token marks the model as slow.
+        responsiveness = latency if first_token is None else first_token
+        if responsiveness > self.settings.slow_call_seconds:
+            self.record_failure(endpoint, model, latency)
+            return
+
+        stats = self._get(endpoint, model)
+        stats.outcomes.append(True)
+        stats.latencies.append(latency)
+        if stage:
+            stats.stage_latencies.setdefault(stage, deque(maxlen=self.settings.window)).append(latency)
+        stats.total_calls += 1
+        stats.consecutive_failures = 0
+        stats.probing = False
+        if stats.opened_at is not None:
+            logger.info("Circuit closed for model %s", model)
+            stats.opened_at = None
+
+    def record_failure(self, endpoint: str, model: str, latency: float) -> None:
+        stats = self._get(endpoint, model)
+        stats.outcomes.append(False)
+        stats.latencies.append(latency)
+        stats.total_calls += 1
+        stats.total_failures += 1
+        stats.consecutive_failures += 1
+
+        if stats.probing or stats.consecutive_failures >= self.settings.failure_threshold:
+            if stats.opened_at is None or stats.probing:
+                logger.warning(
+                    "Circuit opened for model %s after %s consecutive failures",
+                    model,
+                    stats.consecutive_failures,
+                )
+            stats.opened_at = time.monotonic()
+        stats.probing = False
+
+    def success_rate(self, endpoint: str, model: str) -> float:
+        stats = self._stats.get((endpoint, model))
+        if stats is None or not stats.outcomes:
+            return 1.0
+        return sum(stats.outcomes) / len(stats.outcomes)
+
+    def latency_quantile(self, endpoint: str, model: str, quantile: float, stage: str = "") -> float | None:
+        stats = self._stats.get((endpoint, model))
+        if stats is None:
+            return None
+        latencies = stats.stage_latencies.get(stage) if stage else stats.latencies
+        if not latencies:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, max(0, int(round(quantile * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def has_record(self, endpoint: str, model: str) -> bool:
+        stats = self._stats.get((endpoint, model))
+        return stats is not None and bool(stats.outcomes)
+
+    def proven(self, endpoint: str, model: str) -> bool:
+        stats = self._stats.get((endpoint, model))
+        return stats is not None and any(stats.outcomes)
+
+    def score(self, endpoint: str, model: str) -> float:
+        median = self.latency_quantile(endpoint, model, 0.5) or 0.0
+        return self.success_rate(endpoint, model) / (1.0 + median / 10.0)
+
+    def ranked(self, endpoint: str, models: list[str]) -> list[str]:
+        # A model with no record gets the pool's median score, and loses ties to models with one:
+        # it is tried before failing models but never ahead of a proven one.
+        known = {model: self.score(endpoint, model) for model in models if self.has_record(endpoint, model)}
+        prior = statistics.median(known.values()) if known else 1.0
+        return sorted(models, key=lambda model: (known.get(model, prior), model in known), reverse=True)
+
+    def snapshot(self) -> list[dict[str, object]]:
+        rows: list[dict[str, object]] = []
+        for (endpoint, model), stats in self._stats.items():
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "model": model,
+                    "state": self.state(endpoint, model),
+                    "success_rate": round(self.success_rate(endpoint, model), 3),
+                    "p50_latency": self.latency_quantile(endpoint, model, 0.5),
+                    "calls": stats.total_calls,
+                    "failures": stats.total_failures,
+                }
+            )
+        return rows
+
+
+_health = ModelHealth()
+
+
+def configure_health(settings: HealthSettings) -> None:
+    global _health
+    _health = ModelHealth(settings=settings)
+
+
+def get_health() -> ModelHealth:
+    return _health
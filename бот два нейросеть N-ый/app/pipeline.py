@@ -1,29 +1,274 @@
 from __future__ import annotations
 
 import asyncio
+import logging
 import re
+import time
 from collections.abc import Awaitable, Callable
 from dataclasses import dataclass
-
-from app.llm_client import LLMClient
+from typing import Any, TypeVar
+
+from app import tracing
+from app.compress import compress_drafts
+from app.config import DEFAULT_MODE_TOPOLOGIES, DEFAULT_PERSONAS, ModeTopology
+from app.llm_client import LLMClient, LLMRateLimitError
+from app.prompt_budget import fit_prompt
+from app.rate_limit import RateLimitQueueTimeout
+from app.similarity import find_consensus, medoid
 from app.web_search import WebHit, format_web_hits, search_web
 
 
+logger = logging.getLogger(__name__)
+
+
 ProgressCallback = Callable[[int, str], Awaitable[None] | None]
+StreamCallback = Callable[[str], Awaitable[None] | None]
+HedgeCallback = Callable[[str], None]
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    quantile: float = 0.9
+    min_delay_seconds: float = 3.0
+    default_delay_seconds: float = 20.0
+
+
+@dataclass(frozen=True)
+class StageBudgets:
+    # Shares of the total deadline; time a stage does not use carries over to the next one.
+    search: float = 0.1
+    agents: float = 0.5
+    synthesis: float = 0.25
+    review: float = 0.15
+    min_stage_seconds: float = 3.0
 
 
 @dataclass(frozen=True)
 class PipelineResult:
     answer_text: str
     candidates: list[str]
+    skipped_stages: tuple[str, ...] = ()
+    admission_wait_seconds: float = 0.0
+    timings: tuple[StageTiming, ...] = ()
+
+
+class AdmissionDenied(RuntimeError):
+    pass
+
+
+@dataclass
+class _AgentRound:
+    candidates: list[str]
+    consensus: list[int]
+    failed: list[int]
+    timed_out: bool = False
+
+
+class _Deadline:
+    _ORDER = ("search", "agents", "synthesis", "review")
+
+    def __init__(self, total_seconds: float | None, budgets: StageBudgets) -> None:
+        self._budgets = budgets
+        self._started = time.monotonic()
+        self._total = None if total_seconds is None else max(0.0, total_seconds)
+
+    def left(self, stage: str | None = None) -> float | None:
+        if self._total is None:
+            return None
+        share = 1.0
+        if stage is not None:
+            shares = [getattr(self._budgets, name) for name in self._ORDER]
+            share = sum(shares[: self._ORDER.index(stage) + 1]) / (sum(shares) or 1.0)
+        return self._started + self._total * share - time.monotonic()
+
+    def allows(self, stage: str | None = None) -> bool:
+        left = self.left(stage)
+        return left is None or left >= self._budgets.min_stage_seconds
+
+
+async def _within(awaitable: Awaitable[T], timeout: float | None) -> T:
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, max(0.0, timeout))
+
+
+@dataclass(frozen=True)
+class StageTiming:
+    name: str
+    status: str
+    started_at: float
+    seconds: float
+
 
+class StageContext:
+    def __init__(self, results: dict[str, Any], report: Callable[[float, str], Awaitable[None]]) -> None:
+        self.results = results
+        self._report = report
 
-_AGENT_SYSTEM_PROMPTS = [
-    "Ты агент 1. Отвечай строго с опорой на библейский текст и указывай стихи.",
-    "Ты агент 2. Дай богословское объяснение с аккуратными ссылками на Писание.",
-    "Ты агент 3. Будь максимально осторожен: где есть сомнение, явно помечай это.",
-    "Ты агент 4. Проверяй согласованность между Ветхим и Новым Заветом.",
-]
+    async def progress(self, fraction: float, text: str) -> None:
+        await self._report(max(0.0, min(1.0, fraction)), text)
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    run: Callable[[StageContext], Awaitable[Any]]
+    deps: tuple[str, ...] = ()
+    label: str = ""
+    weight: float = 1.0
+    retries: int = 0
+    # Evaluated once the dependencies are done; a stage that is not needed is skipped.
+    when: Callable[[dict[str, Any]], bool] | None = None
+    # Seconds left for the stage when it starts; None means no limit.
+    timeout: Callable[[], float | None] | None = None
+    # Result used when the stage fails, times out or has no time to start; without it errors propagate.
+    fallback: Callable[[dict[str, Any]], Any] | None = None
+
+
+class StageGraph:
+    # Runs stages as soon as their dependencies finish; independent stages run concurrently.
+    def __init__(self, stages: list[Stage], min_stage_seconds: float = 0.0) -> None:
+        self._stages = {stage.name: stage for stage in stages}
+        self._min_stage_seconds = min_stage_seconds
+        for stage in stages:
+            unknown = [dep for dep in stage.deps if dep not in self._stages]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages: {', '.join(unknown)}")
+        self._order = self._sorted()
+
+    def _sorted(self) -> list[Stage]:
+        ordered: list[Stage] = []
+        state: dict[str, str] = {}
+
+        def visit(name: str) -> None:
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Stage graph has a cycle through {name}")
+            state[name] = "visiting"
+            for dep in self._stages[name].deps:
+                visit(dep)
+            state[name] = "done"
+            ordered.append(self._stages[name])
+
+        for name in self._stages:
+            visit(name)
+        return ordered
+
+    async def run(
+        self,
+        progress_callback: ProgressCallback | None = None,
+        first_percent: int = 8,
+        last_percent: int = 97,
+    ) -> tuple[dict[str, Any], list[StageTiming]]:
+        results: dict[str, Any] = {}
+        timings: list[StageTiming] = []
+        finished: set[str] = set()
+        running: dict[asyncio.Task[tuple[str, Any]], Stage] = {}
+        partial: dict[str, float] = {}
+        started = time.monotonic()
+        total_weight = sum(stage.weight for stage in self._order) or 1.0
+        done_weight = 0.0
+
+        def percent() -> int:
+            fraction = (done_weight + sum(partial.values())) / total_weight
+            return first_percent + int((last_percent - first_percent) * min(1.0, fraction))
+
+        def reporter(stage: Stage) -> Callable[[float, str], Awaitable[None]]:
+            async def report(fraction: float, text: str) -> None:
+                partial[stage.name] = stage.weight * fraction
+                await _report_progress(progress_callback, percent(), text)
+
+            return report
+
+        try:
+            while len(finished) < len(self._order):
+                for stage in self._order:
+                    if stage.name in finished or stage in running.values():
+                        continue
+                    if not all(dep in finished for dep in stage.deps):
+                        continue
+                    if stage.when is not None and not stage.when(results):
+                        results[stage.name] = None
+                        finished.add(stage.name)
+                        done_weight += stage.weight
+                        timings.append(StageTiming(stage.name, "skipped", time.monotonic() - started, 0.0))
+                        continue
+                    ctx = StageContext(results, reporter(stage))
+                    task = asyncio.create_task(self._run_stage(stage, ctx))
+                    running[task] = stage
+                    timings.append(StageTiming(stage.name, "running", time.monotonic() - started, 0.0))
+                    if stage.label:
+                        await _report_progress(progress_callback, percent(), stage.label)
+
+                if not running:
+                    continue
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    status, value = task.result()
+                    results[stage.name] = value
+                    finished.add(stage.name)
+                    partial.pop(stage.name, None)
+                    done_weight += stage.weight
+                    for idx, timing in enumerate(timings):
+                        if timing.name == stage.name:
+                            elapsed = time.monotonic() - started - timing.started_at
+                            timings[idx] = StageTiming(stage.name, status, timing.started_at, elapsed)
+        finally:
+            for task in running:
+                task.cancel()
+
+        logger.info(
+            "Pipeline stages: %s",
+            ", ".join(f"{timing.name}={timing.status}/{timing.seconds:.2f}s" for timing in timings),
+        )
+        return results, timings
+
+    async def _run_stage(self, stage: Stage, ctx: StageContext) -> tuple[str, Any]:
+        with tracing.span(f"stage.{stage.name}") as span:
+            status, value = await self._attempt_stage(stage, ctx)
+            span.set("status", status)
+            return status, value
+
+    async def _attempt_stage(self, stage: Stage, ctx: StageContext) -> tuple[str, Any]:
+        timeout = stage.timeout() if stage.timeout is not None else None
+        if timeout is not None and timeout < self._min_stage_seconds:
+            return "deadline", self._fallback(stage, ctx, None)
+
+        attempt = 0
+        while True:
+            try:
+                remaining = stage.timeout() if stage.timeout is not None else None
+                return "ok", await _within(stage.run(ctx), remaining)
+            except asyncio.TimeoutError:
+                return "deadline", self._fallback(stage, ctx, None)
+            except Exception as exc:
+                attempt += 1
+                if attempt <= stage.retries:
+                    tracing.set_attribute("retries", attempt)
+                    continue
+                tracing.record_error(exc)
+                return "fallback", self._fallback(stage, ctx, exc)
+
+    @staticmethod
+    def _fallback(stage: Stage, ctx: StageContext, exc: Exception | None) -> Any:
+        if stage.fallback is None:
+            if exc is not None:
+                raise exc
+            return None
+        if exc is not None:
+            logger.warning("Stage %s failed, using fallback: %s", stage.name, exc)
+        return stage.fallback(ctx.results)
+
+
+_AGENT_PERSONAS = {
+    "scripture": "Ты агент-библеист. Отвечай строго с опорой на библейский текст и указывай стихи.",
+    "theology": "Ты агент-богослов. Дай богословское объяснение с аккуратными ссылками на Писание.",
+    "cautious": "Ты осторожный агент. Будь максимально осторожен: где есть сомнение, явно помечай это.",
+    "consistency": "Ты агент сверки. Проверяй согласованность между Ветхим и Новым Заветом.",
+}
 
 _LENGTH_INSTRUCTIONS = {
     "very_short": "очень коротко: 1-2 предложения",
@@ -88,6 +333,24 @@ async def _report_progress(callback: ProgressCallback | None, percent: int, stag
         return
 
 
+async def _report_stream(callback: StreamCallback, text: str) -> None:
+    try:
+        maybe = callback(text)
+        if asyncio.iscoroutine(maybe):
+            await maybe
+    except Exception:
+        return
+
+
+def _report_hedge(callback: HedgeCallback | None, event: str) -> None:
+    if callback is None:
+        return
+    try:
+        callback(event)
+    except Exception:
+        return
+
+
 def _style_block(denomination: str, answer_length: str, explain_style: str) -> str:
     return (
         f"Конфессия: {_DENOMINATION_INSTRUCTIONS[denomination]}\n"
@@ -97,23 +360,16 @@ def _style_block(denomination: str, answer_length: str, explain_style: str) -> s
     )
 
 
-def _build_agent_user_prompt(
-    question: str,
-    context_excerpt: str,
-    web_context: str,
-    denomination: str,
-    answer_length: str,
-    explain_style: str,
-) -> str:
+def _build_agent_user_prompt(question: str, context_excerpt: str, web_context: str, style: str) -> str:
     return (
         "История диалога (для понимания контекста):\n"
         f"{context_excerpt or '(пусто)'}\n\n"
         "Текущий вопрос пользователя:\n"
         f"{question}\n\n"
         "Свежие источники из интернета:\n"
-        f"{web_context}\n\n"
+        f"{web_context or '(нет)'}\n\n"
         "Стиль ответа:\n"
-        f"{_style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style)}\n\n"
+        f"{style}\n\n"
         "Требования:\n"
         "1) Пиши только на русском.\n"
         "2) Только тема Библии/Бога/христианского учения.\n"
@@ -122,10 +378,38 @@ def _build_agent_user_prompt(
 
 
 def _is_rate_limit_error(error: Exception) -> bool:
+    if isinstance(error, LLMRateLimitError):
+        return True
+    if isinstance(error, RateLimitQueueTimeout):
+        # Our own limiter queue already waited its full timeout; retrying would only wait again.
+        return False
     text = str(error).lower()
     return "429" in text or "rate limit" in text or "too many requests" in text
 
 
+async def _stream_chat(
+    llm: LLMClient,
+    messages: list[dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    model: str,
+    on_text: StreamCallback,
+    stage: str,
+) -> str:
+    text = ""
+    with tracing.span("llm.stream", model=model, stage=stage):
+        async for delta in llm.chat_stream(
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            model=model,
+            stage=stage,
+        ):
+            text += delta
+            await _report_stream(on_text, text)
+    return text.strip()
+
+
 async def _chat_with_retry(
     llm: LLMClient,
     messages: list[dict[str, str]],
@@ -133,21 +417,39 @@ async def _chat_with_retry(
     max_tokens: int,
     model: str,
     retries: int = 2,
+    on_text: StreamCallback | None = None,
+    stage: str = "",
+    coalesce: bool = True,
 ) -> str:
     last_error: Exception | None = None
     for attempt in range(retries + 1):
         try:
+            if on_text is not None:
+                return await _stream_chat(
+                    llm=llm,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    model=model,
+                    on_text=on_text,
+                    stage=stage,
+                )
             return await llm.chat(
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 model=model,
+                stage=stage,
+                coalesce=coalesce,
             )
         except Exception as error:
             last_error = error
             if attempt >= retries or not _is_rate_limit_error(error):
                 raise
-            await asyncio.sleep(1.1 * (attempt + 1))
+            tracing.set_attribute("retries", attempt + 1)
+            # LLMRateLimitError already paused the shared limiter for Retry-After; the retry just queues.
+            if not isinstance(error, LLMRateLimitError):
+                await asyncio.sleep(1.1 * (attempt + 1))
 
     if last_error:
         raise last_error
@@ -167,7 +469,21 @@ async def _run_single_agent(
     explain_style: str,
     max_tokens: int,
     retries: int,
+    stage: str = "agent",
+    coalesce: bool = True,
+    on_text: StreamCallback | None = None,
 ) -> str:
+    prompt = fit_prompt(
+        model or llm.default_model,
+        max_tokens,
+        {
+            "system": system_prompt,
+            "question": question,
+            "style": _style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style),
+            "web": web_context,
+            "history": context_excerpt,
+        },
+    )
     messages = [
         {
             "role": "system",
@@ -176,12 +492,10 @@ async def _run_single_agent(
         {
             "role": "user",
             "content": _build_agent_user_prompt(
-                question=question,
-                context_excerpt=context_excerpt,
-                web_context=web_context,
-                denomination=denomination,
-                answer_length=answer_length,
-                explain_style=explain_style,
+                question=prompt["question"],
+                context_excerpt=prompt["history"],
+                web_context=prompt["web"],
+                style=prompt["style"],
             ),
         },
     ]
@@ -193,6 +507,9 @@ async def _run_single_agent(
         max_tokens=max_tokens,
         model=model,
         retries=retries,
+        on_text=on_text,
+        stage=stage,
+        coalesce=coalesce,
     )
 
 
@@ -209,10 +526,26 @@ async def _synthesize(
     explain_style: str,
     max_tokens: int,
     retries: int,
+    on_text: StreamCallback | None = None,
+    compressed: bool = False,
 ) -> str:
     numbered_candidates = "\n\n".join(
         f"Черновик {idx}:\n{text}" for idx, text in enumerate(candidates, start=1)
     )
+    compressed_note = (
+        "Повторы между черновиками уже убраны: каждая мысль и ссылка встречается один раз. " if compressed else ""
+    )
+    prompt = fit_prompt(
+        model or llm.default_model,
+        max_tokens,
+        {
+            "question": question,
+            "style": _style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style),
+            "drafts": numbered_candidates,
+            "web": web_context,
+            "history": context_excerpt,
+        },
+    )
 
     messages = [
         {
@@ -220,17 +553,18 @@ async def _synthesize(
             "content": (
                 "Ты главный редактор ответа. Получишь несколько черновиков (обычно 4) от разных моделей. "
                 "Собери единый, точный и понятный ответ на русском. "
+                f"{compressed_note}"
                 "Не показывай черновики пользователю и не упоминай их в финале."
             ),
         },
         {
             "role": "user",
             "content": (
-                f"Контекст диалога:\n{context_excerpt or '(пусто)'}\n\n"
-                f"Вопрос:\n{question}\n\n"
-                f"Свежие источники:\n{web_context}\n\n"
-                f"Черновики:\n{numbered_candidates}\n\n"
-                f"Стиль:\n{_style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style)}\n\n"
+                f"Контекст диалога:\n{prompt['history'] or '(пусто)'}\n\n"
+                f"Вопрос:\n{prompt['question']}\n\n"
+                f"Свежие источники:\n{prompt['web'] or '(нет)'}\n\n"
+                f"Черновики:\n{prompt['drafts']}\n\n"
+                f"Стиль:\n{prompt['style']}\n\n"
                 "Сформируй финал в формате:\n"
                 "- Ответ\n"
                 "- Ссылки на Библию\n"
@@ -246,6 +580,8 @@ async def _synthesize(
         max_tokens=max_tokens,
         model=model,
         retries=retries,
+        on_text=on_text,
+        stage="synthesize",
     )
 
 
@@ -259,7 +595,18 @@ async def _self_review(
     explain_style: str,
     max_tokens: int,
     retries: int,
+    on_text: StreamCallback | None = None,
+    stage: str = "self_review",
 ) -> str:
+    prompt = fit_prompt(
+        model or llm.default_model,
+        max_tokens,
+        {
+            "question": question,
+            "style": _style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style),
+            "draft": draft_answer,
+        },
+    )
     messages = [
         {
             "role": "system",
@@ -275,9 +622,9 @@ async def _self_review(
         {
             "role": "user",
             "content": (
-                f"Вопрос:\n{question}\n\n"
-                f"Требуемый стиль:\n{_style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style)}\n\n"
-                f"Черновой финальный ответ:\n{draft_answer}\n\n"
+                f"Вопрос:\n{prompt['question']}\n\n"
+                f"Требуемый стиль:\n{prompt['style']}\n\n"
+                f"Черновой финальный ответ:\n{prompt['draft']}\n\n"
                 "Дай улучшенный итоговый ответ на русском."
             ),
         },
@@ -290,6 +637,8 @@ async def _self_review(
         max_tokens=max_tokens,
         model=model,
         retries=retries,
+        on_text=on_text,
+        stage=stage,
     )
 
 
@@ -304,6 +653,15 @@ async def _emergency_answer(
     max_tokens: int,
     retries: int,
 ) -> str:
+    prompt = fit_prompt(
+        model or llm.default_model,
+        max_tokens,
+        {
+            "question": question,
+            "style": _style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style),
+            "history": context_excerpt,
+        },
+    )
     messages = [
         {
             "role": "system",
@@ -315,9 +673,9 @@ async def _emergency_answer(
         {
             "role": "user",
             "content": (
-                f"Контекст:\\n{context_excerpt or '(пусто)'}\\n\\n"
-                f"Вопрос:\\n{question}\\n\\n"
-                f"Стиль:\\n{_style_block(denomination=denomination, answer_length=answer_length, explain_style=explain_style)}"
+                f"Контекст:\n{prompt['history'] or '(пусто)'}\n\n"
+                f"Вопрос:\n{prompt['question']}\n\n"
+                f"Стиль:\n{prompt['style']}"
             ),
         },
     ]
@@ -328,37 +686,160 @@ async def _emergency_answer(
         max_tokens=max_tokens,
         model=model,
         retries=retries,
+        stage="emergency",
     )
 
 
-def _mode_profile(reasoning_mode: str, web_results: int) -> dict[str, int | bool | float]:
+def _agent_personas(topology: ModeTopology) -> list[str]:
+    known = [name for name in topology.personas if name in _AGENT_PERSONAS] or list(DEFAULT_PERSONAS)
+    return [known[idx % len(known)] for idx in range(max(1, topology.agents))]
+
+
+def _mode_profile(
+    reasoning_mode: str,
+    web_results: int,
+    topology: ModeTopology | None = None,
+) -> dict[str, int | bool | float | list[str]]:
     mode = _normalize_reasoning_mode(reasoning_mode)
+    shape = topology or DEFAULT_MODE_TOPOLOGIES[mode]
     if mode == "fast":
-        return {
+        profile: dict[str, int | bool | float | list[str]] = {
             "web_results": 0,
             "agent_factor": 0.55,
             "final_factor": 0.55,
-            "self_review": False,
-            "extra_review": False,
             "retries": 1,
+            "consensus_k": 2,
+            "consensus_skips_synthesis": True,
+            "min_candidates": 1,
+            "draft_budget_factor": 1.5,
         }
-    if mode == "deep":
-        return {
+    elif mode == "deep":
+        profile = {
             "web_results": max(web_results, 6),
             "agent_factor": 1.2,
             "final_factor": 1.25,
-            "self_review": True,
-            "extra_review": True,
             "retries": 3,
+            "consensus_k": 0,
+            "consensus_skips_synthesis": False,
+            "min_candidates": 3,
+            "draft_budget_factor": 2.5,
         }
-    return {
-        "web_results": web_results,
-        "agent_factor": 1.0,
-        "final_factor": 1.0,
-        "self_review": True,
-        "extra_review": False,
-        "retries": 2,
-    }
+    else:
+        profile = {
+            "web_results": web_results,
+            "agent_factor": 1.0,
+            "final_factor": 1.0,
+            "retries": 2,
+            "consensus_k": 3,
+            "consensus_skips_synthesis": False,
+            "min_candidates": 3,
+            "draft_budget_factor": 2.0,
+        }
+
+    personas = _agent_personas(shape)
+    profile.update(
+        {
+            "personas": personas,
+            "synthesis": shape.synthesis,
+            "self_review": shape.self_review,
+            "extra_review": shape.self_review and shape.extra_review,
+        }
+    )
+    if int(profile["consensus_k"]) > len(personas):
+        profile["consensus_k"] = 0
+    profile["min_candidates"] = min(int(profile["min_candidates"]), len(personas))
+    return profile
+
+
+def _route_models(llm: LLMClient, models: list[str], fallback_models: list[str]) -> list[str]:
+    pool = list(dict.fromkeys(models + fallback_models))
+    healthy = llm.rank_models([model for model in pool if llm.model_state(model) == "closed"])
+
+    routed: list[str] = []
+    probed: set[str] = set()
+    replacements = 0
+    for model in models:
+        state = llm.model_state(model)
+        if state == "closed":
+            routed.append(model)
+            continue
+        # A half-open model gets exactly one agent slot as its recovery probe.
+        if state == "half_open" and model not in probed:
+            probed.add(model)
+            routed.append(model)
+            continue
+        if healthy:
+            routed.append(healthy[replacements % len(healthy)])
+            replacements += 1
+        else:
+            routed.append(model)
+    return routed
+
+
+def _hedge_delay(llm: LLMClient, model: str, policy: HedgePolicy | None) -> float | None:
+    if policy is None:
+        return None
+    # Only agent answers count: gate, synthesis and review calls on the same model have other lengths.
+    learned = llm.latency_quantile(model, policy.quantile, stage="agent")
+    if learned is None:
+        return policy.default_delay_seconds
+    return max(policy.min_delay_seconds, learned)
+
+
+def _rotate_model(llm: LLMClient, model: str, pool: list[str], offset: int) -> str:
+    alternates = llm.rank_models([item for item in pool if item != model and llm.model_state(item) == "closed"])
+    # A top-up recovers a failed slot, so it goes to models that have answered on this endpoint;
+    # untried ones only when there are none, never into a round of guesses on a degraded upstream.
+    proven = [item for item in alternates if llm.model_proven(item)]
+    choices = proven or alternates
+    if not choices:
+        return model
+    return choices[offset % len(choices)]
+
+
+def _hedge_model(llm: LLMClient, model: str, pool: list[str]) -> str:
+    alternates = llm.rank_models([item for item in pool if item != model and llm.model_state(item) == "closed"])
+    return alternates[0] if alternates else model
+
+
+async def _run_hedged(
+    call: Callable[[str, bool], Awaitable[str]],
+    model: str,
+    hedge_model: str,
+    delay: float | None,
+    on_hedge: HedgeCallback | None,
+) -> str:
+    primary = asyncio.create_task(call(model, True))
+    if delay is None:
+        return await primary
+
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return primary.result()
+
+        _report_hedge(on_hedge, "started")
+        # A same-model hedge must bypass single-flight, otherwise it would just join the primary call.
+        hedge = asyncio.create_task(call(hedge_model, hedge_model != model))
+        tasks.append(hedge)
+        pending: set[asyncio.Task[str]] = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                # A loser that was already sent is billed through LLMClient's on_request_cancelled.
+                for loser in pending:
+                    loser.cancel()
+                if task is hedge:
+                    _report_hedge(on_hedge, "won")
+                return task.result()
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
 
 def _cleanup_answer(text: str) -> str:
@@ -379,14 +860,30 @@ def _cleanup_answer(text: str) -> str:
     return normalized
 
 
-def _append_sources(answer_text: str, hits: list[WebHit]) -> str:
+def _models_word(count: int) -> str:
+    if count % 10 == 1 and count % 100 != 11:
+        return "модель"
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return "модели"
+    return "моделей"
+
+
+def _verification_note(models_used: int, reviewed: bool) -> str:
+    note = "Ответ одной модели" if models_used <= 1 else f"Проверено {models_used} моделями"
+    if reviewed:
+        note += " и финальной самопроверкой"
+    return f"{note}."
+
+
+def _append_sources(answer_text: str, hits: list[WebHit], models_used: int = 4, reviewed: bool = True) -> str:
+    note = _verification_note(models_used, reviewed)
     if not hits:
-        return f"{answer_text}\n\nПроверено 4 моделями и финальной самопроверкой."
+        return f"{answer_text}\n\n{note}"
 
     links = "\n".join(f"- {hit.url}" for hit in hits[:3])
     return (
         f"{answer_text}\n\n"
-        "Проверено 4 моделями и финальной самопроверкой.\n"
+        f"{note}\n"
         "Свежие ссылки:\n"
         f"{links}"
     )
@@ -403,181 +900,399 @@ async def run_pipeline(
     answer_length: str = "long",
     explain_style: str = "orthodox",
     reasoning_mode: str = "balanced",
+    topology: ModeTopology | None = None,
+    fallback_models: list[str] | None = None,
+    hedge: HedgePolicy | None = None,
+    consensus_threshold: float | None = None,
+    deadline_seconds: float | None = None,
+    budgets: StageBudgets | None = None,
+    admission: Awaitable[bool] | None = None,
+    top_up_concurrency: int = 2,
     progress_callback: ProgressCallback | None = None,
+    stream_callback: StreamCallback | None = None,
+    hedge_callback: HedgeCallback | None = None,
 ) -> PipelineResult:
+    budgets = budgets or StageBudgets()
+    deadline = _Deadline(deadline_seconds, budgets)
     denomination = _normalize_denomination(denomination)
     answer_length = _normalize_answer_length(answer_length)
     explain_style = _normalize_explain_style(explain_style)
-    mode = _mode_profile(reasoning_mode=reasoning_mode, web_results=web_results)
+    mode = _mode_profile(reasoning_mode=reasoning_mode, web_results=web_results, topology=topology)
     selected_web_results = int(mode["web_results"])
     retries = int(mode["retries"])
     agent_max_tokens = max(120, int(_AGENT_MAX_TOKENS[answer_length] * float(mode["agent_factor"])))
     final_max_tokens = max(180, int(_FINAL_MAX_TOKENS[answer_length] * float(mode["final_factor"])))
+    draft_token_budget = int(agent_max_tokens * float(mode["draft_budget_factor"]))
+    personas = list(mode["personas"])
+    agent_count = len(personas)
+    use_synthesis = bool(mode["synthesis"])
     use_self_review = bool(mode["self_review"])
     use_extra_review = bool(mode["extra_review"])
+    consensus_k = int(mode["consensus_k"]) if consensus_threshold is not None else 0
+    min_candidates = int(mode["min_candidates"])
+    # Only the last text-producing stage is streamed to the user.
+    if use_extra_review:
+        final_stage = "extra_review"
+    elif use_self_review:
+        final_stage = "self_review"
+    elif use_synthesis:
+        final_stage = "synthesize"
+    elif agent_count == 1:
+        final_stage = "agent"
+    else:
+        final_stage = ""
 
-    models = list(agent_models or [llm.default_model] * 4)
-    while len(models) < 4:
-        models.append(models[-1])
-    models = models[:4]
+    configured = list(agent_models or [llm.default_model])
+    models = [configured[idx % len(configured)] for idx in range(agent_count)]
+    model_pool = list(dict.fromkeys(models + list(fallback_models or [])))
+    models = _route_models(llm, models, model_pool)
 
-    hits: list[WebHit] = []
-    web_context = "No web results available."
-    if selected_web_results > 0:
-        await _report_progress(progress_callback, 8, "Ищу свежие источники")
+    async def search_stage(ctx: StageContext) -> list[WebHit]:
         query = f"Bible and Christianity question: {question}"
-        hits = await search_web(query, max_results=selected_web_results)
-        web_context = format_web_hits(hits)
-    else:
-        await _report_progress(progress_callback, 8, "Быстрый режим без веб-поиска")
+        return await search_web(query, max_results=selected_web_results)
 
-    await _report_progress(progress_callback, 22, "Запускаю 4 модели")
-    tasks = [
-        asyncio.create_task(
-            _run_single_agent(
-                llm=llm,
-                system_prompt=system_prompt,
-                question=question,
-                context_excerpt=context_excerpt,
-                web_context=web_context,
-                temperature=min(0.9, temperature + idx * 0.1),
-                model=models[idx],
-                denomination=denomination,
-                answer_length=answer_length,
-                explain_style=explain_style,
-                max_tokens=agent_max_tokens,
-                retries=retries,
-            )
-        )
-        for idx, system_prompt in enumerate(_AGENT_SYSTEM_PROMPTS)
-    ]
+    async def admission_stage(ctx: StageContext) -> None:
+        # With a speculative topic gate the search overlaps the gate; agents still wait for its verdict.
+        if admission is not None and not await asyncio.shield(admission):
+            raise AdmissionDenied("Question rejected by the topic gate")
 
-    candidates: list[str] = []
-    completed = 0
-    for future in asyncio.as_completed(tasks):
-        try:
-            result = await future
-            text = result.strip()
-            if text:
-                candidates.append(text)
-        except Exception:
-            pass
-        completed += 1
-        percent = 22 + int((completed / 4) * 48)
-        await _report_progress(progress_callback, percent, f"Модели завершены: {completed}/4")
-
-    # If some parallel calls failed due rate limits, try to top up sequentially.
-    if len(candidates) < 4:
-        await _report_progress(progress_callback, 72, "Добираю недостающие варианты")
-        for idx in range(4):
-            if len(candidates) >= 4:
-                break
-            try:
-                extra = await _run_single_agent(
+    def web_context(results: dict[str, Any]) -> str:
+        return format_web_hits(results.get("search") or [])
+
+    def agent_call(idx: int, context: str) -> Callable[[str, bool], Awaitable[str]]:
+        async def call(model: str, coalesce: bool) -> str:
+            with tracing.span("agent", persona=personas[idx], model=model):
+                return await _run_single_agent(
                     llm=llm,
-                    system_prompt=_AGENT_SYSTEM_PROMPTS[idx],
+                    system_prompt=_AGENT_PERSONAS[personas[idx]],
                     question=question,
                     context_excerpt=context_excerpt,
-                    web_context=web_context,
+                    web_context=context,
                     temperature=min(0.9, temperature + idx * 0.1),
-                    model=models[idx],
+                    model=model,
                     denomination=denomination,
                     answer_length=answer_length,
                     explain_style=explain_style,
                     max_tokens=agent_max_tokens,
-                    retries=max(1, retries - 1),
+                    retries=retries,
+                    coalesce=coalesce,
+                    on_text=stream_callback if final_stage == "agent" else None,
                 )
-                extra = extra.strip()
-                if extra:
-                    candidates.append(extra)
-            except Exception:
-                pass
 
-    if not candidates:
-        await _report_progress(progress_callback, 82, "Пробую резервный режим")
-        try:
-            emergency = await _emergency_answer(
-                llm=llm,
-                question=question,
-                context_excerpt=context_excerpt,
-                denomination=denomination,
-                answer_length=answer_length,
-                explain_style=explain_style,
-                model=models[0],
-                max_tokens=final_max_tokens,
-                retries=max(2, retries),
+        return call
+
+    async def agents_stage(ctx: StageContext) -> _AgentRound:
+        context = web_context(ctx.results)
+        tasks = [
+            asyncio.create_task(
+                _run_hedged(
+                    call=agent_call(idx, context),
+                    model=models[idx],
+                    hedge_model=_hedge_model(llm, models[idx], model_pool),
+                    # Two streams would interleave in the preview, so a streamed agent is never hedged.
+                    delay=None if final_stage == "agent" else _hedge_delay(llm, models[idx], hedge),
+                    on_hedge=hedge_callback,
+                )
             )
-            await _report_progress(progress_callback, 97, "Форматирую итог")
-            final_answer = _cleanup_answer(emergency)
-            final_answer = _append_sources(answer_text=final_answer, hits=hits)
-            return PipelineResult(answer_text=final_answer, candidates=[emergency])
-        except Exception:
-            await _report_progress(progress_callback, 96, "Не удалось собрать ответы")
-            return PipelineResult(
-                answer_text=(
-                    "Не удалось получить ответы от моделей. "
-                    "Попробуйте повторить запрос через минуту."
-                ),
-                candidates=[],
+            for idx in range(agent_count)
+        ]
+
+        round_ = _AgentRound(candidates=[], consensus=[], failed=[])
+        completed = 0
+        pending = set(tasks)
+        try:
+            while pending and not round_.consensus:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=deadline.left("agents"),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # Out of agent budget: keep what has arrived and let synthesis work with it.
+                    round_.timed_out = True
+                    await ctx.progress(1.0, f"Время на модели вышло: {completed}/{agent_count}")
+                    break
+
+                for future in done:
+                    try:
+                        text = future.result().strip()
+                        if text:
+                            round_.candidates.append(text)
+                        else:
+                            round_.failed.append(tasks.index(future))
+                    except Exception:
+                        round_.failed.append(tasks.index(future))
+                    completed += 1
+                await ctx.progress(completed / agent_count, f"Модели завершены: {completed}/{agent_count}")
+
+                if consensus_k and pending and consensus_threshold is not None:
+                    round_.consensus = find_consensus(
+                        round_.candidates,
+                        k=consensus_k,
+                        threshold=consensus_threshold,
+                    )
+                    if round_.consensus:
+                        await ctx.progress(1.0, f"Модели согласны: {len(round_.consensus)}/{agent_count}")
+        finally:
+            for task in tasks:
+                task.cancel()
+        return round_
+
+    def needs_top_up(results: dict[str, Any]) -> bool:
+        round_: _AgentRound = results["agents"]
+        return (
+            bool(round_.failed)
+            and len(round_.candidates) < min_candidates
+            and not round_.consensus
+            and deadline.allows("agents")
+        )
+
+    async def top_up_stage(ctx: StageContext) -> list[str]:
+        # Failed agents are retried once, concurrently and on other healthy models where possible.
+        round_: _AgentRound = ctx.results["agents"]
+        candidates = list(round_.candidates)
+        context = web_context(ctx.results)
+        slots = round_.failed[: max(1, min(top_up_concurrency, agent_count - len(candidates)))]
+        tasks = [
+            asyncio.create_task(
+                _run_single_agent(
+                    llm=llm,
+                    system_prompt=_AGENT_PERSONAS[personas[idx]],
+                    question=question,
+                    context_excerpt=context_excerpt,
+                    web_context=context,
+                    temperature=min(0.9, temperature + idx * 0.1),
+                    model=_rotate_model(llm, models[idx], model_pool, offset),
+                    denomination=denomination,
+                    answer_length=answer_length,
+                    explain_style=explain_style,
+                    max_tokens=agent_max_tokens,
+                    retries=0,
+                    stage="top_up",
+                )
             )
+            for offset, idx in enumerate(slots)
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=deadline.left("agents"))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        for task in tasks:
+            if task not in done or task.exception() is not None:
+                continue
+            extra = task.result().strip()
+            if extra:
+                candidates.append(extra)
+        return candidates
+
+    def candidates_of(results: dict[str, Any]) -> list[str]:
+        return results.get("top_up") or results["agents"].candidates
+
+    def consensus_only(results: dict[str, Any]) -> bool:
+        return bool(results["agents"].consensus) and bool(mode["consensus_skips_synthesis"])
+
+    def writes_answer(results: dict[str, Any]) -> bool:
+        return bool(candidates_of(results)) and not consensus_only(results)
+
+    def emergency_timeout() -> float | None:
+        # The emergency answer always gets at least one minimal stage, even past the deadline.
+        left = deadline.left()
+        return None if left is None else max(left, budgets.min_stage_seconds)
+
+    async def emergency_stage(ctx: StageContext) -> str:
+        return await _emergency_answer(
+            llm=llm,
+            question=question,
+            context_excerpt=context_excerpt,
+            denomination=denomination,
+            answer_length=answer_length,
+            explain_style=explain_style,
+            model=models[0],
+            max_tokens=final_max_tokens,
+            retries=max(2, retries),
+        )
 
-    judge_model = models[0]
-    await _report_progress(progress_callback, 76, "Сверяю варианты")
-    try:
-        draft_final = await _synthesize(
+    def draft_of(results: dict[str, Any]) -> str:
+        candidates = candidates_of(results)
+        return results.get("synthesis") or candidates[medoid(candidates)]
+
+    async def compress_stage(ctx: StageContext) -> list[str]:
+        result = compress_drafts(candidates_of(ctx.results), token_budget=draft_token_budget)
+        tracing.set_attribute("tokens_before", result.tokens_before)
+        tracing.set_attribute("tokens_after", result.tokens_after)
+        tracing.set_attribute("dropped_sentences", result.dropped_sentences)
+        return result.drafts
+
+    async def synthesis_stage(ctx: StageContext) -> str:
+        drafts = ctx.results.get("compress")
+        return await _synthesize(
             llm=llm,
             question=question,
             context_excerpt=context_excerpt,
-            web_context=web_context,
-            candidates=candidates,
+            web_context=web_context(ctx.results),
+            candidates=drafts or candidates_of(ctx.results),
             temperature=temperature,
-            model=judge_model,
+            model=models[0],
             denomination=denomination,
             answer_length=answer_length,
             explain_style=explain_style,
             max_tokens=final_max_tokens,
             retries=retries,
+            on_text=stream_callback if final_stage == "synthesize" else None,
+            compressed=bool(drafts),
         )
-    except Exception:
-        draft_final = candidates[0]
 
-    reviewed_final = draft_final
-    if use_self_review:
-        await _report_progress(progress_callback, 90, "Финальная самопроверка")
-        try:
-            reviewed_final = await _self_review(
+    def reviewed_of(results: dict[str, Any]) -> str:
+        return results.get("self_review") or draft_of(results)
+
+    def review_stage(stage: str) -> Callable[[StageContext], Awaitable[str]]:
+        async def run(ctx: StageContext) -> str:
+            draft = draft_of(ctx.results) if stage == "self_review" else reviewed_of(ctx.results)
+            return await _self_review(
                 llm=llm,
                 question=question,
-                draft_answer=draft_final,
-                model=judge_model,
+                draft_answer=draft,
+                model=models[0],
                 denomination=denomination,
                 answer_length=answer_length,
                 explain_style=explain_style,
                 max_tokens=final_max_tokens,
                 retries=retries,
+                on_text=stream_callback if final_stage == stage else None,
+                stage=stage,
             )
-        except Exception:
-            reviewed_final = draft_final
 
-    if use_extra_review:
-        await _report_progress(progress_callback, 94, "Дополнительная глубокая проверка")
-        try:
-            reviewed_final = await _self_review(
-                llm=llm,
-                question=question,
-                draft_answer=reviewed_final,
-                model=judge_model,
-                denomination=denomination,
-                answer_length=answer_length,
-                explain_style=explain_style,
-                max_tokens=final_max_tokens,
-                retries=retries,
+        return run
+
+    graph = StageGraph(
+        [
+            Stage(
+                name="search",
+                run=search_stage,
+                label="Ищу свежие источники",
+                when=lambda _: selected_web_results > 0,
+                timeout=lambda: deadline.left("search"),
+                fallback=lambda _: [],
+            ),
+            Stage(name="admission", run=admission_stage, weight=0.0, when=lambda _: admission is not None),
+            Stage(
+                name="agents",
+                run=agents_stage,
+                deps=("search", "admission"),
+                label=f"Запускаю {agent_count} {_models_word(agent_count)}",
+                weight=5.0,
+            ),
+            Stage(
+                name="top_up",
+                run=top_up_stage,
+                deps=("agents",),
+                label="Добираю недостающие варианты",
+                when=needs_top_up,
+                fallback=lambda results: results["agents"].candidates,
+            ),
+            Stage(
+                name="emergency",
+                run=emergency_stage,
+                deps=("top_up",),
+                label="Пробую резервный режим",
+                when=lambda results: not candidates_of(results),
+                timeout=emergency_timeout,
+                fallback=lambda _: None,
+            ),
+            Stage(
+                name="compress",
+                run=compress_stage,
+                deps=("top_up",),
+                weight=0.0,
+                when=lambda results: use_synthesis and writes_answer(results) and len(candidates_of(results)) > 1,
+                fallback=lambda _: None,
+            ),
+            Stage(
+                name="synthesis",
+                run=synthesis_stage,
+                deps=("compress",),
+                label="Сверяю варианты",
+                weight=2.0,
+                when=lambda results: use_synthesis and writes_answer(results),
+                timeout=lambda: deadline.left("synthesis"),
+                fallback=draft_of,
+            ),
+            Stage(
+                name="self_review",
+                run=review_stage("self_review"),
+                deps=("synthesis",),
+                label="Финальная самопроверка",
+                when=lambda results: use_self_review and writes_answer(results),
+                timeout=lambda: deadline.left("review"),
+                fallback=lambda _: None,
+            ),
+            Stage(
+                name="extra_review",
+                run=review_stage("extra_review"),
+                deps=("self_review",),
+                label="Дополнительная глубокая проверка",
+                when=lambda results: use_extra_review and writes_answer(results),
+                timeout=lambda: deadline.left("review"),
+                fallback=lambda _: None,
+            ),
+        ],
+        min_stage_seconds=budgets.min_stage_seconds,
+    )
+
+    results, timings = await graph.run(progress_callback)
+    status = {timing.name: timing.status for timing in timings}
+    finished_at = {timing.name: timing.started_at + timing.seconds for timing in timings}
+    skipped = [timing.name for timing in timings if timing.status == "deadline"]
+    if results["agents"].timed_out:
+        skipped.insert(0, "agents")
+    if skipped:
+        logger.info("Deadline cut pipeline stages: %s", ", ".join(skipped))
+
+    hits: list[WebHit] = results.get("search") or []
+    candidates = candidates_of(results)
+    reviewed = False
+    if not candidates:
+        emergency = results.get("emergency")
+        if not emergency:
+            await _report_progress(progress_callback, 96, "Не удалось собрать ответы")
+            return PipelineResult(
+                answer_text=(
+                    "Не удалось получить ответы от моделей. "
+                    "Попробуйте повторить запрос через минуту."
+                ),
+                candidates=[],
+                skipped_stages=tuple(skipped),
+                timings=tuple(timings),
             )
-        except Exception:
-            pass
+        answer_text = emergency
+        candidates = [emergency]
+        models_used = 1
+    elif consensus_only(results):
+        answer_text = candidates[results["agents"].consensus[0]]
+        models_used = len(candidates)
+    else:
+        answer_text = results.get("extra_review") or reviewed_of(results)
+        models_used = len(candidates)
+        reviewed = status.get("self_review") == "ok" or status.get("extra_review") == "ok"
 
     await _report_progress(progress_callback, 97, "Форматирую итог")
-    final_answer = _cleanup_answer(reviewed_final)
-    final_answer = _append_sources(answer_text=final_answer, hits=hits)
-
-    return PipelineResult(answer_text=final_answer, candidates=candidates)
+    final_answer = _cleanup_answer(answer_text)
+    final_answer = _append_sources(
+        answer_text=final_answer,
+        hits=hits,
+        models_used=models_used,
+        reviewed=reviewed,
+    )
+    admission_wait = 0.0
+    if admission is not None:
+        admission_wait = max(0.0, finished_at.get("admission", 0.0) - finished_at.get("search", 0.0))
+
+    return PipelineResult(
+        answer_text=final_answer,
+        candidates=candidates,
+        skipped_stages=tuple(skipped),
+        admission_wait_seconds=admission_wait,
+        timings=tuple(timings),
+    )
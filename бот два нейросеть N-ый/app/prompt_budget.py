@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass, field
+
+from app import tracing
+
+
+logger = logging.getLogger(__name__)
+
+# Higher keeps longer. Sections missing from this table (system prompt, fixed instructions) are never trimmed.
+SECTION_PRIORITY = {
+    "question": 5,
+    "style": 4,
+    "drafts": 3,
+    "draft": 3,
+    "web": 2,
+    "history": 1,
+}
+
+# Even over budget the question keeps its head: a prompt without it cannot be answered at all.
+_MIN_QUESTION_TOKENS = 32
+
+_CYRILLIC = re.compile(r"[а-яё]", re.IGNORECASE)
+_LATIN_OR_DIGIT = re.compile(r"[a-z0-9]", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class BudgetSettings:
+    default_context_tokens: int = 32_768
+    model_context_tokens: dict[str, int] = field(default_factory=dict)
+    max_prompt_tokens: int = 6_000
+    reserve_tokens: int = 200
+
+
+@dataclass(frozen=True)
+class Trim:
+    section: str
+    tokens_before: int
+    tokens_after: int
+
+
+_settings = BudgetSettings()
+
+
+def configure_budget(settings: BudgetSettings) -> None:
+    global _settings
+    _settings = settings
+
+
+def estimate_tokens(text: str) -> int:
+    # BPE vocabularies cover English far better than Russian: ~4 Latin characters per token
+    # versus ~2.5 Cyrillic ones, while punctuation and spaces mostly cost a token per few characters.
+    if not text:
+        return 0
+    cyrillic = len(_CYRILLIC.findall(text))
+    latin = len(_LATIN_OR_DIGIT.findall(text))
+    other = len(text) - cyrillic - latin
+    return int(cyrillic / 2.5 + latin / 4 + other / 3) + 1
+
+
+def context_tokens(model: str) -> int:
+    limits = _settings.model_context_tokens
+    if model in limits:
+        return limits[model]
+    # "qwen3-4b" matches "qwen/qwen3-4b:free"; the longest matching name wins.
+    matches = [name for name in limits if name and name in model]
+    return limits[max(matches, key=len)] if matches else _settings.default_context_tokens
+
+
+def prompt_budget(model: str, max_tokens: int) -> int:
+    available = context_tokens(model) - max_tokens - _settings.reserve_tokens
+    return max(0, min(_settings.max_prompt_tokens, available))
+
+
+def _cut(text: str, tokens: int) -> str:
+    if tokens <= 8:
+        return ""
+    keep = max(1, len(text) * tokens // max(1, estimate_tokens(text)))
+    while keep > 1 and estimate_tokens(text[:keep]) >= tokens:
+        keep = keep * 9 // 10
+    head = text[:keep]
+    # Prefer ending on a line or sentence boundary when one is close enough.
+    boundary = max(head.rfind("\n"), head.rfind(". "))
+    if boundary >= keep * 0.6:
+        head = head[: boundary + 1]
+    return head.rstrip() + "…"
+
+
+def fit_sections(sections: dict[str, str], budget: int) -> tuple[dict[str, str], list[Trim]]:
+    fitted = dict(sections)
+    costs = {name: estimate_tokens(text) for name, text in fitted.items()}
+    overflow = sum(costs.values()) - budget
+    trims: list[Trim] = []
+    trimmable = sorted(
+        (name for name in fitted if name in SECTION_PRIORITY and fitted[name]),
+        key=lambda name: SECTION_PRIORITY[name],
+    )
+    for name in trimmable:
+        if overflow <= 0:
+            break
+        before = costs[name]
+        target = before - overflow
+        if name == "question":
+            target = max(target, min(before, _MIN_QUESTION_TOKENS))
+        if target >= before:
+            continue
+        fitted[name] = _cut(fitted[name], target)
+        after = estimate_tokens(fitted[name])
+        overflow -= before - after
+        trims.append(Trim(section=name, tokens_before=before, tokens_after=after))
+    return fitted, trims
+
+
+def fit_prompt(model: str, max_tokens: int, sections: dict[str, str]) -> dict[str, str]:
+    budget = prompt_budget(model, max_tokens)
+    fitted, trims = fit_sections(sections, budget)
+    tracing.set_attribute("prompt_tokens_estimate", sum(estimate_tokens(text) for text in fitted.values()))
+    tracing.set_attribute("prompt_budget", budget)
+    if trims:
+        summary = ",".join(f"{trim.section}:{trim.tokens_before}->{trim.tokens_after}" for trim in trims)
+        tracing.set_attribute("prompt_trimmed", summary)
+        logger.info("Prompt for %s trimmed to %d tokens: %s", model, budget, summary)
+    return fitted
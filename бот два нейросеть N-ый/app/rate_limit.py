@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import re
+import time
+from collections import deque
+from collections.abc import Mapping
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+
+@dataclass(frozen=True)
+class LimiterSettings:
+    max_concurrency: int = 4
+    min_concurrency: int = 1
+    queue_timeout_seconds: float = 60.0
+    default_backoff_seconds: float = 2.0
+
+
+class RateLimitQueueTimeout(RuntimeError):
+    pass
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def _parse_seconds(raw: str | None) -> float | None:
+    if raw is None:
+        return None
+    value = raw.strip()
+    if not value:
+        return None
+
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+
+    if number is not None:
+        now = time.time()
+        # x-ratelimit-reset is an epoch timestamp on OpenRouter (ms) and a delta elsewhere.
+        if number > 1e12:
+            return max(0.0, number / 1000 - now)
+        if number > 1e9:
+            return max(0.0, number - now)
+        return max(0.0, number)
+
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(f"{num}{unit}" for num, unit in parts) == value:
+        scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+        return sum(float(num) * scale[unit] for num, unit in parts)
+
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    retry_after = _parse_seconds(headers.get("retry-after"))
+    if retry_after is not None:
+        return retry_after
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset"):
+        reset = _parse_seconds(headers.get(name))
+        if reset is not None:
+            return reset
+    return None
+
+
+def _remaining_requests(headers: Mapping[str, str]) -> int | None:
+    for name in ("x-ratelimit-remaining-requests", "x-ratelimit-remaining"):
+        raw = headers.get(name)
+        if raw is None:
+            continue
+        try:
+            return int(float(raw))
+        except ValueError:
+            continue
+    return None
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency window plus a FIFO queue; a 429 halves the window and pauses the whole key.
+    def __init__(self, settings: LimiterSettings) -> None:
+        self._settings = settings
+        self._window = float(settings.max_concurrency)
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease = float("-inf")
+        self._queue: deque[object] = deque()
+        self._changed = asyncio.Event()
+
+    @property
+    def limit(self) -> int:
+        return max(self._settings.min_concurrency, int(self._window))
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def acquire(self) -> None:
+        deadline = time.monotonic() + self._settings.queue_timeout_seconds
+        ticket = object()
+        self._queue.append(ticket)
+        try:
+            while True:
+                now = time.monotonic()
+                if self._queue[0] is ticket and now >= self._blocked_until and self._in_flight < self.limit:
+                    self._in_flight += 1
+                    return
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise RateLimitQueueTimeout("Timed out waiting for an LLM rate limit slot")
+                timeout = remaining
+                if self._blocked_until > now:
+                    timeout = min(timeout, self._blocked_until - now)
+
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._queue.remove(ticket)
+            self._notify()
+
+    def release(self) -> None:
+        self._in_flight = max(0, self._in_flight - 1)
+        self._notify()
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> None:
+        now = time.monotonic()
+        if status_code == 429:
+            delay = parse_retry_after(headers)
+            if delay is None:
+                delay = self._settings.default_backoff_seconds
+            # Concurrent calls of one burst get their 429s together: halve once per backoff, not per reply.
+            if now - self._last_decrease >= max(delay, self._settings.default_backoff_seconds):
+                self._window = max(float(self._settings.min_concurrency), self._window / 2)
+                self._last_decrease = now
+            self._blocked_until = max(self._blocked_until, now + delay)
+            return
+
+        if status_code >= 400:
+            return
+
+        self._window = min(float(self._settings.max_concurrency), self._window + 1 / self._window)
+        if _remaining_requests(headers) == 0:
+            reset = parse_retry_after(headers)
+            if reset:
+                self._blocked_until = max(self._blocked_until, now + reset)
+
+
+_settings = LimiterSettings()
+_limiters: dict[tuple[str, str, str], AdaptiveLimiter] = {}
+
+
+def configure_limits(settings: LimiterSettings) -> None:
+    global _settings
+    _settings = settings
+    _limiters.clear()
+
+
+def get_limiter(base_url: str, api_key: str, model: str) -> AdaptiveLimiter:
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    key = (base_url, key_hash, model)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = AdaptiveLimiter(_settings)
+        _limiters[key] = limiter
+    return limiter
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int, float], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class SchedulerSettings:
+    max_running: int = 4
+    max_waiting: int = 50
+    max_wait_seconds: float = 180.0
+    priority_burst: int = 3
+
+
+class SchedulerFull(RuntimeError):
+    pass
+
+
+@dataclass
+class _Waiter:
+    owner: Hashable
+    priority: bool
+    future: asyncio.Future[None]
+    on_position: PositionCallback | None = None
+    reported: int = 0
+
+
+@dataclass
+class _Tier:
+    # One FIFO per owner; owners take turns, so a user with many questions cannot starve the rest.
+    owners: OrderedDict[Hashable, deque[_Waiter]] = field(default_factory=OrderedDict)
+
+    def push(self, waiter: _Waiter) -> None:
+        self.owners.setdefault(waiter.owner, deque()).append(waiter)
+
+    def pop(self) -> _Waiter:
+        owner, queue = next(iter(self.owners.items()))
+        waiter = queue.popleft()
+        del self.owners[owner]
+        if queue:
+            self.owners[owner] = queue
+        return waiter
+
+    def remove(self, waiter: _Waiter) -> None:
+        queue = self.owners.get(waiter.owner)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self.owners[waiter.owner]
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.owners.values())
+
+
+class FairScheduler:
+    # Bounded pool of concurrent pipelines with per-owner round-robin and a priority tier for cheap jobs.
+    def __init__(self, settings: SchedulerSettings | None = None) -> None:
+        self._settings = settings or SchedulerSettings()
+        self._running = 0
+        self._priority = _Tier()
+        self._normal = _Tier()
+        self._burst = 0
+        self._service_seconds = {True: 15.0, False: 60.0}
+        self._callbacks: set[asyncio.Task[None]] = set()
+        self.served = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._priority) + len(self._normal)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        owner: Hashable,
+        priority: bool = False,
+        on_position: PositionCallback | None = None,
+    ) -> AsyncIterator[float]:
+        waited = await self._acquire(owner, priority, on_position)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            # A moving average of run time per tier drives the ETA shown to waiting users.
+            previous = self._service_seconds[priority]
+            self._service_seconds[priority] = 0.8 * previous + 0.2 * (time.monotonic() - started)
+            self._running -= 1
+            self._dispatch()
+
+    async def _acquire(self, owner: Hashable, priority: bool, on_position: PositionCallback | None) -> float:
+        if self._running < self._settings.max_running and not self.waiting:
+            self._running += 1
+            self.served += 1
+            return 0.0
+        if self.waiting >= self._settings.max_waiting:
+            self.rejected += 1
+            raise SchedulerFull("Too many queued pipelines")
+
+        waiter = _Waiter(owner, priority, asyncio.get_running_loop().create_future(), on_position)
+        (self._priority if priority else self._normal).push(waiter)
+        self._notify_positions()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self._settings.max_wait_seconds)
+        except BaseException as exc:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just as we gave up: hand it to the next waiter.
+                self._running -= 1
+                self._dispatch()
+            else:
+                waiter.future.cancel()
+                (self._priority if priority else self._normal).remove(waiter)
+                self._notify_positions()
+            if isinstance(exc, asyncio.TimeoutError):
+                self.rejected += 1
+                raise SchedulerFull("Timed out waiting for a pipeline slot") from exc
+            raise
+
+        waited = time.monotonic() - started
+        self.served += 1
+        self.total_wait_seconds += waited
+        return waited
+
+    def _next_tier(self, burst: int, priority_left: int, normal_left: int) -> bool:
+        # Priority jobs go first, but every priority_burst of them a normal job gets its turn.
+        return bool(priority_left) and (not normal_left or burst < self._settings.priority_burst)
+
+    def _dispatch(self) -> None:
+        while self._running < self._settings.max_running and self.waiting:
+            use_priority = self._next_tier(self._burst, len(self._priority), len(self._normal))
+            self._burst = self._burst + 1 if use_priority else 0
+            waiter = (self._priority if use_priority else self._normal).pop()
+            if waiter.future.done():
+                continue
+            self._running += 1
+            waiter.future.set_result(None)
+        self._notify_positions()
+
+    def _order(self) -> list[_Waiter]:
+        # Replays the dispatch rules on copies of the queues to tell each waiter where it stands.
+        priority = _Tier(OrderedDict((owner, deque(queue)) for owner, queue in self._priority.owners.items()))
+        normal = _Tier(OrderedDict((owner, deque(queue)) for owner, queue in self._normal.owners.items()))
+        order: list[_Waiter] = []
+        burst = self._burst
+        while len(priority) or len(normal):
+            use_priority = self._next_tier(burst, len(priority), len(normal))
+            burst = burst + 1 if use_priority else 0
+            order.append((priority if use_priority else normal).pop())
+        return order
+
+    def _notify_positions(self) -> None:
+        ahead_seconds = 0.0
+        for position, waiter in enumerate(self._order(), start=1):
+            ahead_seconds += self._service_seconds[waiter.priority]
+            if waiter.on_position is None or waiter.reported == position:
+                continue
+            waiter.reported = position
+            eta = math.ceil(ahead_seconds / max(1, self._settings.max_running))
+            task = asyncio.create_task(self._report(waiter.on_position, position, eta))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    @staticmethod
+    async def _report(callback: PositionCallback, position: int, eta: float) -> None:
+        try:
+            await callback(position, eta)
+        except Exception:
+            logger.debug("Queue position callback failed", exc_info=True)
+
+    def stats(self) -> dict[str, float | int]:
+        served = max(1, self.served)
+        return {
+            "running": self._running,
+            "waiting": self.waiting,
+            "served": self.served,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait_seconds / served,
+        }
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+
+
+_WORD = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+# A period before "13:4" ends a book abbreviation ("1 Кор. 13:4"), not a sentence.
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+(?!\d{1,3}\s*:\s*\d)")
+
+
+def words(text: str) -> list[str]:
+    # Words shorter than 4 letters are mostly particles and prepositions in Russian.
+    return [word for word in _WORD.findall(text.lower().replace("ё", "е")) if len(word) >= 4]
+
+
+def split_sentences(text: str) -> list[str]:
+    sentences: list[str] = []
+    for line in text.splitlines():
+        for part in _SENTENCE_END.split(line.strip()):
+            part = part.strip()
+            if part:
+                sentences.append(part)
+    return sentences
+
+
+def tfidf_vectors(texts: list[str]) -> list[dict[str, float]]:
+    counts = [Counter(words(text)) for text in texts]
+    document_frequency: Counter[str] = Counter()
+    for counter in counts:
+        document_frequency.update(counter.keys())
+
+    total = len(texts)
+    vectors: list[dict[str, float]] = []
+    for counter in counts:
+        vector = {
+            term: freq * (math.log((1 + total) / (1 + document_frequency[term])) + 1.0)
+            for term, freq in counter.items()
+        }
+        vectors.append(vector)
+    return vectors
+
+
+def cosine(left: dict[str, float], right: dict[str, float]) -> float:
+    if not left or not right:
+        return 0.0
+    if len(left) > len(right):
+        left, right = right, left
+    dot = sum(weight * right.get(term, 0.0) for term, weight in left.items())
+    norm = math.sqrt(sum(w * w for w in left.values())) * math.sqrt(sum(w * w for w in right.values()))
+    return dot / norm if norm else 0.0
+
+
+def similarity_matrix(texts: list[str]) -> list[list[float]]:
+    vectors = tfidf_vectors(texts)
+    size = len(vectors)
+    matrix = [[1.0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(i + 1, size):
+            value = cosine(vectors[i], vectors[j])
+            matrix[i][j] = value
+            matrix[j][i] = value
+    return matrix
+
+
+def find_consensus(texts: list[str], k: int, threshold: float) -> list[int]:
+    # Returns the indices of the largest agreeing group (medoid first) once it has at least k members.
+    if k < 2 or len(texts) < k:
+        return []
+
+    matrix = similarity_matrix(texts)
+    best: list[int] = []
+    best_score = -1.0
+    for i in range(len(texts)):
+        group = [j for j in range(len(texts)) if matrix[i][j] >= threshold]
+        score = sum(matrix[i][j] for j in group)
+        if len(group) > len(best) or (len(group) == len(best) and score > best_score):
+            best = [i] + [j for j in group if j != i]
+            best_score = score
+    return best if len(best) >= k else []
+
+
+def medoid(texts: list[str]) -> int:
+    if len(texts) < 3:
+        return 0
+    matrix = similarity_matrix(texts)
+    return max(range(len(texts)), key=lambda i: sum(matrix[i]))
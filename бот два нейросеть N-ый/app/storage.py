@@ -47,7 +47,9 @@ class BotStorage:
                     """
                     CREATE TABLE IF NOT EXISTS usage (
                         day TEXT PRIMARY KEY,
-                        api_calls INTEGER NOT NULL DEFAULT 0
+                        api_calls INTEGER NOT NULL DEFAULT 0,
+                        hedges_started INTEGER NOT NULL DEFAULT 0,
+                        hedges_won INTEGER NOT NULL DEFAULT 0
                     )
                     """
                 )
@@ -73,7 +75,65 @@ class BotStorage:
                     )
                     """
                 )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS chat_summary (
+                        chat_id INTEGER PRIMARY KEY,
+                        summary TEXT NOT NULL,
+                        updated_at TEXT NOT NULL
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        created_at TEXT NOT NULL
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS token_usage (
+                        day TEXT NOT NULL,
+                        chat_id INTEGER NOT NULL,
+                        model TEXT NOT NULL,
+                        stage TEXT NOT NULL,
+                        calls INTEGER NOT NULL DEFAULT 0,
+                        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                        completion_tokens INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, chat_id, model, stage)
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS answer_usage (
+                        day TEXT NOT NULL,
+                        reasoning_mode TEXT NOT NULL,
+                        answers INTEGER NOT NULL DEFAULT 0,
+                        api_calls INTEGER NOT NULL DEFAULT 0,
+                        tokens INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, reasoning_mode)
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS speculation (
+                        day TEXT PRIMARY KEY,
+                        accepted INTEGER NOT NULL DEFAULT 0,
+                        rejected INTEGER NOT NULL DEFAULT 0,
+                        wasted_calls INTEGER NOT NULL DEFAULT 0,
+                        wasted_tokens INTEGER NOT NULL DEFAULT 0,
+                        saved_seconds REAL NOT NULL DEFAULT 0
+                    )
+                    """
+                )
                 self._ensure_user_columns(conn)
+                self._ensure_usage_columns(conn)
                 conn.commit()
 
     def _ensure_user_columns(self, conn: sqlite3.Connection) -> None:
@@ -101,6 +161,19 @@ class BotStorage:
                 "ALTER TABLE users ADD COLUMN model_preset TEXT NOT NULL DEFAULT 'router_free'"
             )
 
+    def _ensure_usage_columns(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute("PRAGMA table_info(usage)").fetchall()
+        existing = {str(row["name"]) for row in rows}
+
+        if "hedges_started" not in existing:
+            conn.execute(
+                "ALTER TABLE usage ADD COLUMN hedges_started INTEGER NOT NULL DEFAULT 0"
+            )
+        if "hedges_won" not in existing:
+            conn.execute(
+                "ALTER TABLE usage ADD COLUMN hedges_won INTEGER NOT NULL DEFAULT 0"
+            )
+
     def get_user(self, chat_id: int) -> dict[str, Any] | None:
         with self._lock:
             with self._connect() as conn:
@@ -200,6 +273,30 @@ class BotStorage:
         ordered = list(reversed(rows))
         return [(str(row["question"]), str(row["answer"])) for row in ordered]
 
+    def get_chat_summary(self, chat_id: int) -> str:
+        with self._lock:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT summary FROM chat_summary WHERE chat_id = ?",
+                    (chat_id,),
+                ).fetchone()
+        return str(row["summary"]) if row else ""
+
+    def set_chat_summary(self, chat_id: int, summary: str) -> None:
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO chat_summary (chat_id, summary, updated_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        summary = excluded.summary,
+                        updated_at = excluded.updated_at
+                    """,
+                    (chat_id, summary.strip(), _utc_now_iso()),
+                )
+                conn.commit()
+
     def upsert_user(self, chat_id: int, name: str) -> None:
         name = name.strip()
         with self._lock:
@@ -307,3 +404,205 @@ class BotStorage:
         if row is None:
             return 0
         return int(row["api_calls"])
+
+    def record_hedge(self, event: str) -> None:
+        column = {
+            "started": "hedges_started",
+            "won": "hedges_won",
+        }.get(event)
+        if column is None:
+            return
+
+        day = _utc_day()
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO usage (day, api_calls) VALUES (?, 0) "
+                    "ON CONFLICT(day) DO NOTHING",
+                    (day,),
+                )
+                conn.execute(
+                    f"UPDATE usage SET {column} = {column} + 1 WHERE day = ?",
+                    (day,),
+                )
+                conn.commit()
+
+    def get_hedge_stats_today(self) -> tuple[int, int]:
+        day = _utc_day()
+        with self._lock:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT hedges_started, hedges_won FROM usage WHERE day = ?",
+                    (day,),
+                ).fetchone()
+        if row is None:
+            return 0, 0
+        return int(row["hedges_started"]), int(row["hedges_won"])
+
+    def get_cached_response(self, key: str, now: float) -> tuple[str, float] | None:
+        with self._lock:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+        if row is None:
+            return None
+        return str(row["response"]), float(row["expires_at"])
+
+    def put_cached_response(self, key: str, response: str, expires_at: float, max_rows: int = 5000) -> None:
+        keep = max(1, max_rows)
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO llm_cache (key, response, expires_at, created_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        response = excluded.response,
+                        expires_at = excluded.expires_at,
+                        created_at = excluded.created_at
+                    """,
+                    (key, response, expires_at, _utc_now_iso()),
+                )
+                conn.execute(
+                    """
+                    DELETE FROM llm_cache
+                    WHERE key NOT IN (
+                        SELECT key FROM llm_cache
+                        ORDER BY expires_at DESC
+                        LIMIT ?
+                    )
+                    """,
+                    (keep,),
+                )
+                conn.commit()
+
+    def record_token_usage(
+        self,
+        chat_id: int,
+        model: str,
+        stage: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+    ) -> None:
+        day = _utc_day()
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO token_usage (day, chat_id, model, stage, calls, prompt_tokens, completion_tokens)
+                    VALUES (?, ?, ?, ?, 1, ?, ?)
+                    ON CONFLICT(day, chat_id, model, stage) DO UPDATE SET
+                        calls = calls + 1,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens
+                    """,
+                    (day, chat_id, model, stage or "other", max(0, prompt_tokens), max(0, completion_tokens)),
+                )
+                conn.commit()
+
+    def get_tokens_today(self, chat_id: int | None = None) -> int:
+        day = _utc_day()
+        query = "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) AS total FROM token_usage WHERE day = ?"
+        params: tuple[Any, ...] = (day,)
+        if chat_id is not None:
+            query += " AND chat_id = ?"
+            params = (day, chat_id)
+        with self._lock:
+            with self._connect() as conn:
+                row = conn.execute(query, params).fetchone()
+        return int(row["total"]) if row else 0
+
+    def record_answer_usage(self, reasoning_mode: str, api_calls: int, tokens: int) -> None:
+        day = _utc_day()
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO answer_usage (day, reasoning_mode, answers, api_calls, tokens)
+                    VALUES (?, ?, 1, ?, ?)
+                    ON CONFLICT(day, reasoning_mode) DO UPDATE SET
+                        answers = answers + 1,
+                        api_calls = api_calls + excluded.api_calls,
+                        tokens = tokens + excluded.tokens
+                    """,
+                    (day, reasoning_mode, max(0, api_calls), max(0, tokens)),
+                )
+                conn.commit()
+
+    def get_answer_costs(self, days: int = 7) -> dict[str, tuple[float, float]]:
+        with self._lock:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT reasoning_mode, SUM(answers) AS answers, SUM(api_calls) AS api_calls, SUM(tokens) AS tokens
+                    FROM answer_usage
+                    WHERE day >= date('now', ?)
+                    GROUP BY reasoning_mode
+                    """,
+                    (f"-{max(1, days)} days",),
+                ).fetchall()
+        costs: dict[str, tuple[float, float]] = {}
+        for row in rows:
+            answers = int(row["answers"] or 0)
+            if answers <= 0:
+                continue
+            costs[str(row["reasoning_mode"])] = (
+                int(row["api_calls"] or 0) / answers,
+                int(row["tokens"] or 0) / answers,
+            )
+        return costs
+
+    def record_speculation(
+        self,
+        accepted: bool,
+        wasted_calls: int = 0,
+        wasted_tokens: int = 0,
+        saved_seconds: float = 0.0,
+    ) -> None:
+        day = _utc_day()
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO speculation (day, accepted, rejected, wasted_calls, wasted_tokens, saved_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(day) DO UPDATE SET
+                        accepted = accepted + excluded.accepted,
+                        rejected = rejected + excluded.rejected,
+                        wasted_calls = wasted_calls + excluded.wasted_calls,
+                        wasted_tokens = wasted_tokens + excluded.wasted_tokens,
+                        saved_seconds = saved_seconds + excluded.saved_seconds
+                    """,
+                    (
+                        day,
+                        1 if accepted else 0,
+                        0 if accepted else 1,
+                        max(0, wasted_calls),
+                        max(0, wasted_tokens),
+                        max(0.0, saved_seconds),
+                    ),
+                )
+                conn.commit()
+
+    def get_speculation_stats(self, days: int = 7) -> dict[str, float]:
+        with self._lock:
+            with self._connect() as conn:
+                row = conn.execute(
+                    """
+                    SELECT SUM(accepted) AS accepted, SUM(rejected) AS rejected,
+                        SUM(wasted_calls) AS wasted_calls, SUM(wasted_tokens) AS wasted_tokens,
+                        SUM(saved_seconds) AS saved_seconds
+                    FROM speculation
+                    WHERE day >= date('now', ?)
+                    """,
+                    (f"-{max(1, days)} days",),
+                ).fetchone()
+        return {
+            "accepted": int(row["accepted"] or 0),
+            "rejected": int(row["rejected"] or 0),
+            "wasted_calls": int(row["wasted_calls"] or 0),
+            "wasted_tokens": int(row["wasted_tokens"] or 0),
+            "saved_seconds": float(row["saved_seconds"] or 0.0),
+        }
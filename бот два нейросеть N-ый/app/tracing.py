@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TraceSettings:
+    enabled: bool = True
+    path: str = "traces.jsonl"
+    max_bytes: int = 5_000_000
+    backups: int = 3
+    service_name: str = "bible-telegram-bot"
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = ""
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str = ""
+    children: list[Span] = field(default_factory=list)
+    recording: bool = True
+
+    def set(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def add(self, key: str, value: int | float) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def record_error(self, exc: BaseException) -> None:
+        self.error = "Cancelled" if exc.__class__.__name__ == "CancelledError" else type(exc).__name__
+
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+_settings = TraceSettings(enabled=False)
+_write_lock = threading.Lock()
+
+
+def configure_tracing(settings: TraceSettings) -> None:
+    global _settings
+    _settings = settings
+
+
+def set_attribute(key: str, value: Any) -> None:
+    span_ = _current.get()
+    if span_ is not None:
+        span_.set(key, value)
+
+
+def add_to_attribute(key: str, value: int | float) -> None:
+    span_ = _current.get()
+    if span_ is not None:
+        span_.add(key, value)
+
+
+def record_error(exc: BaseException) -> None:
+    span_ = _current.get()
+    if span_ is not None:
+        span_.record_error(exc)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    parent = _current.get()
+    if parent is None or not parent.recording:
+        # Outside a trace spans are still usable objects, they are just never exported.
+        yield Span(name=name, trace_id="", span_id="", attributes=attributes, recording=False)
+        return
+
+    child = Span(
+        name=name,
+        trace_id=parent.trace_id,
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id,
+        attributes={key: value for key, value in attributes.items() if value is not None},
+    )
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.record_error(exc)
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Span]:
+    root = Span(
+        name=name,
+        trace_id=secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        attributes={key: value for key, value in attributes.items() if value is not None},
+        recording=_settings.enabled,
+    )
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as exc:
+        root.record_error(exc)
+        raise
+    finally:
+        root.end_ns = time.time_ns()
+        _current.reset(token)
+        # Updates that did no traced work (menu buttons, settings) are not worth a line in the sink.
+        if root.recording and root.children:
+            _export(root)
+
+
+def _walk(root: Span) -> Iterator[Span]:
+    yield root
+    for child in root.children:
+        yield from _walk(child)
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span_: Span) -> dict[str, Any]:
+    payload: dict[str, Any] = {
+        "traceId": span_.trace_id,
+        "spanId": span_.span_id,
+        "name": span_.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span_.start_ns),
+        "endTimeUnixNano": str(span_.end_ns or span_.start_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span_.attributes.items()],
+        "status": {"code": 2, "message": span_.error} if span_.error else {"code": 1},
+    }
+    if span_.parent_id:
+        payload["parentSpanId"] = span_.parent_id
+    return payload
+
+
+def to_otlp(root: Span) -> dict[str, Any]:
+    # One OTLP/JSON ExportTraceServiceRequest per line, so the file can be replayed into a collector.
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [{"key": "service.name", "value": {"stringValue": _settings.service_name}}],
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "app.tracing"},
+                        "spans": [_otlp_span(item) for item in _walk(root)],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def _rotate(path: str) -> None:
+    for index in range(_settings.backups - 1, 0, -1):
+        source = f"{path}.{index}"
+        if os.path.exists(source):
+            os.replace(source, f"{path}.{index + 1}")
+    if _settings.backups > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+
+def _export(root: Span) -> None:
+    line = json.dumps(to_otlp(root), ensure_ascii=False)
+    path = _settings.path
+    try:
+        with _write_lock:
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > _settings.max_bytes:
+                _rotate(path)
+            with open(path, "a", encoding="utf-8") as sink:
+                sink.write(line + "\n")
+    except OSError:
+        logger.exception("Failed to write trace to %s", path)
+
+
+def recent_traces(limit: int) -> list[dict[str, Any]]:
+    path = _settings.path
+    if limit <= 0 or not os.path.exists(path):
+        return []
+    with _write_lock:
+        with open(path, encoding="utf-8") as sink:
+            lines = sink.readlines()[-limit:]
+
+    traces: list[dict[str, Any]] = []
+    for line in reversed(lines):
+        try:
+            traces.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return traces
+
+
+def _attribute_value(value: dict[str, Any]) -> Any:
+    for kind in ("stringValue", "intValue", "doubleValue", "boolValue"):
+        if kind in value:
+            return value[kind]
+    return None
+
+
+def format_trace(trace: dict[str, Any]) -> str:
+    spans = [
+        item
+        for resource in trace.get("resourceSpans", [])
+        for scope in resource.get("scopeSpans", [])
+        for item in scope.get("spans", [])
+    ]
+    if not spans:
+        return "Пустая трасса."
+
+    children: dict[str, list[dict[str, Any]]] = {}
+    for item in spans:
+        children.setdefault(item.get("parentSpanId", ""), []).append(item)
+
+    def duration(item: dict[str, Any]) -> float:
+        return (int(item["endTimeUnixNano"]) - int(item["startTimeUnixNano"])) / 1e9
+
+    def describe(item: dict[str, Any]) -> str:
+        attrs = {entry["key"]: _attribute_value(entry["value"]) for entry in item.get("attributes", [])}
+        details = [f"{duration(item):.2f} с"]
+        for key in ("model", "persona", "status", "hits", "retries", "prompt_trimmed"):
+            if attrs.get(key) not in (None, ""):
+                details.append(f"{key}={attrs[key]}")
+        tokens = int(attrs.get("prompt_tokens", 0) or 0) + int(attrs.get("completion_tokens", 0) or 0)
+        if tokens:
+            details.append(f"токены={tokens}")
+        if item.get("status", {}).get("code") == 2:
+            details.append(f"ошибка={item['status'].get('message', '')}")
+        return f"{item['name']}: " + ", ".join(details)
+
+    root = children.get("", [spans[0]])[0]
+    lines = [f"Трасса {root['traceId'][:8]}: {describe(root)}"]
+
+    def render(parent_id: str, depth: int) -> None:
+        ordered = sorted(children.get(parent_id, []), key=lambda item: int(item["startTimeUnixNano"]))
+        for item in ordered:
+            lines.append(f"{'  ' * depth}- {describe(item)}")
+            render(item["spanId"], depth + 1)
+
+    render(root["spanId"], 0)
+    return "\n".join(lines)
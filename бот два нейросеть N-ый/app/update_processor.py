@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable
+from contextvars import ContextVar
+from typing import Any
+
+from telegram.ext import BaseUpdateProcessor
+
+
+_ready_at: ContextVar[float] = ContextVar("update_ready_at", default=0.0)
+
+
+def _chat_key(update: object) -> int | None:
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    return user.id if user is not None else None
+
+
+def _percentile(values: list[float], quantile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Updates run concurrently across chats, but one chat's updates still run one at a time, in order.
+    def __init__(self, max_concurrent_updates: int, sample_size: int = 500) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._holders: dict[int, int] = {}
+        self._global_waits: deque[float] = deque(maxlen=sample_size)
+        self._chat_waits: deque[float] = deque(maxlen=sample_size)
+        self.processed = 0
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _chat_key(update)
+        if key is None:
+            self._chat_waits.append(0.0)
+            _ready_at.set(time.monotonic())
+            await super().process_update(update, coroutine)
+            return
+
+        arrived = time.monotonic()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._holders[key] = self._holders.get(key, 0) + 1
+        try:
+            # The chat lock comes before the global limit, so only the head of each chat's line
+            # holds a global slot and a burst from one chat cannot hold up the other chats.
+            async with lock:
+                ready = time.monotonic()
+                self._chat_waits.append(ready - arrived)
+                _ready_at.set(ready)
+                await super().process_update(update, coroutine)
+        finally:
+            self._holders[key] -= 1
+            if not self._holders[key]:
+                del self._holders[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        admitted = time.monotonic()
+        # Time spent behind the global limit, i.e. behind other chats' updates.
+        self._global_waits.append(admitted - (_ready_at.get() or admitted))
+        self.processed += 1
+        await coroutine
+
+    async def initialize(self) -> None:
+        return
+
+    async def shutdown(self) -> None:
+        return
+
+    def stats(self) -> dict[str, float | int]:
+        global_waits = list(self._global_waits)
+        chat_waits = list(self._chat_waits)
+        return {
+            "processed": self.processed,
+            "in_chats": len(self._locks),
+            "global_wait_p50": _percentile(global_waits, 0.50),
+            "global_wait_p95": _percentile(global_waits, 0.95),
+            "global_wait_max": max(global_waits, default=0.0),
+            "chat_wait_p95": _percentile(chat_waits, 0.95),
+            "chat_wait_max": max(chat_waits, default=0.0),
+        }
@@ -6,10 +6,17 @@ from html import unescape
 
 import httpx
 
+from app import tracing
+from app.cassette import cassette_transport
+from app.single_flight import SingleFlight
+
 _HTTP_HEADERS = {
     "User-Agent": "BibleTelegramBot/1.0 (+https://t.me/Bot736363637373bot)"
 }
 
+DUCKDUCKGO_API_URL = "https://api.duckduckgo.com/"
+WIKIPEDIA_API_URL = "https://{lang}.wikipedia.org/w/api.php"
+
 
 @dataclass(frozen=True)
 class WebHit:
@@ -18,7 +25,27 @@ class WebHit:
     snippet: str
 
 
+_flights = SingleFlight()
+
+
+def coalescing_stats() -> dict[str, int]:
+    return _flights.stats()
+
+
+def configure_search(duckduckgo_url: str = "", wikipedia_url: str = "") -> None:
+    # Lets the bench point search at a local mock; empty values keep the public endpoints.
+    global DUCKDUCKGO_API_URL, WIKIPEDIA_API_URL
+    if duckduckgo_url:
+        DUCKDUCKGO_API_URL = duckduckgo_url
+    if wikipedia_url:
+        WIKIPEDIA_API_URL = wikipedia_url
+
+
 async def search_web(query: str, max_results: int) -> list[WebHit]:
+    return await _flights.run((query, max_results), lambda: _search_web(query, max_results))
+
+
+async def _search_web(query: str, max_results: int) -> list[WebHit]:
     hits = await _duckduckgo_instant(query=query, max_results=max_results)
     if len(hits) < max_results:
         needed = max_results - len(hits)
@@ -32,7 +59,14 @@ async def search_web(query: str, max_results: int) -> list[WebHit]:
 
 
 async def _duckduckgo_instant(query: str, max_results: int) -> list[WebHit]:
-    api_url = "https://api.duckduckgo.com/"
+    with tracing.span("search.duckduckgo") as span:
+        hits = await _duckduckgo_request(query=query, max_results=max_results)
+        span.set("hits", len(hits))
+        return hits
+
+
+async def _duckduckgo_request(query: str, max_results: int) -> list[WebHit]:
+    api_url = DUCKDUCKGO_API_URL
     params = {
         "q": query,
         "format": "json",
@@ -41,11 +75,12 @@ async def _duckduckgo_instant(query: str, max_results: int) -> list[WebHit]:
     }
 
     try:
-        async with httpx.AsyncClient(timeout=12, headers=_HTTP_HEADERS) as client:
+        async with httpx.AsyncClient(timeout=12, headers=_HTTP_HEADERS, transport=cassette_transport()) as client:
             response = await client.get(api_url, params=params)
             response.raise_for_status()
             payload = response.json()
-    except Exception:
+    except Exception as exc:
+        tracing.record_error(exc)
         return []
 
     hits: list[WebHit] = []
@@ -86,7 +121,14 @@ def _append_related_hit(target: list[WebHit], item: object) -> None:
 
 
 async def _wikipedia_search(query: str, max_results: int, lang: str) -> list[WebHit]:
-    api_url = f"https://{lang}.wikipedia.org/w/api.php"
+    with tracing.span("search.wikipedia", lang=lang) as span:
+        hits = await _wikipedia_request(query=query, max_results=max_results, lang=lang)
+        span.set("hits", len(hits))
+        return hits
+
+
+async def _wikipedia_request(query: str, max_results: int, lang: str) -> list[WebHit]:
+    api_url = WIKIPEDIA_API_URL.format(lang=lang)
     params = {
         "action": "query",
         "list": "search",
@@ -97,11 +139,12 @@ async def _wikipedia_search(query: str, max_results: int, lang: str) -> list[Web
     }
 
     try:
-        async with httpx.AsyncClient(timeout=12, headers=_HTTP_HEADERS) as client:
+        async with httpx.AsyncClient(timeout=12, headers=_HTTP_HEADERS, transport=cassette_transport()) as client:
             response = await client.get(api_url, params=params)
             response.raise_for_status()
             payload = response.json()
-    except Exception:
+    except Exception as exc:
+        tracing.record_error(exc)
         return []
 
     search_items = payload.get("query", {}).get("search", [])
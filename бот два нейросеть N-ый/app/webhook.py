@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import hmac
+import json
+import logging
+from collections.abc import Awaitable, Callable, MutableMapping
+from dataclasses import dataclass
+from typing import Any
+
+import uvicorn
+from telegram import Update
+from telegram.ext import Application
+
+
+logger = logging.getLogger(__name__)
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+
+
+@dataclass(frozen=True)
+class WebhookSettings:
+    secret_token: str
+    path: str = "/telegram"
+    public_url: str = ""
+    max_connections: int = 40
+    max_body_bytes: int = 1_000_000
+
+
+class WebhookApp:
+    # ASGI app: accepts Telegram update POSTs and hands them to the application's update queue.
+    def __init__(self, application: Application, settings: WebhookSettings) -> None:
+        self._application = application
+        self._settings = settings
+        self.accepted = 0
+        self.rejected = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"].rstrip("/") or "/"
+        if path == "/healthz" and scope["method"] in {"GET", "HEAD"}:
+            await self._health(send)
+        elif path == self._settings.path:
+            if scope["method"] != "POST":
+                await _respond(send, 405, {"error": "method not allowed"})
+            else:
+                await self._receive_update(scope, receive, send)
+        else:
+            await _respond(send, 404, {"error": "not found"})
+
+    async def _receive_update(self, scope: Scope, receive: Receive, send: Send) -> None:
+        secret = dict(scope["headers"]).get(SECRET_HEADER, b"")
+        if not hmac.compare_digest(secret, self._settings.secret_token.encode()):
+            self.rejected += 1
+            await _respond(send, 403, {"error": "bad secret token"})
+            return
+        if not self._application.running:
+            await _respond(send, 503, {"error": "not running"})
+            return
+
+        body = await _read_body(receive, self._settings.max_body_bytes)
+        if body is None:
+            self.rejected += 1
+            await _respond(send, 413, {"error": "body too large"})
+            return
+        try:
+            update = Update.de_json(json.loads(body), self._application.bot)
+        except (ValueError, TypeError, KeyError):
+            update = None
+        if update is None:
+            self.rejected += 1
+            await _respond(send, 400, {"error": "bad update"})
+            return
+
+        # Answer Telegram right away; the update processor runs handlers with its own concurrency limit.
+        await self._application.update_queue.put(update)
+        self.accepted += 1
+        await _respond(send, 200, {"ok": True})
+
+    async def _health(self, send: Send) -> None:
+        application = self._application
+        processor = application.update_processor
+        payload: dict[str, Any] = {
+            "status": "ok" if application.running else "starting",
+            "queued_updates": application.update_queue.qsize(),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        }
+        if hasattr(processor, "stats"):
+            payload["updates"] = processor.stats()
+        await _respond(send, 200 if application.running else 503, payload)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self._start()
+                except Exception as exc:
+                    logger.exception("Webhook startup failed")
+                    await send({"type": "lifespan.startup.failed", "message": str(exc)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _start(self) -> None:
+        application = self._application
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        if not self._settings.public_url:
+            logger.info("WEBHOOK_URL is empty: serving %s without registering it", self._settings.path)
+            return
+        # Every replica registers the same URL and secret, so the call is idempotent behind a load balancer.
+        await application.bot.set_webhook(
+            url=f"{self._settings.public_url}{self._settings.path}",
+            secret_token=self._settings.secret_token,
+            max_connections=self._settings.max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info("Webhook registered at %s%s", self._settings.public_url, self._settings.path)
+
+    async def _stop(self) -> None:
+        # The webhook itself stays registered: other replicas keep receiving updates.
+        application = self._application
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def _read_body(receive: Receive, limit: int) -> bytes | None:
+    chunks: list[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return b"".join(chunks)
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _respond(send: Send, status: int, payload: dict[str, Any]) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def serve(application: Application, settings: WebhookSettings, host: str, port: int) -> None:
+    config = uvicorn.Config(
+        WebhookApp(application, settings),
+        host=host,
+        port=port,
+        lifespan="on",
+        access_log=False,
+        log_config=None,
+    )
+    uvicorn.Server(config).run()
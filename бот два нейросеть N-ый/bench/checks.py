@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+import traceback
+from collections.abc import Awaitable, Callable
+from types import SimpleNamespace
+from typing import Any
+
+from telegram.ext import Application
+
+from bench.mock_server import MockProfile, MockServer
+from app.model_health import ModelHealth
+from app.pipeline import _is_rate_limit_error
+from app.rate_limit import AdaptiveLimiter, LimiterSettings, RateLimitQueueTimeout
+from app.update_processor import ChatOrderedUpdateProcessor
+from app.webhook import WebhookApp, WebhookSettings
+
+
+# Offline regression checks for behaviour the latency bench only shows indirectly.
+Check = Callable[[], Awaitable[None]]
+
+
+def _chat_update(chat_id: int) -> SimpleNamespace:
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+async def check_update_order() -> None:
+    # A burst from one chat must not take the global slots that other chats need.
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+    release = asyncio.Event()
+    started: list[tuple[int, int]] = []
+
+    async def handle(chat_id: int, number: int) -> None:
+        started.append((chat_id, number))
+        if chat_id == 1:
+            await release.wait()
+
+    busy = [asyncio.create_task(processor.process_update(_chat_update(1), handle(1, n))) for n in range(5)]
+    await asyncio.sleep(0.01)
+    other = asyncio.create_task(processor.process_update(_chat_update(2), handle(2, 0)))
+    try:
+        await asyncio.wait_for(asyncio.shield(other), timeout=1.0)
+    except asyncio.TimeoutError:
+        raise AssertionError("an update from another chat waited behind a burst from one chat") from None
+    finally:
+        release.set()
+        await asyncio.gather(*busy, other)
+
+    burst = [number for chat_id, number in started if chat_id == 1]
+    assert burst == list(range(5)), f"one chat's updates ran out of order: {burst}"
+    assert processor.stats()["in_chats"] == 0, "per-chat locks leaked"
+
+
+async def check_rate_limit_burst() -> None:
+    # Eight concurrent calls answered 429 at once are one congestion signal, not eight.
+    limiter = AdaptiveLimiter(LimiterSettings(max_concurrency=8, min_concurrency=1))
+    for _ in range(8):
+        limiter.observe(429, {"retry-after": "1"})
+    assert limiter.limit == 4, f"a burst of 429s shrank the window to {limiter.limit}"
+
+    timeout = RateLimitQueueTimeout("Timed out waiting for an LLM rate limit slot")
+    assert not _is_rate_limit_error(timeout), "a local queue timeout is retried as an upstream 429"
+
+
+async def check_hedge_latency_sample() -> None:
+    # Quick gate verdicts on the same model must not pull the agents' hedge delay down.
+    health = ModelHealth()
+    for _ in range(15):
+        health.record_success("endpoint", "model", 0.2, "gate")
+    for _ in range(5):
+        health.record_success("endpoint", "model", 6.0, "agent")
+    agent_p90 = health.latency_quantile("endpoint", "model", 0.9, "agent")
+    assert agent_p90 == 6.0, f"agent p90 is {agent_p90}, mixed with other stages"
+    assert health.latency_quantile("endpoint", "model", 0.9, "top_up") is None
+
+
+async def _http(
+    app: WebhookApp,
+    method: str,
+    path: str,
+    body: bytes = b"",
+    headers: list[tuple[bytes, bytes]] | None = None,
+) -> tuple[int, dict[str, Any]]:
+    incoming = [{"type": "http.request", "body": body, "more_body": False}]
+    sent: list[dict[str, Any]] = []
+
+    async def receive() -> dict[str, Any]:
+        return incoming.pop(0) if incoming else {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        sent.append(message)
+
+    await app({"type": "http", "method": method, "path": path, "headers": headers or []}, receive, send)
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+async def check_webhook() -> None:
+    # Drives the ASGI app directly, lifespan included; the mock only answers getMe.
+    server = MockServer(MockProfile(telegram_latency_ms=0)).start()
+    application = Application.builder().token("123456:check").base_url(f"{server.base_url}/bot").build()
+    secret = "check-secret-token-123"
+    app = WebhookApp(application, WebhookSettings(secret_token=secret, max_body_bytes=4096))
+    lifespan: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+    replies: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+    running = asyncio.create_task(app({"type": "lifespan"}, lifespan.get, replies.put))
+    try:
+        await lifespan.put({"type": "lifespan.startup"})
+        assert (await replies.get())["type"] == "lifespan.startup.complete", "lifespan startup failed"
+
+        update = json.dumps(
+            {
+                "update_id": 1,
+                "message": {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "text": "hi"},
+            }
+        ).encode()
+        good = [(b"x-telegram-bot-api-secret-token", secret.encode())]
+        bad = [(b"x-telegram-bot-api-secret-token", b"wrong-secret-token-000")]
+        status, _ = await _http(app, "POST", "/telegram", update, good)
+        assert status == 200, f"valid update got {status}"
+        status, _ = await _http(app, "POST", "/telegram", update, bad)
+        assert status == 403, f"wrong secret got {status}"
+        status, _ = await _http(app, "POST", "/telegram", update)
+        assert status == 403, f"missing secret got {status}"
+        status, _ = await _http(app, "POST", "/telegram", b"x" * 5000, good)
+        assert status == 413, f"oversized body got {status}"
+        status, _ = await _http(app, "POST", "/telegram", b"{not json", good)
+        assert status == 400, f"bad JSON got {status}"
+        status, _ = await _http(app, "GET", "/telegram")
+        assert status == 405, f"GET on the update path got {status}"
+
+        status, health = await _http(app, "GET", "/healthz")
+        assert status == 200 and health["status"] == "ok", f"healthz: {status} {health}"
+        assert health["accepted"] == 1 and health["rejected"] == 4, f"healthz counters: {health}"
+    finally:
+        await lifespan.put({"type": "lifespan.shutdown"})
+        await asyncio.wait_for(running, timeout=5)
+        server.stop()
+    assert not application.running, "application still running after lifespan shutdown"
+
+
+CHECKS: list[Check] = [check_update_order, check_rate_limit_burst, check_hedge_latency_sample, check_webhook]
+
+
+async def _main() -> int:
+    failed = 0
+    for check in CHECKS:
+        try:
+            await check()
+        except Exception:
+            failed += 1
+            print(f"FAIL {check.__name__}")
+            traceback.print_exc()
+        else:
+            print(f"ok   {check.__name__}")
+    return failed
+
+
+def main() -> None:
+    sys.exit(1 if asyncio.run(_main()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+_WORDS = (
+    "Писание говорит что Бог есть любовь и призывает к прощению ближнего "
+    "как сказано в Евангелии от Матфея 6:14 и в Первом послании Иоанна 4:8"
+).split()
+
+
+@dataclass
+class MockProfile:
+    latency_median_ms: float = 800.0
+    latency_sigma: float = 0.5
+    rate_429: float = 0.0
+    retry_after_seconds: float = 1.0
+    timeout_rate: float = 0.0
+    hang_seconds: float = 120.0
+    error_rate: float = 0.0
+    response_words: int = 180
+    search_latency_ms: float = 150.0
+    telegram_latency_ms: float = 40.0
+
+
+@dataclass
+class MockCounters:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    llm_calls: int = 0
+    llm_429: int = 0
+    llm_timeouts: int = 0
+    llm_errors: int = 0
+    search_calls: int = 0
+    telegram_calls: int = 0
+
+    def bump(self, name: str) -> None:
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "llm_calls": self.llm_calls,
+                "llm_429": self.llm_429,
+                "llm_timeouts": self.llm_timeouts,
+                "llm_errors": self.llm_errors,
+                "search_calls": self.search_calls,
+                "telegram_calls": self.telegram_calls,
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.llm_calls = self.llm_429 = self.llm_timeouts = self.llm_errors = 0
+            self.search_calls = self.telegram_calls = 0
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request: object, client_address: object) -> None:
+        # Hedged and cancelled streams drop their connection mid-response, which is expected here.
+        return
+
+
+class MockServer:
+    # One ThreadingHTTPServer for the OpenAI-compatible API, both search backends and the Telegram Bot API.
+    def __init__(self, profile: MockProfile, host: str = "127.0.0.1", port: int = 0, seed: int | None = None) -> None:
+        self.profile = profile
+        self.counters = MockCounters()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._message_id = 0
+        self.replies: dict[int, list[str]] = {}
+        self._server = _QuietServer((host, port), self._handler_class())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> MockServer:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _roll(self) -> float:
+        with self._random_lock:
+            return self._random.random()
+
+    def _llm_delay(self) -> float:
+        with self._random_lock:
+            factor = math.exp(self._random.gauss(0.0, self.profile.latency_sigma))
+        return self.profile.latency_median_ms * factor / 1000
+
+    def _record_reply(self, chat_id: int, text: str) -> None:
+        with self._random_lock:
+            self.replies.setdefault(chat_id, []).append(text)
+
+    def _next_message_id(self) -> int:
+        with self._random_lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _answer_text(self, body: dict[str, object]) -> str:
+        # The topic gate asks for max_tokens=24 and only needs a verdict.
+        if body.get("max_tokens") == 24:
+            return "YES"
+        count = max(1, self.profile.response_words)
+        return " ".join(_WORDS[idx % len(_WORDS)] for idx in range(count))
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: object) -> None:
+                return
+
+            def _send_json(self, payload: object, status: int = 200, headers: dict[str, str] | None = None) -> None:
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self) -> dict[str, object]:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if not raw:
+                    return {}
+                if "json" in content_type:
+                    try:
+                        payload = json.loads(raw)
+                    except json.JSONDecodeError:
+                        return {}
+                    return payload if isinstance(payload, dict) else {}
+                return {key: values[-1] for key, values in parse_qs(raw.decode("utf-8")).items()}
+
+            def do_GET(self) -> None:
+                path = urlparse(self.path).path
+                if path.startswith("/duckduckgo"):
+                    self._search_duckduckgo()
+                elif path.startswith("/wikipedia"):
+                    self._search_wikipedia(path)
+                elif path.startswith("/bot"):
+                    self._telegram(path, {})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self) -> None:
+                path = urlparse(self.path).path
+                body = self._read_body()
+                if path.endswith("/chat/completions"):
+                    self._chat(body)
+                elif path.startswith("/bot"):
+                    self._telegram(path, body)
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def _chat(self, body: dict[str, object]) -> None:
+                mock.counters.bump("llm_calls")
+                profile = mock.profile
+                if mock._roll() < profile.timeout_rate:
+                    mock.counters.bump("llm_timeouts")
+                    time.sleep(profile.hang_seconds)
+                    return
+                time.sleep(mock._llm_delay())
+                if mock._roll() < profile.rate_429:
+                    mock.counters.bump("llm_429")
+                    self._send_json(
+                        {"error": {"message": "Rate limit exceeded", "code": 429}},
+                        status=429,
+                        headers={"Retry-After": str(profile.retry_after_seconds)},
+                    )
+                    return
+                if mock._roll() < profile.error_rate:
+                    mock.counters.bump("llm_errors")
+                    self._send_json({"error": {"message": "Upstream error", "code": 502}}, status=502)
+                    return
+
+                text = mock._answer_text(body)
+                words = len(text.split())
+                usage = {"prompt_tokens": 400, "completion_tokens": words * 2, "total_tokens": 400 + words * 2}
+                if body.get("stream"):
+                    self._stream(text, usage)
+                    return
+                self._send_json(
+                    {
+                        "id": "chatcmpl-bench",
+                        "object": "chat.completion",
+                        "model": body.get("model", ""),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}}],
+                        "usage": usage,
+                    }
+                )
+
+            def _stream(self, text: str, usage: dict[str, int]) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def chunk(data: bytes) -> None:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+                for word in text.split(" "):
+                    event = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+                    chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                chunk(b"data: [DONE]\n\n")
+                chunk(b"")
+
+            def _search_duckduckgo(self) -> None:
+                mock.counters.bump("search_calls")
+                time.sleep(mock.profile.search_latency_ms / 1000)
+                self._send_json(
+                    {
+                        "Heading": "Прощение",
+                        "AbstractText": "Прощение в христианстве — отказ от мести и обиды.",
+                        "AbstractURL": "https://example.org/forgiveness",
+                        "RelatedTopics": [
+                            {"Text": f"Тема {idx} - описание темы {idx}", "FirstURL": f"https://example.org/topic/{idx}"}
+                            for idx in range(5)
+                        ],
+                    }
+                )
+
+            def _search_wikipedia(self, path: str) -> None:
+                mock.counters.bump("search_calls")
+                time.sleep(mock.profile.search_latency_ms / 1000)
+                self._send_json(
+                    {
+                        "query": {
+                            "search": [
+                                {
+                                    "title": f"Статья {idx}",
+                                    "pageid": 1000 + idx,
+                                    "snippet": f"Фрагмент <span>статьи</span> {idx}",
+                                    "timestamp": "2024-01-01T00:00:00Z",
+                                }
+                                for idx in range(5)
+                            ]
+                        }
+                    }
+                )
+
+            def _telegram(self, path: str, body: dict[str, object]) -> None:
+                mock.counters.bump("telegram_calls")
+                time.sleep(mock.profile.telegram_latency_ms / 1000)
+                method = path.rsplit("/", 1)[-1]
+                chat_id = int(body.get("chat_id") or 0)
+                chat = {"id": chat_id, "type": "private", "first_name": "Bench"}
+                if method == "getMe":
+                    result: object = {
+                        "id": 1,
+                        "is_bot": True,
+                        "first_name": "BenchBot",
+                        "username": "bench_bot",
+                        "can_join_groups": False,
+                        "can_read_all_group_messages": False,
+                        "supports_inline_queries": False,
+                    }
+                elif method in {"sendMessage", "editMessageText"}:
+                    mock._record_reply(chat_id, str(body.get("text", "")))
+                    message_id = int(body.get("message_id") or 0) or mock._next_message_id()
+                    result = {
+                        "message_id": message_id,
+                        "date": int(time.time()),
+                        "chat": chat,
+                        "text": str(body.get("text", "")),
+                    }
+                else:
+                    result = True
+                self._send_json({"ok": True, "result": result})
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline mock of the LLM API, search backends and Telegram Bot API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=MockProfile.latency_median_ms)
+    parser.add_argument("--latency-sigma", type=float, default=MockProfile.latency_sigma)
+    parser.add_argument("--rate-429", type=float, default=MockProfile.rate_429)
+    parser.add_argument("--timeout-rate", type=float, default=MockProfile.timeout_rate)
+    parser.add_argument("--error-rate", type=float, default=MockProfile.error_rate)
+    parser.add_argument("--words", type=int, default=MockProfile.response_words)
+    args = parser.parse_args()
+
+    profile = MockProfile(
+        latency_median_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        rate_429=args.rate_429,
+        timeout_rate=args.timeout_rate,
+        error_rate=args.error_rate,
+        response_words=args.words,
+    )
+    server = MockServer(profile, host=args.host, port=args.port).start()
+    print(f"Mock server on {server.base_url} (LLM: {server.base_url}/v1)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from bench.mock_server import MockProfile, MockServer
+
+
+_CORPUS = Path(__file__).with_name("corpus.txt")
+_FAILURE_MARKERS = ("Ошибка при обработке", "Не удалось получить ответы")
+
+
+@dataclass
+class ModeReport:
+    mode: str
+    answers: int = 0
+    failures: int = 0
+    latencies: list[float] = field(default_factory=list)
+    wall_seconds: float = 0.0
+    upstream: dict[str, int] = field(default_factory=dict)
+    command_latencies: list[float] = field(default_factory=list)
+
+    def percentile(self, quantile: float, values: list[float] | None = None) -> float:
+        samples = self.latencies if values is None else values
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, int(round(quantile * len(ordered) + 0.5)) - 1))
+        return ordered[index]
+
+    def summary(self) -> dict[str, float | int | str]:
+        finished = max(1, self.answers)
+        return {
+            "mode": self.mode,
+            "answers": self.answers,
+            "failures": self.failures,
+            "p50": round(self.percentile(0.50), 3),
+            "p95": round(self.percentile(0.95), 3),
+            "p99": round(self.percentile(0.99), 3),
+            "throughput": round(self.answers / self.wall_seconds, 3) if self.wall_seconds else 0.0,
+            "llm_calls_per_answer": round(self.upstream.get("llm_calls", 0) / finished, 2),
+            "llm_429": self.upstream.get("llm_429", 0),
+            "llm_timeouts": self.upstream.get("llm_timeouts", 0),
+            "search_calls_per_answer": round(self.upstream.get("search_calls", 0) / finished, 2),
+            "command_p95": round(self.percentile(0.95, self.command_latencies), 3),
+            "command_max": round(max(self.command_latencies, default=0.0), 3),
+        }
+
+
+def _load_corpus(path: Path) -> list[str]:
+    return [line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+def _configure_environment(server: MockServer, storage_path: str, args: argparse.Namespace) -> None:
+    # Everything points at the mock before app.config is imported, so nothing leaves the machine.
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": "123456:bench",
+            "TELEGRAM_API_BASE_URL": server.base_url,
+            "LLM_BASE_URL": f"{server.base_url}/v1",
+            "LLM_API_KEY": "bench-key",
+            "LLM_MODEL": "bench/model",
+            "LLM_TIMEOUT_SECONDS": str(args.llm_timeout),
+            "SEARCH_DUCKDUCKGO_URL": f"{server.base_url}/duckduckgo/",
+            "SEARCH_WIKIPEDIA_URL": f"{server.base_url}/wikipedia/{{lang}}/w/api.php",
+            "STORAGE_PATH": storage_path,
+            "DAILY_API_LIMIT": "1000000000",
+            "DAILY_TOKEN_LIMIT": "0",
+            "LLM_CACHE_ENABLED": "false",
+            "TRACE_ENABLED": "false",
+            "STREAM_EDIT_INTERVAL_SECONDS": "0.5",
+        }
+    )
+
+
+async def _run_pipeline_mode(mode: str, questions: list[str], args: argparse.Namespace) -> ModeReport:
+    from app.cassette import CassetteSettings, configure_cassette
+    from app.config import load_settings
+    from app.llm_client import LLMClient
+    from app.model_health import HealthSettings, configure_health
+    from app.pipeline import run_pipeline
+    from app.web_search import configure_search
+
+    settings = load_settings()
+    configure_cassette(
+        CassetteSettings(
+            mode=settings.cassette_mode,
+            path=settings.cassette_path,
+            replay_timing=settings.cassette_replay_timing,
+        )
+    )
+    configure_search(duckduckgo_url=settings.search_duckduckgo_url, wikipedia_url=settings.search_wikipedia_url)
+    # Circuit breaker state from the previous mode would skew the next one.
+    configure_health(HealthSettings())
+    llm = LLMClient(settings.llm_base_url, settings.llm_api_key, settings.llm_model, settings.llm_timeout_seconds)
+    report = ModeReport(mode=mode)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(question: str) -> None:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                result = await run_pipeline(
+                    llm=llm,
+                    question=question,
+                    web_results=settings.web_results,
+                    temperature=settings.request_temperature,
+                    agent_models=settings.agent_models,
+                    reasoning_mode=mode,
+                    topology=settings.mode_topologies.get(mode),
+                    fallback_models=settings.fallback_models,
+                    consensus_threshold=settings.consensus_threshold if settings.consensus_enabled else None,
+                    deadline_seconds=settings.mode_deadlines.get(mode) or None,
+                    top_up_concurrency=settings.top_up_concurrency,
+                )
+                failed = not result.candidates
+            except Exception:
+                failed = True
+            report.latencies.append(time.monotonic() - started)
+            report.answers += 1
+            report.failures += int(failed)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(question) for question in questions))
+    report.wall_seconds = time.monotonic() - started
+    return report
+
+
+async def _run_handler_mode(mode: str, questions: list[str], server: MockServer, args: argparse.Namespace) -> ModeReport:
+    from telegram import Update
+
+    from app.bot import build_application
+    from app.config import load_settings
+    from app.storage import BotStorage
+
+    settings = load_settings()
+    storage = BotStorage(settings.storage_path)
+    base_chat_id = {"fast": 100_000, "balanced": 200_000, "deep": 300_000}.get(mode, 400_000)
+    chat_ids = [base_chat_id + idx for idx in range(len(questions))]
+    for chat_id in chat_ids:
+        storage.upsert_user(chat_id=chat_id, name="Bench")
+        storage.update_reasoning_mode(chat_id=chat_id, reasoning_mode=mode)
+
+    app = build_application()
+    await app.initialize()
+    await app.start()
+    report = ModeReport(mode=mode)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    def make_update(update_id: int, chat_id: int, text: str) -> Update:
+        message: dict[str, object] = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return Update.de_json({"update_id": update_id, "message": message}, app.bot)
+
+    async def dispatch(update: Update) -> None:
+        # The same path polling takes, so the update processor's concurrency and per-chat ordering apply.
+        await app.update_processor.process_update(update, app.process_update(update))
+
+    async def one(update_id: int, chat_id: int, question: str) -> None:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await dispatch(make_update(update_id, chat_id, question))
+                work = app.bot_data["answers"].get(chat_id)
+                if work is not None and work.task is not None:
+                    # Answers run detached from the update handler.
+                    await asyncio.wait([work.task])
+                replies = server.replies.get(chat_id, [])
+                failed = not replies or any(marker in replies[-1] for marker in _FAILURE_MARKERS)
+            except Exception:
+                failed = True
+            report.latencies.append(time.monotonic() - started)
+            report.answers += 1
+            report.failures += int(failed)
+
+    async def commands(stop: asyncio.Event) -> None:
+        # Cheap commands from other chats while answers run: their latency is the head-of-line blocking.
+        update_id = 1_000_000
+        while not stop.is_set() and update_id < 1_000_000 + args.commands:
+            update_id += 1
+            started = time.monotonic()
+            await dispatch(make_update(update_id, base_chat_id + 50_000 + update_id % 97, "/quota"))
+            report.command_latencies.append(time.monotonic() - started)
+            await asyncio.sleep(args.command_interval)
+
+    started = time.monotonic()
+    stop = asyncio.Event()
+    chatter = asyncio.create_task(commands(stop))
+    try:
+        await asyncio.gather(
+            *(one(idx + 1, chat_id, question) for idx, (chat_id, question) in enumerate(zip(chat_ids, questions)))
+        )
+    finally:
+        stop.set()
+        await chatter
+        report.wall_seconds = time.monotonic() - started
+        await app.stop()
+        await app.shutdown()
+    return report
+
+
+def _print_table(reports: list[ModeReport]) -> None:
+    header = (
+        f"{'mode':<9} {'answers':>7} {'fail':>5} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+        f"{'ans/s':>6} {'llm/ans':>7} {'429':>5} {'hangs':>5} {'cmd p95':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        row = report.summary()
+        print(
+            f"{row['mode']:<9} {row['answers']:>7} {row['failures']:>5} {row['p50']:>7.2f} {row['p95']:>7.2f} "
+            f"{row['p99']:>7.2f} {row['throughput']:>6.2f} {row['llm_calls_per_answer']:>7.2f} "
+            f"{row['llm_429']:>5} {row['llm_timeouts']:>5} {row['command_p95']:>7.2f}"
+        )
+
+
+async def _main(args: argparse.Namespace) -> list[ModeReport]:
+    profile = MockProfile(
+        latency_median_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        rate_429=args.rate_429,
+        retry_after_seconds=args.retry_after,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.llm_timeout + 5,
+        error_rate=args.error_rate,
+        response_words=args.words,
+    )
+    server = MockServer(profile, port=args.port, seed=args.seed).start()
+    corpus = _load_corpus(Path(args.corpus))
+    questions = [corpus[idx % len(corpus)] for idx in range(args.requests)]
+
+    reports: list[ModeReport] = []
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_environment(server, os.path.join(workdir, "bench.sqlite3"), args)
+        from app.http_pool import close_clients
+
+        try:
+            for mode in args.modes.split(","):
+                server.counters.reset()
+                if args.target == "handler":
+                    report = await _run_handler_mode(mode, questions, server, args)
+                else:
+                    report = await _run_pipeline_mode(mode, questions, args)
+                report.upstream = server.counters.snapshot()
+                reports.append(report)
+        finally:
+            await close_clients()
+            server.stop()
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline latency and load benchmark for the answer pipeline.")
+    parser.add_argument("--target", choices=("pipeline", "handler"), default="pipeline")
+    parser.add_argument("--modes", default="fast,balanced,deep")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--corpus", default=str(_CORPUS))
+    parser.add_argument("--latency-ms", type=float, default=MockProfile.latency_median_ms)
+    parser.add_argument("--latency-sigma", type=float, default=MockProfile.latency_sigma)
+    parser.add_argument("--rate-429", type=float, default=MockProfile.rate_429)
+    parser.add_argument("--retry-after", type=float, default=MockProfile.retry_after_seconds)
+    parser.add_argument("--timeout-rate", type=float, default=MockProfile.timeout_rate)
+    parser.add_argument("--error-rate", type=float, default=MockProfile.error_rate)
+    parser.add_argument("--words", type=int, default=MockProfile.response_words)
+    parser.add_argument("--llm-timeout", type=float, default=20.0)
+    parser.add_argument("--commands", type=int, default=50, help="Handler target: /quota commands sent during the run.")
+    parser.add_argument("--command-interval", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--port", type=int, default=0, help="Fixed mock port, so recorded cassettes replay.")
+    parser.add_argument("--json", dest="json_path", default="", help="Also write the summary to this file.")
+    args = parser.parse_args()
+
+    reports = asyncio.run(_main(args))
+    _print_table(reports)
+    if args.json_path:
+        payload = {"args": vars(args), "modes": [report.summary() for report in reports]}
+        Path(args.json_path).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
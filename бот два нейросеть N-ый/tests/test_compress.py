@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import unittest
+
+from app.compress import compress_drafts, scripture_references
+from app.similarity import split_sentences
+
+
+_DRAFTS = [
+    "Бог есть любовь (1 Ин 4:8). Любовь долготерпит и милосердствует (1 Кор. 13:4). "
+    "Молитва укрепляет душу в трудные дни. Прощение освобождает сердце от обиды.",
+    "Любовь долготерпит, милосердствует (1 Кор. 13:4). Так возлюбил Бог мир (Ин 3:16). "
+    "Пост учит воздержанию и смирению перед Богом. Милостыня совершается втайне.",
+    "Если прощаете людям, простит и вам Отец (Матфея 6:14-15). Молитва укрепляет душу в трудные дни. "
+    "Смирение есть начало всякой добродетели в жизни христианина.",
+]
+_REFERENCES = {"1ин4:8", "1кор.13:4", "ин3:16", "матфея6:14-15"}
+
+
+def _references(drafts: list[str]) -> frozenset[str]:
+    return scripture_references("\n".join(drafts))
+
+
+class CompressDraftsTest(unittest.TestCase):
+    def test_abbreviated_book_name_does_not_split_the_reference(self) -> None:
+        self.assertEqual(
+            split_sentences("Любовь долготерпит (1 Кор. 13:4). Так сказано."),
+            ["Любовь долготерпит (1 Кор. 13:4).", "Так сказано."],
+        )
+
+    def test_duplicates_dropped_and_references_kept_under_a_loose_budget(self) -> None:
+        result = compress_drafts(_DRAFTS, token_budget=1000)
+        self.assertEqual(_references(_DRAFTS), _REFERENCES)
+        self.assertEqual(_references(result.drafts), _REFERENCES)
+        self.assertGreater(result.dropped_sentences, 0)
+        self.assertLess(result.tokens_after, result.tokens_before)
+        self.assertEqual("\n".join(result.drafts).count("Молитва укрепляет душу"), 1)
+
+    def test_over_budget_keeps_references_first_and_fits(self) -> None:
+        result = compress_drafts(_DRAFTS, token_budget=70)
+        self.assertLessEqual(result.tokens_after, 70)
+        self.assertEqual(_references(result.drafts), _REFERENCES)
+
+    def test_budget_is_respected_at_every_size(self) -> None:
+        for budget in range(25, 200, 5):
+            with self.subTest(budget=budget):
+                self.assertLessEqual(compress_drafts(_DRAFTS, token_budget=budget).tokens_after, budget)
+
+    def test_tiny_budget_still_keeps_one_sentence(self) -> None:
+        result = compress_drafts(_DRAFTS, token_budget=1)
+        self.assertEqual(len(result.drafts), 1)
+        self.assertEqual(len(split_sentences(result.drafts[0])), 1)
+
+    def test_single_draft_is_left_alone(self) -> None:
+        result = compress_drafts(_DRAFTS[:1], token_budget=1)
+        self.assertEqual(result.drafts, _DRAFTS[:1])
+        self.assertEqual(result.dropped_sentences, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
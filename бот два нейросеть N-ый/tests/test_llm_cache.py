@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from app.http_pool import close_clients
+from app.llm_cache import CacheSettings, ResponseCache
+from app.llm_client import LLMClient
+from app.storage import BotStorage
+from bench.mock_server import MockProfile, MockServer
+
+
+def _key(prompt: str, key_hash: str = "hash") -> str:
+    messages = [{"role": "user", "content": prompt}]
+    return ResponseCache.make_key("http://llm/v1/chat/completions", key_hash, "model", messages, 0.2, 900)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = BotStorage(str(Path(directory.name) / "bot.sqlite3"))
+
+    def test_key_depends_on_the_api_key(self) -> None:
+        self.assertNotEqual(_key("hi", "first"), _key("hi", "second"))
+        self.assertEqual(_key("hi", "first"), _key("hi", "first"))
+
+    def test_memory_tier_evicts_least_recently_used(self) -> None:
+        cache = ResponseCache(None, CacheSettings(max_entries=2))
+        cache.put(_key("a"), "A")
+        cache.put(_key("b"), "B")
+        self.assertEqual(cache.get(_key("a")), "A")
+        cache.put(_key("c"), "C")
+        self.assertIsNone(cache.get(_key("b")))
+        self.assertEqual(cache.get(_key("a")), "A")
+        self.assertEqual(cache.get(_key("c")), "C")
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_evicted_entry_falls_through_to_sqlite(self) -> None:
+        cache = ResponseCache(self.storage, CacheSettings(max_entries=1))
+        cache.put(_key("a"), "A")
+        cache.put(_key("b"), "B")
+        self.assertEqual(cache.get(_key("a")), "A")
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+
+        restarted = ResponseCache(self.storage, CacheSettings())
+        self.assertEqual(restarted.get(_key("b")), "B")
+        self.assertEqual(restarted.get(_key("b")), "B")
+        self.assertEqual(restarted.stats(), {"memory_hits": 1, "disk_hits": 1, "misses": 0, "entries": 1})
+
+    def test_expired_entries_miss_in_both_tiers(self) -> None:
+        cache = ResponseCache(self.storage, CacheSettings(ttl_seconds=60))
+        with mock.patch("app.llm_cache.time.time", return_value=1000.0):
+            cache.put(_key("a"), "A")
+            self.assertEqual(cache.get(_key("a")), "A")
+        with mock.patch("app.llm_cache.time.time", return_value=1061.0):
+            self.assertIsNone(cache.get(_key("a")))
+        self.assertIsNone(ResponseCache(self.storage, CacheSettings()).get(_key("a")))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class CachedChatTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = MockServer(MockProfile(latency_median_ms=5, latency_sigma=0.01, response_words=5)).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.stop()
+
+    async def asyncSetUp(self) -> None:
+        self.server.counters.reset()
+        self.cache = ResponseCache(None, CacheSettings())
+
+    async def asyncTearDown(self) -> None:
+        await close_clients()
+
+    def _client(self, api_key: str = "test-key") -> LLMClient:
+        return LLMClient(f"{self.server.base_url}/v1", api_key, "test/model", timeout_seconds=5, cache=self.cache)
+
+    async def _ask(self, llm: LLMClient, cache: bool) -> str:
+        return await llm.chat([{"role": "user", "content": "hi"}], 0.2, cache=cache)
+
+    async def test_only_calls_marked_cacheable_are_cached(self) -> None:
+        llm = self._client()
+        await self._ask(llm, cache=False)
+        await self._ask(llm, cache=False)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.assertEqual(self.server.counters.llm_calls, 2)
+
+        first = await self._ask(llm, cache=True)
+        self.assertEqual(await self._ask(llm, cache=True), first)
+        self.assertEqual(self.server.counters.llm_calls, 3)
+        self.assertEqual(self.cache.stats()["memory_hits"], 1)
+
+    async def test_another_api_key_does_not_share_entries(self) -> None:
+        await self._ask(self._client("first-key"), cache=True)
+        await self._ask(self._client("second-key"), cache=True)
+        self.assertEqual(self.server.counters.llm_calls, 2)
+        self.assertEqual(self.cache.stats()["entries"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+import unittest
+
+from app.http_pool import close_clients
+from app.llm_client import LLMClient
+from app.rate_limit import LimiterSettings, configure_limits, get_limiter
+from bench.mock_server import MockProfile, MockServer
+
+
+class CancelledRequestTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = MockServer(MockProfile(latency_median_ms=400, latency_sigma=0.01)).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.stop()
+
+    async def asyncSetUp(self) -> None:
+        configure_limits(LimiterSettings(max_concurrency=1, queue_timeout_seconds=5))
+        self.cancelled: list[tuple[str, str]] = []
+        self.llm = LLMClient(
+            f"{self.server.base_url}/v1",
+            "test-key",
+            "test/model",
+            timeout_seconds=5,
+            on_request_cancelled=lambda model, stage: self.cancelled.append((model, stage)),
+        )
+
+    async def asyncTearDown(self) -> None:
+        await close_clients()
+        configure_limits(LimiterSettings())
+
+    async def _cancel_after(self, seconds: float, coalesce: bool = True) -> None:
+        messages = [{"role": "user", "content": "hi"}]
+        task = asyncio.create_task(self.llm.chat(messages, 0.2, stage="agent", coalesce=coalesce))
+        await asyncio.sleep(seconds)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        # A coalesced call is cancelled after its last waiter leaves, one loop step later.
+        await asyncio.sleep(0.05)
+
+    async def test_request_cancelled_after_sending_is_reported(self) -> None:
+        await self._cancel_after(0.1)
+        self.assertEqual(self.cancelled, [("test/model", "agent")])
+
+    async def test_uncoalesced_request_cancelled_after_sending_is_reported(self) -> None:
+        await self._cancel_after(0.1, coalesce=False)
+        self.assertEqual(self.cancelled, [("test/model", "agent")])
+
+    async def test_request_cancelled_in_limiter_queue_is_not_reported(self) -> None:
+        limiter = get_limiter(self.llm._url, "test-key", "test/model")
+        await limiter.acquire()
+        try:
+            await self._cancel_after(0.1)
+        finally:
+            limiter.release()
+        self.assertEqual(self.cancelled, [])
+
+    async def test_completed_request_is_not_reported_as_cancelled(self) -> None:
+        await self.llm.chat([{"role": "user", "content": "hi"}], 0.2, stage="agent")
+        self.assertEqual(self.cancelled, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import unittest
+
+from app.model_health import HealthSettings, ModelHealth
+
+
+class RankingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.health = ModelHealth()
+        for _ in range(5):
+            self.health.record_success("endpoint", "good", 2.0)
+        for _ in range(2):
+            self.health.record_failure("endpoint", "bad", 5.0)
+        self.health.record_success("endpoint", "bad", 5.0)
+
+    def test_unknown_model_ranks_between_proven_and_failing(self) -> None:
+        self.assertEqual(self.health.ranked("endpoint", ["new", "bad", "good"]), ["good", "new", "bad"])
+
+    def test_unknown_model_loses_ties_to_a_proven_one(self) -> None:
+        self.assertEqual(self.health.ranked("endpoint", ["new", "good"]), ["good", "new"])
+
+    def test_all_unknown_keeps_pool_order(self) -> None:
+        self.assertEqual(self.health.ranked("other", ["b", "a", "c"]), ["b", "a", "c"])
+
+    def test_records_are_per_endpoint(self) -> None:
+        self.assertFalse(self.health.has_record("other", "good"))
+        self.assertTrue(self.health.has_record("endpoint", "good"))
+
+
+class SlowCallTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.health = ModelHealth(HealthSettings(failure_threshold=2, slow_call_seconds=60.0))
+
+    def test_slow_complete_call_counts_as_failure(self) -> None:
+        for _ in range(2):
+            self.health.record_success("endpoint", "model", 90.0, "agent")
+        self.assertEqual(self.health.state("endpoint", "model"), "open")
+
+    def test_long_stream_with_quick_first_token_is_a_success(self) -> None:
+        for _ in range(2):
+            self.health.record_success("endpoint", "model", 90.0, "synthesize", first_token=1.5)
+        self.assertEqual(self.health.state("endpoint", "model"), "closed")
+        self.assertEqual(self.health.success_rate("endpoint", "model"), 1.0)
+
+    def test_slow_first_token_still_counts_as_failure(self) -> None:
+        for _ in range(2):
+            self.health.record_success("endpoint", "model", 95.0, "synthesize", first_token=70.0)
+        self.assertEqual(self.health.state("endpoint", "model"), "open")
+
+
+if __name__ == "__main__":
+    unittest.main()
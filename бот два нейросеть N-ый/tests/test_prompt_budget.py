@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import unittest
+
+from app.prompt_budget import estimate_tokens, fit_sections
+
+
+def _sections() -> dict[str, str]:
+    return {
+        "system": "Ты помощник.",
+        "history": "история " * 200,
+        "web": "поиск " * 200,
+        "drafts": "черновик " * 200,
+        "style": "стиль " * 50,
+        "question": "Что говорит Писание о прощении? " * 10,
+    }
+
+
+def _total(sections: dict[str, str]) -> int:
+    return sum(estimate_tokens(text) for text in sections.values())
+
+
+class FitSectionsTest(unittest.TestCase):
+    def test_prompt_within_budget_is_untouched(self) -> None:
+        sections = _sections()
+        fitted, trims = fit_sections(sections, _total(sections))
+        self.assertEqual(fitted, sections)
+        self.assertEqual(trims, [])
+
+    def test_lowest_priority_sections_are_trimmed_first(self) -> None:
+        sections = _sections()
+        costs = {name: estimate_tokens(text) for name, text in sections.items()}
+        cases = [
+            (_total(sections) - costs["history"] // 2, ["history"]),
+            (_total(sections) - costs["history"] - costs["web"] // 2, ["history", "web"]),
+            (costs["system"] + costs["question"] + costs["style"] + costs["drafts"] // 2, ["history", "web", "drafts"]),
+            (costs["system"] + costs["question"] + costs["style"] // 2, ["history", "web", "drafts", "style"]),
+        ]
+        for budget, trimmed in cases:
+            with self.subTest(trimmed=trimmed):
+                fitted, trims = fit_sections(sections, budget)
+                self.assertEqual([trim.section for trim in trims], trimmed)
+                self.assertLessEqual(_total(fitted), budget)
+                self.assertEqual(fitted["question"], sections["question"])
+                self.assertEqual(fitted["system"], sections["system"])
+
+    def test_question_is_trimmed_last(self) -> None:
+        sections = _sections()
+        budget = estimate_tokens(sections["system"]) + estimate_tokens(sections["question"]) // 2
+        fitted, trims = fit_sections(sections, budget)
+        self.assertEqual([trim.section for trim in trims], ["history", "web", "drafts", "style", "question"])
+        self.assertLessEqual(_total(fitted), budget)
+        self.assertTrue(sections["question"].startswith(fitted["question"].rstrip("…")))
+
+    def test_question_alone_over_budget_keeps_its_head(self) -> None:
+        sections = _sections()
+        fitted, trims = fit_sections(sections, 10)
+        self.assertEqual(trims[-1].section, "question")
+        self.assertTrue(fitted["question"])
+        self.assertTrue(sections["question"].startswith(fitted["question"].rstrip("…")))
+        for name in ("history", "web", "drafts", "style"):
+            self.assertEqual(fitted[name], "")
+
+    def test_short_question_is_never_cut(self) -> None:
+        sections = {"question": "Кто написал Послание к Римлянам?", "history": "история " * 200}
+        fitted, trims = fit_sections(sections, 5)
+        self.assertEqual(fitted["question"], sections["question"])
+        self.assertEqual([trim.section for trim in trims], ["history"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import unittest
+
+from app.model_health import ModelHealth
+from app.pipeline import _hedge_model, _rotate_model
+
+
+class _HealthView:
+    # The slice of LLMClient the routing helpers use, backed by a private ModelHealth.
+    def __init__(self, health: ModelHealth) -> None:
+        self._health = health
+
+    def model_state(self, model: str) -> str:
+        return self._health.state("endpoint", model)
+
+    def model_proven(self, model: str) -> bool:
+        return self._health.proven("endpoint", model)
+
+    def rank_models(self, models: list[str]) -> list[str]:
+        return self._health.ranked("endpoint", models)
+
+
+class TopUpRotationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        health = ModelHealth()
+        for _ in range(3):
+            health.record_success("endpoint", "fast", 1.0)
+            health.record_success("endpoint", "slow", 8.0)
+        health.record_failure("endpoint", "flaky", 2.0)
+        self.llm = _HealthView(health)
+        self.pool = ["failed", "untried", "flaky", "slow", "fast"]
+
+    def test_rotates_only_among_proven_models_best_first(self) -> None:
+        picks = [_rotate_model(self.llm, "failed", self.pool, offset) for offset in range(4)]
+        self.assertEqual(picks, ["fast", "slow", "fast", "slow"])
+
+    def test_falls_back_to_untried_models_when_none_are_proven(self) -> None:
+        self.assertEqual(_rotate_model(_HealthView(ModelHealth()), "failed", ["failed", "untried"], 0), "untried")
+
+    def test_keeps_the_model_without_alternates(self) -> None:
+        self.assertEqual(_rotate_model(self.llm, "failed", ["failed"], 0), "failed")
+
+    def test_hedge_goes_to_the_best_alternate(self) -> None:
+        self.assertEqual(_hedge_model(self.llm, "slow", self.pool), "fast")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import unittest
+from collections.abc import Hashable
+
+from app.scheduler import FairScheduler, SchedulerFull, SchedulerSettings
+
+
+class FairSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def _scheduler(self, **overrides: float) -> FairScheduler:
+        self.scheduler = FairScheduler(SchedulerSettings(**{"max_running": 1, **overrides}))
+        self.release = asyncio.Event()
+        self.order: list[str] = []
+        self.holder = asyncio.create_task(self._hold())
+        return self.scheduler
+
+    async def _hold(self) -> None:
+        async with self.scheduler.slot("holder"):
+            await self.release.wait()
+
+    async def _job(self, owner: Hashable, tag: str, priority: bool = False) -> None:
+        async with self.scheduler.slot(owner, priority):
+            self.order.append(tag)
+
+    async def _run(self, jobs: list[tuple[Hashable, str, bool]]) -> list[str]:
+        tasks = []
+        for owner, tag, priority in jobs:
+            tasks.append(asyncio.create_task(self._job(owner, tag, priority)))
+            await asyncio.sleep(0)
+        self.release.set()
+        await asyncio.gather(self.holder, *tasks)
+        return self.order
+
+    async def test_owners_take_turns(self) -> None:
+        self._scheduler()
+        jobs = [("alice", "a1", False), ("alice", "a2", False), ("alice", "a3", False)]
+        jobs += [("bob", "b1", False), ("bob", "b2", False)]
+        self.assertEqual(await self._run(jobs), ["a1", "b1", "a2", "b2", "a3"])
+
+    async def test_priority_burst_lets_a_normal_job_through(self) -> None:
+        self._scheduler(priority_burst=2)
+        jobs = [("n", "n1", False), ("n", "n2", False)]
+        jobs += [("p", f"p{number}", True) for number in range(1, 5)]
+        self.assertEqual(await self._run(jobs), ["p1", "p2", "n1", "p3", "p4", "n2"])
+
+    async def test_priority_jobs_run_back_to_back_without_normal_waiters(self) -> None:
+        self._scheduler(priority_burst=1)
+        jobs = [("p", f"p{number}", True) for number in range(1, 4)]
+        self.assertEqual(await self._run(jobs), ["p1", "p2", "p3"])
+
+    async def test_full_queue_rejects_new_waiters(self) -> None:
+        scheduler = self._scheduler(max_waiting=2)
+        queued = [asyncio.create_task(self._job(owner, owner)) for owner in ("a", "b")]
+        await asyncio.sleep(0)
+        with self.assertRaises(SchedulerFull):
+            await self._job("c", "c")
+        self.assertEqual(scheduler.stats()["rejected"], 1)
+        self.release.set()
+        await asyncio.gather(self.holder, *queued)
+        self.assertEqual(self.order, ["a", "b"])
+
+    async def test_waiting_too_long_raises_and_frees_the_place(self) -> None:
+        scheduler = self._scheduler(max_wait_seconds=0.05)
+        await asyncio.sleep(0)
+        with self.assertRaises(SchedulerFull):
+            await self._job("a", "a")
+        self.assertEqual(scheduler.waiting, 0)
+        self.assertEqual(scheduler.stats()["rejected"], 1)
+        self.release.set()
+        await self.holder
+        await self._job("b", "b")
+        self.assertEqual(self.order, ["b"])
+
+    async def test_cancelled_waiter_leaves_the_queue(self) -> None:
+        scheduler = self._scheduler()
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(self._job("a", "a"))
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.waiting, 1)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.waiting, 0)
+        self.release.set()
+        await self.holder
+        self.assertEqual(scheduler.stats()["running"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
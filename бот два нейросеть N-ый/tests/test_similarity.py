@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import unittest
+
+from app.similarity import find_consensus, medoid, similarity_matrix
+
+
+_AGREEING = [
+    "Апостол Павел пишет, что любовь долготерпит и милосердствует, никогда не перестает.",
+    "Павел пишет: любовь долготерпит, милосердствует и никогда не перестает.",
+    "Любовь долготерпит и милосердствует, пишет апостол Павел, она никогда не перестает.",
+]
+_OFF_TOPIC = "Сегодня солнечная погода, температура воздуха поднимется выше двадцати градусов."
+
+
+class FindConsensusTest(unittest.TestCase):
+    def test_near_duplicate_drafts_agree_with_medoid_first(self) -> None:
+        group = find_consensus(_AGREEING + [_OFF_TOPIC], k=3, threshold=0.4)
+        self.assertEqual(sorted(group), [0, 1, 2])
+        self.assertEqual(group[0], medoid(_AGREEING))
+
+    def test_divergent_drafts_have_no_consensus(self) -> None:
+        drafts = [
+            _AGREEING[0],
+            _OFF_TOPIC,
+            "Фотосинтез превращает энергию света в химическую энергию органических веществ.",
+        ]
+        self.assertEqual(find_consensus(drafts, k=2, threshold=0.4), [])
+
+    def test_group_smaller_than_k_is_not_consensus(self) -> None:
+        self.assertEqual(find_consensus(_AGREEING[:2] + [_OFF_TOPIC], k=3, threshold=0.4), [])
+
+    def test_empty_and_short_texts(self) -> None:
+        self.assertEqual(find_consensus([], k=2, threshold=0.4), [])
+        self.assertEqual(find_consensus(["да", "да", "да"], k=2, threshold=0.4), [])
+        self.assertEqual(find_consensus(["", ""], k=2, threshold=0.4), [])
+        self.assertEqual(find_consensus(_AGREEING, k=1, threshold=0.4), [])
+
+    def test_result_is_deterministic(self) -> None:
+        drafts = _AGREEING + [_OFF_TOPIC]
+        self.assertEqual(
+            {tuple(find_consensus(drafts, k=2, threshold=0.4)) for _ in range(5)},
+            {tuple(find_consensus(drafts, k=2, threshold=0.4))},
+        )
+
+
+class MedoidTest(unittest.TestCase):
+    def test_medoid_is_the_most_central_draft(self) -> None:
+        self.assertIn(medoid([_OFF_TOPIC, *_AGREEING]), {1, 2, 3})
+
+    def test_short_inputs_fall_back_to_the_first_draft(self) -> None:
+        self.assertEqual(medoid([]), 0)
+        self.assertEqual(medoid([_OFF_TOPIC, _AGREEING[0]]), 0)
+
+    def test_texts_without_content_words_pick_the_first(self) -> None:
+        self.assertEqual(medoid(["", "и", "да"]), 0)
+
+
+class SimilarityMatrixTest(unittest.TestCase):
+    def test_matrix_is_symmetric_with_unit_diagonal(self) -> None:
+        matrix = similarity_matrix(_AGREEING + [_OFF_TOPIC])
+        for i, row in enumerate(matrix):
+            self.assertEqual(row[i], 1.0)
+            for j, value in enumerate(row):
+                self.assertEqual(value, matrix[j][i])
+        self.assertGreater(matrix[0][1], matrix[0][3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import asyncio
+import unittest
+
+from app.single_flight import SingleFlight
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.flights = SingleFlight()
+        self.release = asyncio.Event()
+        self.calls = 0
+        self.shared: asyncio.Future[str] | None = None
+
+    async def _work(self) -> str:
+        self.calls += 1
+        self.shared = asyncio.current_task()
+        await self.release.wait()
+        return "answer"
+
+    async def test_concurrent_callers_share_one_call(self) -> None:
+        waiters = [asyncio.create_task(self.flights.run("key", self._work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+        self.assertEqual(await asyncio.gather(*waiters), ["answer"] * 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights.stats(), {"leaders": 1, "followers": 2})
+
+    async def test_leader_cancel_leaves_the_follower_its_result(self) -> None:
+        leader = asyncio.create_task(self.flights.run("key", self._work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(self.flights.run("key", self._work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.release.set()
+        self.assertEqual(await follower, "answer")
+        self.assertEqual(self.calls, 1)
+
+    async def test_shared_call_is_cancelled_once_every_waiter_leaves(self) -> None:
+        waiters = [asyncio.create_task(self.flights.run("key", self._work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, asyncio.CancelledError) for result in results))
+        await asyncio.sleep(0)
+        self.assertIsNotNone(self.shared)
+        self.assertTrue(self.shared.cancelled())
+        self.assertEqual(self.flights._flights, {})
+
+    async def test_exception_reaches_every_waiter(self) -> None:
+        async def fail() -> str:
+            await self.release.wait()
+            raise ValueError("upstream down")
+
+        waiters = [asyncio.create_task(self.flights.run("key", fail)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        self.assertEqual([type(result) for result in results], [ValueError] * 3)
+        self.assertEqual(self.flights.stats(), {"leaders": 1, "followers": 2})
+
+    async def test_finished_flight_is_not_reused(self) -> None:
+        self.release.set()
+        await self.flights.run("key", self._work)
+        await self.flights.run("key", self._work)
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()